@@ -0,0 +1,183 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from google.api_core.exceptions import (
+	Aborted,
+	DeadlineExceeded,
+	InternalServerError,
+	ResourceExhausted,
+	ServiceUnavailable,
+)
+from google.cloud.firestore_v1 import Client, DocumentReference
+
+from core.instrumentation import timed
+
+FIRESTORE_WRITE_WORKERS: int = settings.FIRESTORE_WRITE_WORKERS
+RETRYABLE_ERRORS = (Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable)
+
+
+def document_size(value) -> int:
+	"""Estimated Firestore storage size of a value, as in https://firebase.google.com/docs/firestore/storage-size"""
+	if value is None or isinstance(value, bool):
+		return 1
+	if isinstance(value, (int, float, datetime)):
+		return 8
+	if isinstance(value, str):
+		return len(value.encode('utf-8')) + 1
+	if isinstance(value, (bytes, bytearray)):
+		return len(value)
+	if isinstance(value, dict):
+		return sum(len(key.encode('utf-8')) + 1 + document_size(item) for key, item in value.items())
+	if isinstance(value, (list, tuple)):
+		return sum(document_size(item) for item in value)
+	return 16
+
+
+class BatchWriter:
+	"""
+	Firestore writes grouped into batches, each committed once it reaches `max_operations` or `max_bytes`.
+	Up to `max_workers` batches commit at once and retry on transient errors,
+	so batches may land in any order unless separated by `wait`.
+
+	Made per call and used as a context manager, which commits the rest and raises the first failed commit:
+
+		with BatchWriter() as writer:
+			writer.set(ref, data)
+	"""
+
+	MAX_OPERATIONS = 500
+	# Firestore rejects requests over 10 MiB, leaving room for the document names and request overhead
+	MAX_BYTES = 9 * 1024 * 1024
+
+	def __init__(
+		self,
+		client: Client = None,
+		max_operations: int = MAX_OPERATIONS,
+		max_bytes: int = MAX_BYTES,
+		max_workers: int = FIRESTORE_WRITE_WORKERS,
+		retries: int = 3,
+		backoff: float = 0.5,
+	):
+		self.__client = client if client is not None else settings.FIREBASE
+		self.max_operations = max_operations
+		self.max_bytes = max_bytes
+		self.max_workers = max_workers
+		self.retries = retries
+		self.backoff = backoff
+
+		self.operations = 0
+		self.batches = 0
+		self.__pending: list[tuple[str, DocumentReference, dict | None, dict]] = []
+		self.__pending_bytes = 0
+		self.__futures: list[Future] = []
+		self.__executor: ThreadPoolExecutor | None = None
+		# Bounds the batches waiting for a worker, holding back callers that produce faster than Firestore takes
+		self.__slots = threading.BoundedSemaphore(max(1, max_workers) * 2)
+		self.__lock = threading.Lock()
+		self.__count_lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.wait(raise_errors=False)
+			self.__shutdown()
+
+	def set(self, ref: DocumentReference, data: dict, merge=False):
+		self.__add('set', ref, data, {'merge': merge}, document_size(data))
+
+	def update(self, ref: DocumentReference, data: dict):
+		self.__add('update', ref, data, {}, document_size(data))
+
+	def delete(self, ref: DocumentReference):
+		self.__add('delete', ref, None, {}, 0)
+
+	def __add(self, operation: str, ref: DocumentReference, data: dict | None, options: dict, size: int):
+		size += len(ref.path.encode('utf-8')) + 16
+		with self.__lock:
+			if len(self.__pending) > 0 and self.__pending_bytes + size > self.max_bytes:
+				self.__flush()
+
+			self.__pending.append((operation, ref, data, options))
+			self.__pending_bytes += size
+			if len(self.__pending) >= self.max_operations:
+				self.__flush()
+
+	def flush(self):
+		"""Start committing the writes added so far"""
+		with self.__lock:
+			self.__flush()
+
+	def __flush(self):
+		if len(self.__pending) == 0:
+			return
+
+		pending = self.__pending
+		self.__pending = []
+		self.__pending_bytes = 0
+
+		if self.max_workers <= 1:
+			self.__commit(pending)
+			return
+
+		if self.__executor is None:
+			self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='batch-writer')
+		self.__slots.acquire()
+		# In a copy of the context, so that the commit is timed as part of the request writing
+		future = self.__executor.submit(contextvars.copy_context().run, self.__commit, pending)
+		future.add_done_callback(lambda _: self.__slots.release())
+		self.__futures.append(future)
+
+	@timed('firestore_write')
+	def __commit(self, pending: list[tuple[str, DocumentReference, dict | None, dict]]):
+		for attempt in range(self.retries + 1):
+			batch = self.__client.batch()
+			for operation, ref, data, options in pending:
+				if operation == 'delete':
+					batch.delete(ref)
+				else:
+					getattr(batch, operation)(ref, data, **options)
+
+			try:
+				batch.commit()
+				break
+			except RETRYABLE_ERRORS:
+				if attempt == self.retries:
+					raise
+				time.sleep(self.backoff * 2**attempt)
+
+		with self.__count_lock:
+			self.operations += len(pending)
+			self.batches += 1
+
+	def wait(self, raise_errors=True):
+		"""Commit the pending writes and wait for every commit started so far"""
+		self.flush()
+		with self.__lock:
+			futures = self.__futures
+			self.__futures = []
+
+		error = None
+		for future in futures:
+			if future.exception() is not None and error is None:
+				error = future.exception()
+		if error is not None and raise_errors:
+			raise error
+
+	def close(self):
+		try:
+			self.wait()
+		finally:
+			self.__shutdown()
+
+	def __shutdown(self):
+		if self.__executor is not None:
+			self.__executor.shutdown(wait=True)
+			self.__executor = None
@@ -0,0 +1,186 @@
+import fcntl
+import os
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from api_v2.candle_store import CandleStore
+from machd.utils import log_error
+
+CANDLE_ARENA_NAME: str = settings.CANDLE_ARENA_NAME
+CANDLE_ARENA_SYMBOLS: list[str] = settings.CANDLE_ARENA_SYMBOLS
+CANDLE_ARENA_REFRESH_SECONDS: int = settings.CANDLE_ARENA_REFRESH_SECONDS
+DEFAULT_TIMEFRAME: str = settings.DEFAULT_TIMEFRAME
+DEFAULT_PLATFORM: str = settings.DEFAULT_PLATFORM
+GENERATIONS_FILE = 'generations'
+LOCK_FILE = 'owner.lock'
+
+
+def shared_directory(name: str) -> Path:
+	"""Directory of an arena in shared memory, `/dev/shm` being a tmpfs on Linux"""
+	root = Path('/dev/shm')
+	return (root if root.is_dir() else Path(tempfile.gettempdir())) / name
+
+
+class CandleArena:
+	"""
+	Candles of hot pairs shared by the server processes of a host, kept as `CandleStore` files in shared memory.
+
+	The arena is created by the first process, e.g. the gunicorn master with `--preload` before it forks,
+	and attached by name by the others. Whichever process holds the lock of the arena refreshes the candles,
+	replacing the file of a series before increasing its generation counter, which every process maps.
+	Other processes only reopen a file when its generation changed, and read views of it without copying,
+	while the views they already hold stay valid as a replaced file is only unlinked.
+	"""
+
+	def __init__(
+		self,
+		name: str,
+		symbols: list[str],
+		timeframe: str = DEFAULT_TIMEFRAME,
+		platform: str = DEFAULT_PLATFORM,
+		refresh: float = CANDLE_ARENA_REFRESH_SECONDS,
+		directory: Path | str | None = None,
+		sources: Callable[[str, str, str], object] | None = None,
+	):
+		self.enabled = name != '' and len(symbols) > 0
+		self.directory = Path(directory) if directory is not None else shared_directory(name)
+		self.refresh_seconds = refresh
+		self.series = [(symbol, timeframe, platform) for symbol in symbols]
+		self.__slots = {series: slot for slot, series in enumerate(self.series)}
+		self.__sources = sources
+		self.__generations: np.memmap | None = None
+		self.__arrays: dict[int, tuple[int, np.ndarray]] = {}
+		self.__lock_file = None
+		self.__pid: int | None = None
+		self.__stop = threading.Event()
+		self.__guard = threading.Lock()
+
+	def has(self, symbol: str, timeframe: str, platform: str) -> bool:
+		return self.enabled and (symbol, timeframe, platform) in self.__slots
+
+	def create(self):
+		"""Create the arena unless another process has, and map its generation counters"""
+		with self.__guard:
+			if self.__generations is not None:
+				return
+
+			self.directory.mkdir(parents=True, exist_ok=True)
+			path = self.directory / GENERATIONS_FILE
+			size = len(self.series) * np.dtype(np.int64).itemsize
+			if not path.exists() or path.stat().st_size != size:
+				# Written aside and renamed, so that no process maps a partial file
+				temp_path = path.with_name(f'.{GENERATIONS_FILE}.{os.getpid()}.tmp')
+				temp_path.write_bytes(bytes(size))
+				os.replace(temp_path, path)
+			self.__generations = np.memmap(path, dtype=np.int64, mode='r+', shape=(len(self.series),))
+
+	def generation(self, symbol: str, timeframe: str, platform: str) -> int:
+		"""Counter increased by every refresh changing the candles of the series, 0 until they are loaded"""
+		if not self.has(symbol, timeframe, platform):
+			return 0
+		self.create()
+		return int(self.__generations[self.__slots[(symbol, timeframe, platform)]])
+
+	def read(
+		self,
+		symbol: str,
+		timeframe: str,
+		platform: str,
+		start_time: int | None = None,
+		end_time: int | None = None,
+	) -> pd.DataFrame | None:
+		"""Candles from `start_time` and before `end_time` in ms, `None` while the arena does not hold the series"""
+		if not self.has(symbol, timeframe, platform):
+			return None
+
+		self.start()
+		generation = self.generation(symbol, timeframe, platform)
+		if generation == 0:
+			return None
+
+		slot = self.__slots[(symbol, timeframe, platform)]
+		cached = self.__arrays.get(slot)
+		if cached is None or cached[0] != generation:
+			# A later refresh may already have replaced the file, which is then reloaded on the next read
+			cached = (generation, self.__store(slot).load())
+			self.__arrays[slot] = cached
+		return CandleStore.frame(cached[1], start_time, end_time)
+
+	def refresh(self) -> int:
+		"""Sync every series from Firestore and publish the changed ones, returning the candles fetched"""
+		self.create()
+		fetched = 0
+		for slot in range(len(self.series)):
+			store = self.__store(slot)
+			try:
+				count = store.sync()
+			except Exception:
+				error = traceback.format_exc()
+				log_error({'message': 'Candle arena refresh failed', 'series': self.series[slot], 'error': error})
+				continue
+
+			fetched += count
+			# The file may also be left by a previous owner, with the counters of a new arena
+			if count > 0 or (self.__generations[slot] == 0 and store.version() is not None):
+				self.__generations[slot] += 1
+		return fetched
+
+	def owner(self) -> bool:
+		"""Whether this process owns the refreshes, taking them over if no other process does"""
+		with self.__guard:
+			if self.__lock_file is not None:
+				return True
+
+			self.directory.mkdir(parents=True, exist_ok=True)
+			lock_file = open(self.directory / LOCK_FILE, 'a')
+			try:
+				# Released by the system if the process dies
+				fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				lock_file.close()
+				return False
+			self.__lock_file = lock_file
+			return True
+
+	def start(self):
+		"""Start the refresh thread of this process, which refreshes while it owns the arena"""
+		if not self.enabled or self.__pid == os.getpid():
+			return
+
+		with self.__guard:
+			# A thread started before a fork is not running in the child
+			if self.__pid == os.getpid():
+				return
+			self.__pid = os.getpid()
+			self.__lock_file = None
+			self.__stop = threading.Event()
+			threading.Thread(target=self.__run, args=(self.__stop,), name='candle-arena', daemon=True).start()
+
+	def close(self):
+		with self.__guard:
+			self.__stop.set()
+			self.__pid = None
+			if self.__lock_file is not None:
+				self.__lock_file.close()
+				self.__lock_file = None
+
+	def __run(self, stop: threading.Event):
+		while not stop.is_set():
+			if self.owner():
+				self.refresh()
+			stop.wait(self.refresh_seconds)
+
+	def __store(self, slot: int) -> CandleStore:
+		symbol, timeframe, platform = self.series[slot]
+		source = self.__sources(symbol, timeframe, platform) if self.__sources is not None else None
+		return CandleStore(symbol, timeframe, platform, directory=self.directory, source=source)
+
+
+CANDLE_ARENA = CandleArena(CANDLE_ARENA_NAME, CANDLE_ARENA_SYMBOLS)
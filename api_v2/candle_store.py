@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from api_v2.firebase import FirebaseCandle, Platform
+
+DEFAULT_PLATFORM: str = settings.DEFAULT_PLATFORM
+CANDLE_STORE_DIR: Path | None = settings.CANDLE_STORE_DIR
+TIMESTAMP_MS_THRES = FirebaseCandle.TIMESTAMP_MS_THRES
+OHLC_COLUMNS = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class CandleStore:
+	"""
+	Local columnar copy of the Firestore candles of a pair and timeframe, read through a memory map.
+
+	The candles are kept in a single `.npy` file as a `6 x n` float64 array with a row per column of `OHLC_COLUMNS`,
+	the open times being stored as int64 bit patterns read back with `.view(np.int64)`.
+	A sync writes a temporary file and renames it over the old one, so readers never see a partial file.
+	"""
+
+	_guard = threading.Lock()
+	_locks: dict[Path, threading.Lock] = {}
+	_maps: dict[Path, tuple[tuple[int, int], np.ndarray]] = {}
+	_synced: dict[Path, float] = {}
+
+	def __init__(self, token_pair: str, timeframe: str, platform=DEFAULT_PLATFORM, directory=None, source=None):
+		if isinstance(platform, Platform):
+			platform = platform.value
+		directory = directory if directory is not None else CANDLE_STORE_DIR
+		if directory is None:
+			raise ValueError('Candle store directory is not set!')
+
+		self.path = Path(directory) / token_pair / f'{platform}_{timeframe}.npy'
+		self.__token_pair = token_pair
+		self.__timeframe = timeframe
+		self.__platform = platform
+		self.__source = source
+
+	@property
+	def source(self):
+		"""Where the candles are synced from, `FirebaseCandle` unless given"""
+		if self.__source is None:
+			self.__source = FirebaseCandle(self.__token_pair, self.__timeframe, self.__platform)
+		return self.__source
+
+	def __lock(self):
+		with self._guard:
+			return self._locks.setdefault(self.path, threading.Lock())
+
+	def version(self) -> tuple[int, int] | None:
+		"""Inode and modification time of the store file, changed by every sync that writes"""
+		try:
+			stat = os.stat(self.path)
+		except FileNotFoundError:
+			return None
+		return stat.st_ino, stat.st_mtime_ns
+
+	def load(self) -> np.ndarray[np.float64]:
+		"""Memory map of the stored array, reopened only when the file has been replaced"""
+		version = self.version()
+		if version is None:
+			return np.empty((len(OHLC_COLUMNS), 0), dtype=np.float64)
+
+		cached = self._maps.get(self.path)
+		if cached is not None and cached[0] == version:
+			return cached[1]
+
+		array = np.load(self.path, mmap_mode='r')
+		self._maps[self.path] = (version, array)
+		return array
+
+	def open_times(self) -> np.ndarray[np.int64]:
+		return self.load()[0].view(np.int64)
+
+	def watermark(self) -> int | None:
+		"""Open time of the last stored candle"""
+		open_times = self.open_times()
+		return int(open_times[-1]) if len(open_times) > 0 else None
+
+	def read(self, start_time: int | None = None, end_time: int | None = None) -> pd.DataFrame:
+		"""
+		Candles with an open time from `start_time` and before `end_time` in ms.
+		The columns are views of the memory map, nothing is copied.
+		"""
+		return self.frame(self.load(), start_time, end_time)
+
+	@staticmethod
+	def frame(array: np.ndarray[np.float64], start_time: int | None = None, end_time: int | None = None):
+		"""Candles of a store array from `start_time` and before `end_time` in ms, as views of the array"""
+		open_times = array[0].view(np.int64)
+		start = np.searchsorted(open_times, start_time, side='left') if start_time is not None else 0
+		end = np.searchsorted(open_times, end_time, side='left') if end_time is not None else len(open_times)
+
+		df = pd.DataFrame(array[1:, start:end].T, columns=OHLC_COLUMNS[1:], copy=False)
+		df.insert(0, OHLC_COLUMNS[0], open_times[start:end])
+		return df
+
+	def sync(self, max_age: float | None = None) -> int:
+		"""
+		Fetch the candles from the watermark onwards and merge them into the store.
+		The last stored candle is fetched again as it may have been saved before it closed.
+		Skipped if the store has been synced in this process within `max_age` seconds.
+		Return the number of candles fetched.
+		"""
+		if max_age is not None and time.monotonic() - self._synced.get(self.path, -np.inf) < max_age:
+			return 0
+
+		with self.__lock():
+			if max_age is not None and time.monotonic() - self._synced.get(self.path, -np.inf) < max_age:
+				return 0
+
+			stored = self.load()
+			watermark = self.watermark()
+			fetched = self.to_array(self.source.fetch_since(watermark))
+
+			if fetched.shape[1] > 0:
+				if watermark is not None:
+					stored = stored[:, stored[0].view(np.int64) < watermark]
+				self.write(self.merge(stored, fetched))
+
+			self._synced[self.path] = time.monotonic()
+			return fetched.shape[1]
+
+	def write(self, array: np.ndarray[np.float64]):
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		temp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+		with open(temp_path, 'wb') as file:
+			np.save(file, np.ascontiguousarray(array, dtype=np.float64))
+		os.replace(temp_path, self.path)
+
+	@staticmethod
+	def merge(stored: np.ndarray[np.float64], fetched: np.ndarray[np.float64]) -> np.ndarray[np.float64]:
+		"""Candles of both arrays sorted by open time, a fetched candle replacing a stored one at the same time"""
+		array = np.concatenate((stored, fetched), axis=1)
+		open_times = array[0].view(np.int64)
+		order = np.argsort(open_times, kind='stable')
+		sorted_times = open_times[order]
+		is_last = np.append(sorted_times[1:] != sorted_times[:-1], True)
+		return array[:, order[is_last]]
+
+	@staticmethod
+	def to_array(candles: list[dict] | pd.DataFrame) -> np.ndarray[np.float64]:
+		"""`6 x n` store array of candles, open times in seconds are converted to ms"""
+		array = np.empty((len(OHLC_COLUMNS), len(candles)), dtype=np.float64)
+		if len(candles) == 0:
+			return array
+
+		df = pd.DataFrame(candles, columns=OHLC_COLUMNS)
+		open_times = df[OHLC_COLUMNS[0]].to_numpy(np.int64)
+		open_times = np.where(open_times < TIMESTAMP_MS_THRES, open_times * 1000, open_times)
+		array[0] = open_times.view(np.float64)
+		array[1:] = df[OHLC_COLUMNS[1:]].astype(np.float64).to_numpy().T
+		return array
@@ -1,4 +1,7 @@
+import hashlib
 import math
+import struct
+import zlib
 from datetime import datetime, timedelta
 from decimal import Decimal
 from enum import Enum
@@ -8,16 +11,153 @@ import numpy as np
 import pytz
 from django.conf import settings
 from django.utils import timezone
-from google.cloud.firestore_v1 import Client, CollectionReference, DocumentReference, WriteBatch
+from google.cloud.firestore_v1 import Client, CollectionReference, DocumentReference, DocumentSnapshot
 from google.cloud.firestore_v1.base_query import FieldFilter
-from pandas import DataFrame
+from pandas import DataFrame, concat
 
+from api_v2.batch_writer import BatchWriter
+from api_v2.kline_cache import KLINE_CACHE
+from api_v2.parallel_reader import PARALLEL_READER, Partition
+from api_v2.symbol_registry import SymbolRegistry
 from core.calculations import calculate
 from core.exceptions import NotEnoughTokenException
 
 FIREBASE: Client = settings.FIREBASE
-DB_BATCH: WriteBatch = settings.DB_BATCH
 INTERVAL_MAP: dict[str, int] = settings.INTERVAL_MAP
+CANDLE_PACKED: bool = settings.CANDLE_PACKED
+CANDLE_BUCKETS: dict[str, str] = settings.CANDLE_BUCKETS
+DEFAULT_TIMEFRAME: str = settings.DEFAULT_TIMEFRAME
+DEFAULT_PLATFORM: str = settings.DEFAULT_PLATFORM
+SYMBOL_REGISTRY_LISTEN: bool = settings.SYMBOL_REGISTRY_LISTEN
+FIRESTORE_READ_PARTITIONS: int = settings.FIRESTORE_READ_PARTITIONS
+FIRESTORE_READ_MIN_BUCKETS: int = settings.FIRESTORE_READ_MIN_BUCKETS
+BUCKET_MIN_DAYS = {'day': 1, 'week': 7, 'month': 28}
+CANDLE_COLUMNS = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+PACKED_FIELD = 'packed'
+HASH_FIELD = 'hash'
+SERIES_FIELD = 'series'
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct('<BI')
+
+
+def pack_candles(candles: DataFrame) -> bytes:
+	"""
+	Candles as a version and count header followed by a zlib compressed body of
+	delta encoded int64 open times and the float64 columns one after another
+	"""
+	open_times = candles[CANDLE_COLUMNS[0]].to_numpy(np.int64)
+	prices = candles[CANDLE_COLUMNS[1:]].astype(np.float64).to_numpy().T
+	body = np.diff(open_times, prepend=0).astype('<i8').tobytes() + prices.astype('<f8').tobytes()
+	return PACKED_HEADER.pack(PACKED_VERSION, len(open_times)) + zlib.compress(body)
+
+
+def _unpack_arrays(packed: bytes) -> tuple[np.ndarray[np.int64], np.ndarray[np.float64]]:
+	version, count = PACKED_HEADER.unpack_from(packed)
+	if version != PACKED_VERSION:
+		raise ValueError(f'Unknown packed candle version {version}!')
+
+	body = zlib.decompress(packed[PACKED_HEADER.size :])
+	open_times = np.cumsum(np.frombuffer(body, dtype='<i8', count=count))
+	prices = np.frombuffer(body, dtype='<f8', offset=count * 8).reshape(len(CANDLE_COLUMNS) - 1, count)
+	return open_times, prices
+
+
+def _candle_frame(open_times: np.ndarray[np.int64], prices: np.ndarray[np.float64]) -> DataFrame:
+	return DataFrame({CANDLE_COLUMNS[0]: open_times, **dict(zip(CANDLE_COLUMNS[1:], prices))})
+
+
+def unpack_candles(packed: bytes) -> DataFrame:
+	return _candle_frame(*_unpack_arrays(packed))
+
+
+def candle_hash(candles: DataFrame) -> str:
+	"""Digest of the open times and prices of candles, missing values all hashing the same"""
+	digest = hashlib.blake2b(digest_size=16)
+	digest.update(candles[CANDLE_COLUMNS[0]].to_numpy(np.int64).tobytes())
+	prices = candles[CANDLE_COLUMNS[1:]].astype(np.float64).to_numpy()
+	digest.update(np.where(np.isnan(prices), np.nan, prices).tobytes())
+	return digest.hexdigest()
+
+
+def bucket_candles(days: list[dict]) -> DataFrame:
+	"""Candles of bucket documents in either encoding, packed ones are joined as arrays before building the frame"""
+	if not any(PACKED_FIELD in day for day in days):
+		return DataFrame([candle for day in days for candle in day['candles']])
+	return _candle_frame(*bucket_arrays(days))
+
+
+def bucket_arrays(days: list[dict]) -> tuple[np.ndarray[np.int64], np.ndarray[np.float64]]:
+	"""Open times and `5 x n` prices of bucket documents in either encoding"""
+	if len(days) == 0:
+		return np.empty(0, dtype=np.int64), np.empty((len(CANDLE_COLUMNS) - 1, 0), dtype=np.float64)
+
+	open_times = []
+	prices = []
+	for day in days:
+		if PACKED_FIELD in day:
+			day_open_times, day_prices = _unpack_arrays(day[PACKED_FIELD])
+		else:
+			candles = DataFrame(day['candles'], columns=CANDLE_COLUMNS)
+			day_open_times = candles[CANDLE_COLUMNS[0]].to_numpy(np.int64)
+			day_prices = candles[CANDLE_COLUMNS[1:]].astype(np.float64).to_numpy().T
+		open_times.append(day_open_times)
+		prices.append(day_prices)
+	return np.concatenate(open_times), np.concatenate(prices, axis=1)
+
+
+def merge_arrays(
+	parts: list[tuple[np.ndarray[np.int64], np.ndarray[np.float64]]],
+) -> tuple[np.ndarray[np.int64], np.ndarray[np.float64]]:
+	"""`bucket_arrays` of consecutive partitions copied one after another into arrays allocated once"""
+	count = sum(len(part_open_times) for part_open_times, _ in parts)
+	open_times = np.empty(count, dtype=np.int64)
+	prices = np.empty((len(CANDLE_COLUMNS) - 1, count), dtype=np.float64)
+
+	offset = 0
+	for part_open_times, part_prices in parts:
+		open_times[offset : offset + len(part_open_times)] = part_open_times
+		prices[:, offset : offset + len(part_open_times)] = part_prices
+		offset += len(part_open_times)
+	return open_times, prices
+
+
+def bucket_start(date: datetime, bucket: str) -> datetime:
+	"""Start of the UTC day, week from Monday or month of `date`"""
+	date = date.astimezone(pytz.UTC)
+	start = datetime(date.year, date.month, 1 if bucket == 'month' else date.day, tzinfo=pytz.UTC)
+	if bucket == 'week':
+		start -= timedelta(days=start.weekday())
+	return start
+
+
+def next_bucket(start: datetime, bucket: str) -> datetime:
+	match bucket:
+		case 'day':
+			return start + timedelta(days=1)
+		case 'week':
+			return start + timedelta(days=7)
+		case 'month':
+			return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=pytz.UTC)
+	raise ValueError(f'Invalid bucket "{bucket}"! (Expected one of {", ".join(BUCKET_MIN_DAYS)})')
+
+
+def series_name(timeframe: str, platform: str) -> str:
+	"""Key of a candle series, its collection under the pair document and its entry in the pair `series` map"""
+	return f'{platform}_{timeframe}'
+
+
+def series_metadata(start_time: int | None, end_time: int | None, count: int, timeframe: str) -> dict:
+	"""Metadata of a candle series, `gaps` being the number of candles missing between its first and last candle"""
+	if count == 0 or start_time is None or end_time is None:
+		return {'start_time': None, 'end_time': None, 'count': 0, 'gaps': 0}
+
+	expected = (end_time - start_time) // (INTERVAL_MAP[timeframe] * 60 * 1000) + 1
+	return {
+		'start_time': int(start_time),
+		'end_time': int(end_time),
+		'count': int(count),
+		'gaps': max(int(expected - count), 0),
+	}
 
 
 class Platform(Enum):
@@ -31,11 +171,11 @@ class FirebaseCandle:
 	TABLE_NAME = 'Candle'
 	__candle_token: DocumentReference = None
 	__candle_data: CollectionReference = None
-	__record_per_day: int = None
+	__records_per_bucket: int = None
+	__bucket: str = None
 
 	def __init__(self, token_pair=None, timeframe=None, platform=None):
 		self.__timestamp_column = 'Open Time'
-		self.__db_batch = DB_BATCH
 		self.__candle = FIREBASE.collection(self.TABLE_NAME)
 
 		if None not in [token_pair, timeframe, platform]:
@@ -44,170 +184,269 @@ class FirebaseCandle:
 	def change_pair(self, token_pair: str, timeframe: str, platform: Platform):
 		if isinstance(platform, Platform):
 			platform = platform.value
+		self.__cache_key = (token_pair, timeframe, platform)
 		self.__candle_token = self.__candle.document(token_pair)
-		self.__candle_data = self.__candle_token.collection(f'{platform}_{timeframe}')
-		self.__record_per_day = 24 * 60 / INTERVAL_MAP[timeframe]
+		self.__series = series_name(timeframe, platform)
+		self.__candle_data = self.__candle_token.collection(self.__series)
+		self.__bucket = CANDLE_BUCKETS.get(timeframe, 'day')
+		self.__records_per_bucket = BUCKET_MIN_DAYS[self.__bucket] * 24 * 60 / INTERVAL_MAP[timeframe]
 
-	def __combine_existing(self, ref: DocumentReference, commit_array: list, overwrite: bool, all_docs: list[str]):
+	def __merge_bucket(self, snapshot: DocumentSnapshot | None, start: datetime, candles: DataFrame, overwrite: bool):
+		"""
+		Document of the bucket with `candles` merged in, `None` if that leaves its candles unchanged,
+		and the number of candles added to it
+		"""
+		if snapshot is None or not snapshot.exists:
+			return self.bucket_document(start, candles, CANDLE_PACKED), len(candles)
+
+		existing = snapshot.to_dict()
+		existing_candles = bucket_candles([existing])
 		time_col = self.__timestamp_column
 
-		if ref.id in all_docs:
-			existing = ref.get().to_dict()['candles']
-			if overwrite:
-				committing_timestamp = [candle[time_col] for candle in commit_array]
-				commit_array = [
-					*commit_array,
-					*[candle for candle in existing if candle[time_col] not in committing_timestamp],
-				]
-			else:
-				existing_timestamp = [candle[time_col] for candle in existing]
-
-				no_new_data = len([c for c in commit_array if c[time_col] not in existing_timestamp]) == 0
-				if no_new_data:
-					return False
-
-				commit_array = [
-					*existing,
-					*[candle for candle in commit_array if candle[time_col] not in existing_timestamp],
-				]
-
-			commit_array.sort(key=lambda x: x[time_col])
-		return commit_array
-
-	def __set_data(self, today: int, overwrite: bool, commit_array: list[dict], all_docs: list[str]):
-		batch = self.__db_batch
-		cur_date = datetime.fromtimestamp(today, tz=pytz.UTC)
-		ref = self.__candle_data.document(str(int(today)))
-		commit_array = self.__combine_existing(ref, commit_array, overwrite, all_docs)
-
-		# If old data is already having the whole day's data, do not need to update
-		if commit_array is not False:
-			batch.set(ref, {'date': cur_date, 'candles': commit_array})
+		# The frame concatenated last wins at a duplicated open time
+		merged = concat([existing_candles, candles] if overwrite else [candles, existing_candles], ignore_index=True)
+		merged = merged.drop_duplicates(time_col, keep='last').sort_values(time_col, kind='stable')
+
+		existing_hash = existing.get(HASH_FIELD) or candle_hash(existing_candles)
+		if candle_hash(merged) == existing_hash:
+			return None, 0
+		return self.bucket_document(start, merged, CANDLE_PACKED), len(merged) - len(existing_candles)
+
+	@staticmethod
+	def bucket_document(date: datetime, candles: DataFrame, packed: bool):
+		document = {'date': date, HASH_FIELD: candle_hash(candles)}
+		if packed:
+			document[PACKED_FIELD] = pack_candles(candles)
+		else:
+			document['candles'] = candles[CANDLE_COLUMNS].replace(np.nan, None).to_dict('records')
+		return document
 
 	def save(self, token_id: str, from_token: str, to_token: str):
-		self.__candle_token.set({'token_id': token_id, 'from_token': from_token, 'to_token': to_token})
+		pair = {'token_id': token_id, 'from_token': from_token, 'to_token': to_token}
+		# Merged to keep the series metadata
+		self.__candle_token.set(pair, merge=True)
+		SYMBOL_REGISTRY.add(pair)
 
-	def save_ohlc(self, data: DataFrame, overwrite=True, batch_save=True):
+	def save_ohlc(self, data: DataFrame, overwrite=True) -> int:
 		"""
-		Use `batch_save = False` if the dataframe is too big to upload at once, firebase limit 11534336 bytes
+		Merge candles into their bucket documents, committed in batches within the Firestore limits.
+		Return the number of documents written
 		"""
 
 		if self.__candle_token is None or self.__candle_data is None:
-			return
+			return 0
 
 		assert data.columns.to_list() == ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
 
-		batch = self.__db_batch
+		if len(data) == 0:
+			return 0
+
 		data = data.sort_values(self.__timestamp_column)
-		timestamp_in_ms = False
 
-		first_timestamp = data[self.__timestamp_column].iloc[0]
-		last_timestamp = data[self.__timestamp_column].iloc[-1]
-		if first_timestamp > self.TIMESTAMP_MS_THRES:
-			timestamp_in_ms = True
-			first_timestamp = int(first_timestamp / 1000)
-			last_timestamp = int(last_timestamp / 1000)
-		else:
+		if data[self.__timestamp_column].iloc[0] < self.TIMESTAMP_MS_THRES:
 			data[self.__timestamp_column] = data[self.__timestamp_column] * 1000
 
-		first_date = datetime.fromtimestamp(first_timestamp, tz=pytz.UTC)
-		today = datetime(first_date.year, first_date.month, first_date.day, tzinfo=pytz.UTC)
-		today_timestamp = int(today.timestamp())
-		one_day_timestamp = int(timedelta(days=1).total_seconds())
-
-		last_date = datetime.fromtimestamp(last_timestamp, tz=pytz.UTC)
-		query = self.__candle_data.where(filter=FieldFilter('date', '>=', today))
-		query = query.where(filter=FieldFilter('date', '<', last_date))
-		all_docs = [doc.id for doc in query.stream()]
-
-		for timestamp in range(today_timestamp, last_timestamp, one_day_timestamp):
-			tomorrow = timestamp + one_day_timestamp
-			if timestamp_in_ms:
-				filter_query = data[self.__timestamp_column] >= timestamp * 1000
-				filter_query = filter_query & (data[self.__timestamp_column] < (tomorrow * 1000))
-			else:
-				filter_query = data[self.__timestamp_column] >= timestamp
-				filter_query = filter_query & (data[self.__timestamp_column] < tomorrow)
-
-			commit_array = data[filter_query].to_dict('records')
-			self.__set_data(timestamp, overwrite, commit_array, all_docs)
-
-			if not batch_save:
-				batch.commit()
-
-		batch.commit()
+		# Every document the data falls in is read in one request
+		buckets = self.split_buckets(data, self.__bucket)
+		refs = [self.__candle_data.document(str(int(start.timestamp()))) for start, _ in buckets]
+		snapshots = {snapshot.reference.path: snapshot for snapshot in FIREBASE.get_all([*refs, self.__candle_token])}
+
+		added = 0
+		with BatchWriter() as writer:
+			for ref, (start, bucket_data) in zip(refs, buckets):
+				document, count = self.__merge_bucket(snapshots.get(ref.path), start, bucket_data, overwrite)
+				added += count
+				if document is not None:
+					writer.set(ref, document)
+
+		# Existing candles win when not overwriting, which the cache cannot tell apart
+		if overwrite:
+			KLINE_CACHE.merge(*self.__cache_key, data)
+		else:
+			KLINE_CACHE.invalidate(*self.__cache_key)
+
+		metadata = self.__metadata(snapshots.get(self.__candle_token.path))
+		if metadata is None:
+			self.refresh_metadata()
+		elif added > 0:
+			open_times = data[self.__timestamp_column]
+			start_time, end_time = int(open_times.iloc[0]), int(open_times.iloc[-1])
+			if metadata['count'] > 0:
+				start_time, end_time = min(start_time, metadata['start_time']), max(end_time, metadata['end_time'])
+			self.__save_metadata(series_metadata(start_time, end_time, metadata['count'] + added, self.__cache_key[1]))
+		return writer.operations
 
 	def remove_older_than(self, date: datetime | None = None, inclusive=False):
-		if self.__candle_token is None or self.__candle_data is None:
-			return
-
-		query = self.__candle_data
-		operator = '<=' if inclusive else '<'
-
-		if date is not None:
-			query = query.where(filter=FieldFilter('date', operator, date))
-		else:
+		"""Remove the candles before `date`, the bucket holding `date` is rewritten with the candles left"""
+		if self.__candle_token is None or self.__candle_data is None or date is None:
 			return
 
-		docs = query.get()
-		batch = self.__db_batch
-
-		for doc in docs:
-			batch.delete(doc.reference)
-
-		batch.commit()
+		start = bucket_start(date, self.__bucket)
+		docs = self.__candle_data.where(filter=FieldFilter('date', '<', start)).get()
+
+		removed = 0
+		with BatchWriter() as writer:
+			for doc in docs:
+				removed += len(bucket_candles([doc.to_dict()]))
+				writer.delete(doc.reference)
+
+			ref = self.__candle_data.document(str(int(start.timestamp())))
+			doc = ref.get()
+			if doc.exists:
+				candles = bucket_candles([doc.to_dict()])
+				open_times = candles[self.__timestamp_column].to_numpy()
+				timestamp = date.timestamp() * (1000 if open_times[0] > self.TIMESTAMP_MS_THRES else 1)
+				keep = open_times > timestamp if inclusive else open_times >= timestamp
+
+				removed += int((~keep).sum())
+				if not keep.any():
+					writer.delete(ref)
+				elif not keep.all():
+					writer.set(ref, self.bucket_document(start, candles[keep], CANDLE_PACKED))
+
+		KLINE_CACHE.invalidate(*self.__cache_key)
+		SYMBOL_REGISTRY.invalidate(self.__cache_key[0])
+
+		metadata = self.__metadata(self.__candle_token.get())
+		if metadata is None:
+			self.refresh_metadata()
+		elif removed > 0:
+			first = self.fetch_first()
+			start_time = self.__to_ms(first[0][self.__timestamp_column]) if len(first) > 0 else None
+			count = metadata['count'] - removed
+			self.__save_metadata(series_metadata(start_time, metadata['end_time'], count, self.__cache_key[1]))
+
+	def fetch_metadata(self) -> dict | None:
+		"""First and last open time in ms, candle count and gap count of the series, `None` if not computed yet"""
+		if self.__candle_token is None:
+			return None
+		return self.__metadata(self.__candle_token.get())
+
+	def refresh_metadata(self) -> dict | None:
+		"""Compute the series metadata from all of its candles, `None` if the pair has no document"""
+		if self.__candle_token is None or self.__candle_data is None or not self.__candle_token.get().exists:
+			return None
+
+		start_time, end_time, count = None, None, 0
+		for doc in self.__candle_data.order_by('date').stream():
+			open_times = bucket_candles([doc.to_dict()])[self.__timestamp_column]
+			if len(open_times) == 0:
+				continue
+			if start_time is None:
+				start_time = self.__to_ms(open_times.iloc[0])
+			end_time = self.__to_ms(open_times.iloc[-1])
+			count += len(open_times)
+
+		metadata = series_metadata(start_time, end_time, count, self.__cache_key[1])
+		self.__save_metadata(metadata)
+		return metadata
+
+	def __metadata(self, snapshot: DocumentSnapshot | None) -> dict | None:
+		if snapshot is None or not snapshot.exists:
+			return None
+		return (snapshot.to_dict().get(SERIES_FIELD) or {}).get(self.__series)
+
+	def __save_metadata(self, metadata: dict):
+		# Merged into the pair document, leaving the metadata of its other series in place
+		self.__candle_token.set({SERIES_FIELD: {self.__series: metadata}}, merge=True)
+		SYMBOL_REGISTRY.update(self.__cache_key[0], {f'{SERIES_FIELD}.{self.__series}': metadata})
+
+	def __to_ms(self, timestamp) -> int:
+		timestamp = int(timestamp)
+		return timestamp * 1000 if timestamp < self.TIMESTAMP_MS_THRES else timestamp
 
 	def fetch_last(self, count=1):
 		"""Return `[ ]` if no candle is chosen"""
 		if self.__candle_token is None or self.__candle_data is None:
 			return []
 
-		days = math.ceil(count / self.__record_per_day) + 1
-		query = self.__candle_data.order_by('date').limit_to_last(days).get()
-		data = [record.to_dict() for record in query]
-		return_data = [candle for day in data for candle in day['candles']]
-		return return_data[-count:]
+		buckets = math.ceil(count / self.__records_per_bucket) + 1
+		query = self.__candle_data.order_by('date').limit_to_last(buckets).get()
+		data = bucket_candles([record.to_dict() for record in query])
+		return data.iloc[-count:].replace(np.nan, None).to_dict('records')
 
 	def fetch_first(self, count=1):
 		"""Return `[ ]` if no candle is chosen"""
 		if self.__candle_token is None or self.__candle_data is None:
 			return []
 
-		days = math.ceil(count / self.__record_per_day) + 1
-		query = self.__candle_data.order_by('date').limit(days).get()
-		data = [record.to_dict() for record in query]
-		return_data = [candle for day in data for candle in day['candles']]
-		return return_data[-count:]
+		buckets = math.ceil(count / self.__records_per_bucket) + 1
+		query = self.__candle_data.order_by('date').limit(buckets).get()
+		data = bucket_candles([record.to_dict() for record in query])
+		return data.iloc[:count].replace(np.nan, None).to_dict('records')
 
 	def fetch_all(self):
 		if self.__candle_token is None or self.__candle_data is None:
 			return
 
 		query = self.__candle_data.order_by('date').get()
-		data = [record.to_dict() for record in query]
-		return_data = [candle for day in data for candle in day['candles']]
-		return DataFrame(return_data)
+		return bucket_candles([record.to_dict() for record in query])
 
 	def fetch(self, start_date: datetime = None, end_date: datetime = None):
-		"""Return `[ ]` if no candle is chosen"""
+		"""Return `[ ]` if no candle is chosen. Long ranges are read as date partitions concurrently"""
 		if self.__candle_token is None or self.__candle_data is None:
 			return []
 
-		query = self.__candle_data.order_by('date')
+		partitions = self.__partitions(start_date, end_date)
+		if len(partitions) > 1:
+			parts = PARALLEL_READER.read(self.__path(), partitions, bucket_arrays)
+			return self.__select(_candle_frame(*merge_arrays(parts)), start_date, end_date)
 
-		start_timestamp = None
+		query = self.__candle_data.order_by('date')
 		if start_date is not None:
-			before_start = start_date - timedelta(days=1)
-			start_timestamp = int(start_date.timestamp())
-			query = query.where(filter=FieldFilter('date', '>=', before_start))
-
-		end_timestamp = None
+			query = query.where(filter=FieldFilter('date', '>=', bucket_start(start_date, self.__bucket)))
 		if end_date is not None:
-			after_end = end_date + timedelta(days=1)
-			end_timestamp = int(end_date.timestamp())
-			query = query.where(filter=FieldFilter('date', '<=', after_end))
+			query = query.where(filter=FieldFilter('date', '<', end_date.astimezone(pytz.UTC)))
+
+		data = bucket_candles([record.to_dict() for record in query.stream()])
+		return self.__select(data, start_date, end_date)
+
+	def __path(self) -> tuple[str, ...]:
+		return self.TABLE_NAME, self.__cache_key[0], self.__series
 
-		data = DataFrame([candle for record in query.stream() for candle in record.to_dict()['candles']])
+	def __partitions(self, start_date: datetime | None, end_date: datetime | None) -> list[Partition]:
+		"""
+		Date partitions of the bucket documents from `start_date` to `end_date`,
+		none if the range spans too few buckets to be worth reading concurrently.
+		Without `start_date` or `end_date` the range is split from the first or to the last candle
+		of the series metadata
+		"""
+		if not PARALLEL_READER.available or FIRESTORE_READ_PARTITIONS <= 1:
+			return []
+
+		start, end = start_date, end_date
+		if start is None or end is None:
+			pair = SYMBOL_REGISTRY.get(self.__cache_key[0]) or {}
+			metadata = (pair.get(SERIES_FIELD) or {}).get(self.__series) or {}
+			if start is None and metadata.get('start_time') is None:
+				return []
+			if start is None:
+				start = datetime.fromtimestamp(metadata['start_time'] / 1000, tz=pytz.UTC)
+			if end is None:
+				end_time = metadata.get('end_time')
+				end = datetime.fromtimestamp(end_time / 1000, tz=pytz.UTC) if end_time is not None else timezone.now()
+
+		end = end.astimezone(pytz.UTC)
+		first = bucket_start(start, self.__bucket)
+		buckets = (end - first) / timedelta(days=BUCKET_MIN_DAYS[self.__bucket])
+		count = min(FIRESTORE_READ_PARTITIONS, int(buckets // max(FIRESTORE_READ_MIN_BUCKETS, 1)))
+		if count <= 1:
+			return []
+
+		# Even splits of the range moved back to the start of their bucket, so that no bucket spans two partitions.
+		# The outer partitions stay unbounded when the range is, catching candles outside the metadata
+		bounds = sorted({bucket_start(first + (end - first) * i / count, self.__bucket) for i in range(count)})
+		lows = [bounds[0] if start_date is not None else None, *bounds[1:]]
+		highs = [*bounds[1:], end if end_date is not None else None]
+		return list(zip(lows, highs))
+
+	def __select(self, data: DataFrame, start_date: datetime | None, end_date: datetime | None):
+		"""Records of the candles from `start_date` and before `end_date`"""
+		if len(data) == 0:
+			return []
+
+		start_timestamp = int(start_date.timestamp()) if start_date is not None else None
+		end_timestamp = int(end_date.timestamp()) if end_date is not None else None
 
 		first_timestamp = data[self.__timestamp_column].iloc[0]
 		if first_timestamp > self.TIMESTAMP_MS_THRES:
@@ -218,13 +457,148 @@ class FirebaseCandle:
 
 		query = np.repeat(True, len(data))
 		if start_timestamp is not None:
-			query = query & data[self.__timestamp_column] >= start_timestamp
+			query = query & (data[self.__timestamp_column] >= start_timestamp)
 		if end_timestamp is not None:
-			query = query & data[self.__timestamp_column] < end_timestamp
+			query = query & (data[self.__timestamp_column] < end_timestamp)
 
 		return_data = data[query].replace(np.nan, None).to_dict('records')
 		return return_data
 
+	def fetch_since(self, timestamp: int | None = None) -> DataFrame:
+		"""
+		Candles with an open time from `timestamp` in ms, reading only the documents from its bucket.
+		Open times are returned in ms
+		"""
+		if self.__candle_token is None or self.__candle_data is None:
+			return DataFrame(columns=CANDLE_COLUMNS)
+
+		query = self.__candle_data.order_by('date')
+		if timestamp is not None:
+			start = bucket_start(datetime.fromtimestamp(timestamp // 1000, tz=pytz.UTC), self.__bucket)
+			query = query.where(filter=FieldFilter('date', '>=', start))
+
+		data = bucket_candles([record.to_dict() for record in query.stream()])
+		if len(data) == 0:
+			return DataFrame(columns=CANDLE_COLUMNS)
+
+		time_col = self.__timestamp_column
+		open_times = data[time_col].to_numpy(np.int64)
+		data[time_col] = np.where(open_times < self.TIMESTAMP_MS_THRES, open_times * 1000, open_times)
+		if timestamp is not None:
+			data = data[data[time_col] >= timestamp]
+		return data
+
+	def migrate(self, packed=True, batch_size=200) -> int:
+		"""
+		Rewrite the day documents of the pair in the packed or list encoding, committing `batch_size` at a time.
+		Return the number of documents rewritten
+		"""
+		if self.__candle_token is None or self.__candle_data is None:
+			return 0
+
+		query = self.__candle_data.order_by('date').limit(batch_size)
+		migrated = 0
+		last_doc = None
+		while True:
+			docs = (query if last_doc is None else query.start_after(last_doc)).get()
+			if len(docs) == 0:
+				return migrated
+
+			with BatchWriter() as writer:
+				for doc in docs:
+					day = doc.to_dict()
+					if (PACKED_FIELD in day) != packed:
+						writer.set(doc.reference, self.bucket_document(day['date'], bucket_candles([day]), packed))
+
+			migrated += writer.operations
+			last_doc = docs[-1]
+
+	def rebucket(self, bucket: str, batch_size=200) -> int:
+		"""
+		Rewrite the documents of the pair into `bucket` sized documents, reading `batch_size` at a time.
+		Candles are written before the documents they came from are removed.
+		Return the number of documents written
+		"""
+		if self.__candle_token is None or self.__candle_data is None:
+			return 0
+		if bucket not in BUCKET_MIN_DAYS:
+			raise ValueError(f'Invalid bucket "{bucket}"! (Expected one of {", ".join(BUCKET_MIN_DAYS)})')
+
+		time_col = self.__timestamp_column
+		query = self.__candle_data.order_by('date').limit(batch_size)
+		pending = []
+		read_docs: list[tuple[DocumentReference, int]] = []
+		written_ids = set()
+		last_doc = None
+
+		while True:
+			docs = (query if last_doc is None else query.start_after(last_doc)).get()
+			for doc in docs:
+				candles = bucket_candles([doc.to_dict()])
+				max_time = 0
+				if len(candles) > 0:
+					open_times = candles[time_col].to_numpy(np.int64)
+					candles[time_col] = np.where(open_times < self.TIMESTAMP_MS_THRES, open_times * 1000, open_times)
+					pending.append(candles)
+					max_time = int(candles[time_col].max())
+				read_docs.append((doc.reference, max_time))
+
+			# Documents after the last one read only hold candles from its date
+			flush_before = np.inf
+			if len(docs) > 0:
+				last_doc = docs[-1]
+				flush_before = bucket_start(last_doc.to_dict()['date'], bucket).timestamp() * 1000
+
+			candles = concat(pending, ignore_index=True) if len(pending) > 0 else DataFrame(columns=CANDLE_COLUMNS)
+			candles = candles.sort_values(time_col, kind='stable').drop_duplicates(time_col, keep='last')
+			flushing = (candles[time_col] < flush_before).to_numpy()
+			pending = [candles[~flushing]]
+
+			writes = []
+			for start, bucket_data in self.split_buckets(candles[flushing], bucket):
+				ref = self.__candle_data.document(str(int(start.timestamp())))
+				writes.append((ref, self.bucket_document(start, bucket_data, CANDLE_PACKED)))
+				written_ids.add(ref.id)
+
+			removes = [ref for ref, max_time in read_docs if max_time < flush_before and ref.id not in written_ids]
+			read_ids = {ref.id for ref, _ in read_docs}
+			read_docs = [(ref, max_time) for ref, max_time in read_docs if max_time >= flush_before]
+
+			# Overwrites of documents that were read, then removals, each wait for the writes before them,
+			# so an interrupted run only leaves duplicates
+			with BatchWriter() as writer:
+				for overwrite in [False, True]:
+					for ref, document in writes:
+						if (ref.id in read_ids) == overwrite:
+							writer.set(ref, document)
+					writer.wait()
+
+				for ref in removes:
+					writer.delete(ref)
+
+			if len(docs) == 0:
+				KLINE_CACHE.invalidate(*self.__cache_key)
+				return len(written_ids)
+
+	@staticmethod
+	def split_buckets(candles: DataFrame, bucket: str) -> list[tuple[datetime, DataFrame]]:
+		"""Start and candles of each non-empty bucket of candles sorted by open time in ms"""
+		if len(candles) == 0:
+			return []
+
+		open_times = candles['Open Time'].to_numpy()
+		start = bucket_start(datetime.fromtimestamp(open_times[0] / 1000, tz=pytz.UTC), bucket)
+		buckets = []
+		first = 0
+		while first < len(open_times):
+			end = next_bucket(start, bucket)
+			last = np.searchsorted(open_times, end.timestamp() * 1000, side='left')
+			if last > first:
+				buckets.append((start, candles.iloc[first:last]))
+			first = last
+			start = end
+		return buckets
+
 	def fetch_cur_token(self):
 		return self.__candle_token.get().to_dict()
 
@@ -237,6 +611,30 @@ class FirebaseCandle:
 		return doc.to_dict()
 
 
+def load_symbols() -> dict[str, dict]:
+	return {pair['token_id']: pair for pair in FirebaseCandle().fetch_pairs()}
+
+
+def load_symbol_range(token_id: str) -> tuple[int | None, int | None]:
+	"""Open times of the first and last candle of the default timeframe and platform"""
+	firebase = FirebaseCandle(token_id, DEFAULT_TIMEFRAME, DEFAULT_PLATFORM)
+	first = firebase.fetch_first()
+	if len(first) == 0:
+		return None, None
+	last = firebase.fetch_last()
+	return first[0]['Open Time'], last[-1]['Open Time']
+
+
+def watch_symbols(callback):
+	def on_snapshot(docs: list[DocumentSnapshot], changes, read_time):
+		callback({pair['token_id']: pair for pair in (doc.to_dict() for doc in docs)})
+
+	return FIREBASE.collection(FirebaseCandle.TABLE_NAME).on_snapshot(on_snapshot)
+
+
+SYMBOL_REGISTRY = SymbolRegistry(load_symbols, load_symbol_range, watch_symbols if SYMBOL_REGISTRY_LISTEN else None)
+
+
 class FirebaseOrderBook:
 	ORDER_BOOK_TABLE = 'OrderBook'
 	__OPEN_STATUS = 'OPEN'
@@ -0,0 +1,185 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+JOB_QUEUE_PATH: Path = settings.JOB_QUEUE_PATH
+JOB_KINDS = ('backtest', 'batch', 'optimize')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+JOB_TIMES = ('created_at', 'started_at', 'finished_at')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+	id TEXT PRIMARY KEY,
+	uid TEXT NOT NULL,
+	kind TEXT NOT NULL,
+	status TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	result TEXT,
+	error TEXT,
+	progress REAL NOT NULL DEFAULT 0,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	worker TEXT,
+	created_at REAL NOT NULL,
+	started_at REAL,
+	finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS job_status ON job (status, created_at);
+CREATE INDEX IF NOT EXISTS job_uid ON job (uid, status);
+"""
+
+
+class JobQueue:
+	"""
+	Jobs kept in a SQLite database, so that the server enqueues them and worker processes on the same host run them.
+
+	A worker claims the oldest queued job of a user running fewer than `max_per_user` jobs, in a write transaction
+	so that two workers never claim the same job. Payloads and results are stored as JSON.
+	Each thread uses a connection of its own, the database being in WAL mode so reads do not wait for writes.
+	"""
+
+	def __init__(self, path: Path | str = JOB_QUEUE_PATH, timeout: float = 30):
+		self.path = Path(path)
+		self.timeout = timeout
+		self.__local = threading.local()
+
+	def __connection(self) -> sqlite3.Connection:
+		connection = getattr(self.__local, 'connection', None)
+		if connection is None:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			# Autocommit, transactions being opened explicitly where needed
+			connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+			connection.row_factory = sqlite3.Row
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.executescript(SCHEMA)
+			self.__local.connection = connection
+		return connection
+
+	@staticmethod
+	def __decode(row: sqlite3.Row | None) -> dict | None:
+		if row is None:
+			return None
+		job = dict(row)
+		job['payload'] = json.loads(job['payload'])
+		job['result'] = json.loads(job['result']) if job['result'] is not None else None
+		return job
+
+	def enqueue(self, uid: str, kind: str, payload: dict) -> str:
+		if kind not in JOB_KINDS:
+			raise ValueError(f'Invalid job kind "{kind}"! (Expected one of {", ".join(JOB_KINDS)})')
+
+		job_id = uuid.uuid4().hex
+		self.__connection().execute(
+			'INSERT INTO job (id, uid, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+			(job_id, uid, kind, QUEUED, json.dumps(payload, cls=JSONEncoder), time.time()),
+		)
+		return job_id
+
+	def get(self, job_id: str) -> dict | None:
+		row = self.__connection().execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+		return self.__decode(row)
+
+	def pending(self, uid: str) -> int:
+		"""Jobs of a user queued or running"""
+		cursor = self.__connection().execute(
+			'SELECT COUNT(*) FROM job WHERE uid = ? AND status IN (?, ?)', (uid, QUEUED, RUNNING)
+		)
+		return cursor.fetchone()[0]
+
+	def claim(self, worker: str, max_per_user: int) -> dict | None:
+		"""Oldest queued job of a user with fewer than `max_per_user` running jobs, marked as run by `worker`"""
+		connection = self.__connection()
+		# Take the write lock before reading, so no other worker claims in between
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			row = connection.execute(
+				"""
+				SELECT * FROM job WHERE status = ? AND uid NOT IN (
+					SELECT uid FROM job WHERE status = ? GROUP BY uid HAVING COUNT(*) >= ?
+				)
+				ORDER BY created_at LIMIT 1
+				""",
+				(QUEUED, RUNNING, max_per_user),
+			).fetchone()
+			if row is not None:
+				connection.execute(
+					'UPDATE job SET status = ?, worker = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?',
+					(RUNNING, worker, time.time(), row['id']),
+				)
+			connection.execute('COMMIT')
+		except BaseException:
+			connection.execute('ROLLBACK')
+			raise
+
+		job = self.__decode(row)
+		if job is not None:
+			job['status'] = RUNNING
+			job['worker'] = worker
+			job['attempts'] += 1
+		return job
+
+	def progress(self, job_id: str, progress: float):
+		self.__connection().execute(
+			'UPDATE job SET progress = ? WHERE id = ? AND status = ?', (min(max(progress, 0.0), 1.0), job_id, RUNNING)
+		)
+
+	def complete(self, job_id: str, result: dict):
+		self.__connection().execute(
+			'UPDATE job SET status = ?, result = ?, progress = 1, finished_at = ? WHERE id = ?',
+			(DONE, json.dumps(result, cls=JSONEncoder), time.time(), job_id),
+		)
+
+	def fail(self, job_id: str, error: str):
+		self.__connection().execute(
+			'UPDATE job SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+			(FAILED, error, time.time(), job_id),
+		)
+
+	def release(self, worker: str | None = None, max_attempts: int = 3) -> int:
+		"""
+		Queue again the running jobs of `worker`, or of every worker, e.g. after it died.
+		Jobs already run `max_attempts` times fail instead, as they may be what stops the worker.
+		"""
+		where, args = ('status = ?', [RUNNING]) if worker is None else ('status = ? AND worker = ?', [RUNNING, worker])
+		connection = self.__connection()
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			connection.execute(
+				f'UPDATE job SET status = ?, error = ?, finished_at = ? WHERE {where} AND attempts >= ?',
+				(FAILED, 'The worker stopped while running the job', time.time(), *args, max_attempts),
+			)
+			cursor = connection.execute(
+				f'UPDATE job SET status = ?, worker = NULL, started_at = NULL, progress = 0 WHERE {where}',
+				(QUEUED, *args),
+			)
+			connection.execute('COMMIT')
+		except BaseException:
+			connection.execute('ROLLBACK')
+			raise
+		return cursor.rowcount
+
+	def prune(self, older_than: float) -> int:
+		"""Delete the jobs finished more than `older_than` seconds ago"""
+		cursor = self.__connection().execute(
+			'DELETE FROM job WHERE status IN (?, ?) AND finished_at < ?', (*FINISHED, time.time() - older_than)
+		)
+		return cursor.rowcount
+
+	def close(self):
+		connection = getattr(self.__local, 'connection', None)
+		if connection is not None:
+			connection.close()
+			self.__local.connection = None
+
+
+JOB_QUEUE = JobQueue()
@@ -0,0 +1,63 @@
+import threading
+import traceback
+from functools import partial
+from typing import Callable
+
+from django.conf import settings
+
+from api_v2.job_queue import JOB_QUEUE, JobQueue
+from machd.utils import log_error
+
+JOB_USER_CONCURRENCY: int = settings.JOB_USER_CONCURRENCY
+JOB_POLL_SECONDS: float = settings.JOB_POLL_SECONDS
+
+# Runs the payload of a job with a callback taking the fraction done, returning the result
+JobRunner = Callable[[dict, Callable[[float], None]], dict]
+
+
+class JobWorker:
+	"""
+	Runs the jobs claimed from a `JobQueue` one at a time, with the runner of their kind.
+	A `ValueError` is the error of the job, as it would be a bad request of its endpoint, other errors are logged too.
+	"""
+
+	def __init__(
+		self,
+		name: str,
+		runners: dict[str, JobRunner],
+		queue: JobQueue = JOB_QUEUE,
+		max_per_user: int = JOB_USER_CONCURRENCY,
+		poll: float = JOB_POLL_SECONDS,
+	):
+		self.name = name
+		self.runners = runners
+		self.queue = queue
+		self.max_per_user = max_per_user
+		self.poll = poll
+
+	def run_once(self) -> bool:
+		"""Run the next job, if any is claimed"""
+		job = self.queue.claim(self.name, self.max_per_user)
+		if job is None:
+			return False
+
+		try:
+			runner = self.runners.get(job['kind'])
+			if runner is None:
+				raise ValueError(f'Invalid job kind "{job["kind"]}"!')
+			result = runner(job['payload'], partial(self.queue.progress, job['id']))
+		except ValueError as e:
+			self.queue.fail(job['id'], str(e))
+		except Exception:
+			log_error({'message': 'Job failed', 'job': job['id'], 'kind': job['kind'], 'error': traceback.format_exc()})
+			self.queue.fail(job['id'], 'Internal server error')
+		else:
+			self.queue.complete(job['id'], result)
+		return True
+
+	def run(self, stop: threading.Event | None = None):
+		"""Run jobs until `stop` is set, polling the queue while it is empty"""
+		stop = stop if stop is not None else threading.Event()
+		while not stop.is_set():
+			if not self.run_once():
+				stop.wait(self.poll)
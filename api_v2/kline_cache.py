@@ -0,0 +1,162 @@
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+KLINE_CACHE_BYTES: int = settings.KLINE_CACHE_BYTES
+TIME_COLUMN = 'Open Time'
+
+# (token_pair, timeframe, platform, start_time, end_time) -> candles with an open time in [start_time, end_time)
+KlineLoader = Callable[[str, str, str, int | None, int | None], pd.DataFrame]
+
+
+class KlineCache:
+	"""
+	Candles cached per pair, platform and timeframe as the widest range loaded so far,
+	`[start_time, end_time)` in ms with `None` as unbounded.
+	A range inside the cached one is sliced from it, any other range loads the union of both.
+
+	Least recently used pairs are evicted once the cached frames exceed `max_bytes`,
+	and concurrent misses of the same pair wait for a single load.
+	"""
+
+	def __init__(self, max_bytes: int = KLINE_CACHE_BYTES):
+		self.max_bytes = max_bytes
+		self.__entries: OrderedDict[tuple, tuple[int | None, int | None, pd.DataFrame, int]] = OrderedDict()
+		self.__versions: dict[tuple, int] = {}
+		self.__loading: dict[tuple, threading.Lock] = {}
+		self.__size = 0
+		self.__lock = threading.Lock()
+
+	@property
+	def size(self):
+		"""Bytes used by the cached frames"""
+		return self.__size
+
+	def version(self, token_pair: str, timeframe: str, platform: str) -> int:
+		"""Counter increased whenever the cached candles of the pair change or are invalidated"""
+		return self.__versions.get((token_pair, platform, timeframe), 0)
+
+	def get(
+		self,
+		loader: KlineLoader,
+		token_pair: str,
+		timeframe: str,
+		platform: str,
+		start_time: int | None = None,
+		end_time: int | None = None,
+	) -> pd.DataFrame:
+		key = (token_pair, platform, timeframe)
+		data = self.__cached(key, start_time, end_time)
+		if data is not None:
+			return data
+
+		with self.__lock:
+			loading = self.__loading.setdefault(key, threading.Lock())
+
+		with loading:
+			# Another request may have loaded a superset while this one waited
+			data = self.__cached(key, start_time, end_time)
+			if data is not None:
+				return data
+
+			with self.__lock:
+				entry = self.__entries.get(key)
+				version = self.__versions.get(key, 0)
+
+			load_start, load_end = start_time, end_time
+			if entry is not None:
+				load_start = None if load_start is None or entry[0] is None else min(load_start, entry[0])
+				load_end = None if load_end is None or entry[1] is None else max(load_end, entry[1])
+
+			data = loader(token_pair, timeframe, platform, load_start, load_end)
+			with self.__lock:
+				# Candles saved during the load may be missing from it
+				if self.__versions.get(key, 0) == version:
+					self.__put(key, load_start, load_end, data)
+
+		return self.__slice(data, start_time, end_time)
+
+	def merge(self, token_pair: str, timeframe: str, platform: str, data: pd.DataFrame):
+		"""Add saved candles within the cached range, replacing cached candles at the same open time"""
+		key = (token_pair, platform, timeframe)
+		with self.__lock:
+			entry = self.__entries.get(key)
+			if entry is None or len(data) == 0:
+				return
+
+			start_time, end_time, cached, _ = entry
+			open_times = data[TIME_COLUMN].to_numpy()
+			in_range = np.repeat(True, len(data))
+			if start_time is not None:
+				in_range &= open_times >= start_time
+			if end_time is not None:
+				in_range &= open_times < end_time
+			if not in_range.any():
+				return
+
+			merged = pd.concat([cached, data[in_range]], ignore_index=True)
+			merged = merged.sort_values(TIME_COLUMN, kind='stable').drop_duplicates(TIME_COLUMN, keep='last')
+			self.__versions[key] = self.__versions.get(key, 0) + 1
+			self.__put(key, start_time, end_time, merged.reset_index(drop=True))
+
+	def invalidate(self, token_pair: str, timeframe: str | None = None, platform: str | None = None):
+		"""Drop the cached candles of a pair, of every timeframe and platform unless given"""
+		with self.__lock:
+			for key in [*self.__entries, *self.__versions]:
+				if key[0] == token_pair and platform in (None, key[1]) and timeframe in (None, key[2]):
+					self.__versions[key] = self.__versions.get(key, 0) + 1
+					self.__remove(key)
+
+	def clear(self):
+		with self.__lock:
+			for key in list(self.__entries):
+				self.__versions[key] = self.__versions.get(key, 0) + 1
+				self.__remove(key)
+
+	def __cached(self, key: tuple, start_time: int | None, end_time: int | None) -> pd.DataFrame | None:
+		with self.__lock:
+			entry = self.__entries.get(key)
+			if entry is None:
+				return None
+
+			cached_start, cached_end, data, _ = entry
+			if cached_start is not None and (start_time is None or start_time < cached_start):
+				return None
+			if cached_end is not None and (end_time is None or end_time > cached_end):
+				return None
+
+			self.__entries.move_to_end(key)
+		return self.__slice(data, start_time, end_time)
+
+	def __put(self, key: tuple, start_time: int | None, end_time: int | None, data: pd.DataFrame):
+		self.__remove(key)
+		size = int(data.memory_usage(index=True).sum())
+		self.__entries[key] = (start_time, end_time, data, size)
+		self.__size += size
+
+		while self.__size > self.max_bytes and len(self.__entries) > 1:
+			self.__remove(next(iter(self.__entries)))
+
+	def __remove(self, key: tuple):
+		entry = self.__entries.pop(key, None)
+		if entry is not None:
+			self.__size -= entry[3]
+
+	@staticmethod
+	def __slice(data: pd.DataFrame, start_time: int | None, end_time: int | None) -> pd.DataFrame:
+		if len(data) == 0:
+			return data
+
+		open_times = data[TIME_COLUMN].to_numpy()
+		start = np.searchsorted(open_times, start_time, side='left') if start_time is not None else 0
+		end = np.searchsorted(open_times, end_time, side='left') if end_time is not None else len(open_times)
+		if start == 0 and end == len(open_times):
+			return data
+		return data.iloc[start:end].reset_index(drop=True)
+
+
+KLINE_CACHE = KlineCache()
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api_v2.firebase import FirebaseCandle, Platform, series_name
+
+
+class Command(BaseCommand):
+	help = 'Compute the first and last open time, candle count and gap count of existing candle series'
+
+	def add_arguments(self, parser):
+		parser.add_argument('symbols', nargs='*', help='Pairs to backfill, all pairs if empty')
+		parser.add_argument('--timeframe', choices=list(settings.INTERVAL_MAP), help='All timeframes if not given')
+
+	def handle(self, *args, **kwargs):
+		symbols = kwargs['symbols'] or [pair['token_id'] for pair in FirebaseCandle().fetch_pairs()]
+		timeframes = [kwargs['timeframe']] if kwargs['timeframe'] else list(settings.INTERVAL_MAP)
+
+		for symbol in symbols:
+			for timeframe in timeframes:
+				for platform in Platform:
+					metadata = FirebaseCandle(symbol, timeframe, platform).refresh_metadata()
+					series = series_name(timeframe, platform.value)
+					if metadata is None:
+						self.stdout.write(self.style.WARNING(f'Skipped {symbol} {series}, the pair has no document'))
+					else:
+						self.stdout.write(self.style.SUCCESS(f'{symbol} {series}: {metadata}'))
@@ -102,11 +102,13 @@ class Command(BaseCommand):
 
 		self.stdout.write(f'    {len(df)} candle found ({len(df) // rows_per_day} days)!')
 		for _, group in df.groupby(np.arange(len(df)) // max_upload_limit):
-			firebase.save_ohlc(group)
+			written = firebase.save_ohlc(group)
 
 			num_days = len(group) // rows_per_day
 			self.imported_days += num_days
-			self.stdout.write(f'    - Imported {num_days} days... [{get_duration(self.start_time):d}s]')
+			self.stdout.write(
+				f'    - Imported {num_days} days, {written} documents written... [{get_duration(self.start_time):d}s]'
+			)
 
 			if self.imported_days >= self.limit:
 				self.limit_hit = True
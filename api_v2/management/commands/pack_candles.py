@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api_v2.firebase import FirebaseCandle, Platform
+
+
+class Command(BaseCommand):
+	help = 'Migrate the candle day documents to the packed encoding, or back with --unpack'
+
+	def add_arguments(self, parser):
+		parser.add_argument('symbols', nargs='*', help='Pairs to migrate, all pairs if empty')
+		parser.add_argument('--unpack', action='store_true')
+		parser.add_argument('--batch_size', type=int, default=200)
+
+	def handle(self, *args, **kwargs):
+		packed = not kwargs['unpack']
+		symbols = kwargs['symbols'] or [pair['token_id'] for pair in FirebaseCandle().fetch_pairs()]
+
+		for symbol in symbols:
+			for platform in Platform:
+				for timeframe in settings.INTERVAL_MAP:
+					firebase = FirebaseCandle(symbol, timeframe, platform)
+					count = firebase.migrate(packed, kwargs['batch_size'])
+					if count > 0:
+						collection = f'{platform.value}_{timeframe}'
+						self.stdout.write(self.style.SUCCESS(f'Migrated {count} {symbol} {collection} documents'))
+
+		self.stdout.write(self.style.SUCCESS('Migrated all candles!'))
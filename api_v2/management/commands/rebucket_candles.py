@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api_v2.firebase import BUCKET_MIN_DAYS, FirebaseCandle, Platform
+
+
+class Command(BaseCommand):
+	help = 'Move the candle documents of a timeframe to day, week or month buckets'
+
+	def add_arguments(self, parser):
+		parser.add_argument('timeframe', choices=list(settings.INTERVAL_MAP))
+		parser.add_argument('bucket', choices=list(BUCKET_MIN_DAYS))
+		parser.add_argument('symbols', nargs='*', help='Pairs to rebucket, all pairs if empty')
+		parser.add_argument('--batch_size', type=int, default=200)
+
+	def handle(self, *args, **kwargs):
+		timeframe = kwargs['timeframe']
+		bucket = kwargs['bucket']
+		symbols = kwargs['symbols'] or [pair['token_id'] for pair in FirebaseCandle().fetch_pairs()]
+
+		for symbol in symbols:
+			for platform in Platform:
+				firebase = FirebaseCandle(symbol, timeframe, platform)
+				count = firebase.rebucket(bucket, kwargs['batch_size'])
+				collection = f'{platform.value}_{timeframe}'
+				self.stdout.write(self.style.SUCCESS(f'Wrote {count} {symbol} {collection} documents'))
+
+		if settings.CANDLE_BUCKETS.get(timeframe) != bucket:
+			message = f'Set CANDLE_BUCKETS to {timeframe}={bucket} to read the new documents'
+			self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import signal
+import threading
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api_v2.job_queue import JOB_QUEUE
+from api_v2.job_worker import JobWorker
+
+SUPERVISE_SECONDS = 5
+
+
+def _work(name: str):
+	django.setup()
+	# The views are imported once the apps of the spawned process are set up
+	from api_v2 import views
+
+	# Stopped by the command on SIGTERM, rather than on the SIGINT of a terminal sent to every process
+	stop = threading.Event()
+	signal.signal(signal.SIGTERM, lambda *_: stop.set())
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	runners = {'backtest': views.backtest_job, 'batch': views.backtest_batch, 'optimize': views.backtest_optimize}
+	JobWorker(name, runners).run(stop)
+
+
+class Command(BaseCommand):
+	help = 'Run worker processes for the jobs queued through the jobs endpoint, restarting the ones that die'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--workers', type=int, default=settings.JOB_WORKERS)
+
+	def handle(self, *args, **kwargs):
+		# Jobs left running when the previous workers stopped
+		released = JOB_QUEUE.release()
+		if released > 0:
+			self.stdout.write(self.style.WARNING(f'Queued {released} interrupted jobs again'))
+
+		stop = threading.Event()
+		signal.signal(signal.SIGTERM, lambda *_: stop.set())
+		signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+		# Spawn, as forking a process with Firestore / gRPC threads is unsafe
+		context = multiprocessing.get_context('spawn')
+		names = [f'{os.getpid()}-{i}' for i in range(kwargs['workers'])]
+		processes: dict[str, multiprocessing.Process] = {}
+		while not stop.is_set():
+			for name in names:
+				process = processes.get(name)
+				if process is not None and process.is_alive():
+					continue
+
+				if process is not None:
+					released = JOB_QUEUE.release(name)
+					message = f'Worker {name} exited with {process.exitcode}, queued {released} jobs again'
+					self.stdout.write(self.style.WARNING(message))
+				processes[name] = context.Process(target=_work, args=(name,), name=f'job-worker-{name}')
+				processes[name].start()
+
+			JOB_QUEUE.prune(settings.JOB_RETENTION_SECONDS)
+			stop.wait(SUPERVISE_SECONDS)
+
+		# Workers finish their current job, which is queued again if it takes too long
+		for process in processes.values():
+			process.terminate()
+		for name, process in processes.items():
+			process.join(settings.JOB_SHUTDOWN_SECONDS)
+			if process.is_alive():
+				process.kill()
+				process.join()
+			JOB_QUEUE.release(name)
+		self.stdout.write(self.style.SUCCESS(f'Stopped {len(processes)} job workers'))
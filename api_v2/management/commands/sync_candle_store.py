@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api_v2.candle_store import CandleStore
+from api_v2.firebase import FirebaseCandle
+
+
+class Command(BaseCommand):
+	help = 'Sync the local candle store with Firestore'
+
+	def add_arguments(self, parser):
+		parser.add_argument('symbols', nargs='*', help='Pairs to sync, all pairs if empty')
+		parser.add_argument('--timeframe', default=settings.DEFAULT_TIMEFRAME)
+
+	def handle(self, *args, **kwargs):
+		if settings.CANDLE_STORE_DIR is None:
+			self.stdout.write(self.style.ERROR('CANDLE_STORE_DIR is not set!'))
+			return
+
+		symbols = kwargs['symbols'] or [pair['token_id'] for pair in FirebaseCandle().fetch_pairs()]
+		for symbol in symbols:
+			store = CandleStore(symbol, kwargs['timeframe'], settings.DEFAULT_PLATFORM)
+			count = store.sync()
+			self.stdout.write(self.style.SUCCESS(f'Synced {count} {symbol} candles to "{store.path}"'))
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from datetime import datetime
+from typing import Callable, TypeVar
+
+from django.conf import settings
+from google.cloud.firestore_v1 import AsyncClient
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+T = TypeVar('T')
+# Date range of the bucket documents of a partition, `[start, end)` with `None` as unbounded
+Partition = tuple[datetime | None, datetime | None]
+
+
+class ParallelReader:
+	"""
+	Bucket documents of a collection read as date partitions concurrently through the Firestore `AsyncClient`.
+
+	The client runs on an event loop of its own in a background thread, as its channel is bound to one loop,
+	so that sync callers in any thread can wait for the reads, e.g. views run through `sync_to_async`.
+	Each partition is decoded in a worker thread as soon as its documents arrive.
+	"""
+
+	def __init__(self, client: AsyncClient | None = None):
+		self.__client = client if client is not None else settings.FIREBASE_ASYNC
+		self.__loop: asyncio.AbstractEventLoop | None = None
+		self.__lock = threading.Lock()
+
+	@property
+	def available(self) -> bool:
+		return self.__client is not None
+
+	def read(self, path: tuple[str, ...], partitions: list[Partition], decode: Callable[[list[dict]], T]) -> list[T]:
+		"""Decoded documents of each partition, in the order of `partitions`"""
+		return asyncio.run_coroutine_threadsafe(self.__read(path, partitions, decode), self.__event_loop()).result()
+
+	def __event_loop(self) -> asyncio.AbstractEventLoop:
+		with self.__lock:
+			if self.__loop is None:
+				loop = asyncio.new_event_loop()
+				threading.Thread(target=loop.run_forever, name='parallel-reader', daemon=True).start()
+				self.__loop = loop
+			return self.__loop
+
+	async def __read(self, path: tuple[str, ...], partitions: list[Partition], decode: Callable[[list[dict]], T]):
+		collection = self.__client.collection(*path)
+		reads = [self.__read_partition(collection, start, end, decode) for start, end in partitions]
+		return list(await asyncio.gather(*reads))
+
+	@staticmethod
+	async def __read_partition(collection, start: datetime | None, end: datetime | None, decode: Callable):
+		query = collection.order_by('date')
+		if start is not None:
+			query = query.where(filter=FieldFilter('date', '>=', start))
+		if end is not None:
+			query = query.where(filter=FieldFilter('date', '<', end))
+
+		docs = [doc.to_dict() async for doc in query.stream()]
+		return await asyncio.to_thread(decode, docs)
+
+
+PARALLEL_READER = ParallelReader()
@@ -0,0 +1,175 @@
+import threading
+import time
+import traceback
+from typing import Callable
+
+from django.conf import settings
+
+from machd.utils import log_warning
+
+SYMBOL_REGISTRY_TTL_SECONDS: int = settings.SYMBOL_REGISTRY_TTL_SECONDS
+
+# () -> pair documents by token id
+SymbolLoader = Callable[[], dict[str, dict]]
+# token_id -> open times of the first and last candle, `None` without candles
+RangeLoader = Callable[[str], tuple[int | None, int | None]]
+# callback -> watch calling it with the pair documents whenever they change, stopped with `unsubscribe()`
+SymbolWatcher = Callable[[Callable[[dict[str, dict]], None]], object]
+
+
+class SymbolRegistry:
+	"""
+	Pair documents by token id, kept in process instead of queried per request,
+	with the range of the candles of pairs whose documents lack the series metadata.
+
+	The pairs are loaded on first use and reloaded in the background once older than `ttl` seconds,
+	the stale pairs being served meanwhile. An unknown symbol reloads them at once,
+	at most every `MISS_RELOAD_SECONDS` so that invalid symbols cannot flood Firestore.
+	With a `watcher` the pairs are also replaced by a Firestore snapshot listener as soon as they change.
+	"""
+
+	MISS_RELOAD_SECONDS = 10
+
+	def __init__(
+		self,
+		loader: SymbolLoader,
+		range_loader: RangeLoader,
+		watcher: SymbolWatcher | None = None,
+		ttl: float = SYMBOL_REGISTRY_TTL_SECONDS,
+	):
+		self.__loader = loader
+		self.__range_loader = range_loader
+		self.__watcher = watcher
+		self.ttl = ttl
+
+		self.__pairs: dict[str, dict] | None = None
+		self.__loaded_at = -float('inf')
+		self.__ranges: dict[str, tuple[float, int | None, int | None]] = {}
+		self.__reloading = False
+		self.__watch = None
+		self.__watching = False
+		self.__lock = threading.Lock()
+		self.__load_lock = threading.Lock()
+
+	def pairs(self) -> dict[str, dict]:
+		if self.__pairs is None:
+			with self.__load_lock:
+				if self.__pairs is None:
+					self.__load()
+		elif time.monotonic() - self.__loaded_at >= self.ttl:
+			self.__reload_in_background()
+
+		if self.__watcher is not None and not self.__watching:
+			self.watch()
+		return self.__pairs
+
+	def symbols(self) -> list[str]:
+		return list(self.pairs())
+
+	def get(self, symbol: str) -> dict | None:
+		"""Pair document of the symbol, `None` if it is not in Firestore either"""
+		pair = self.pairs().get(symbol)
+		if pair is not None:
+			return pair
+
+		with self.__load_lock:
+			if symbol not in self.__pairs and time.monotonic() - self.__loaded_at >= self.MISS_RELOAD_SECONDS:
+				self.__load()
+		return self.__pairs.get(symbol)
+
+	def has(self, symbol: str) -> bool:
+		return self.get(symbol) is not None
+
+	def data_range(self, symbol: str) -> tuple[int | None, int | None]:
+		"""Open times of the first and last candle of the symbol, reloaded once older than `ttl` seconds"""
+		cached = self.__ranges.get(symbol)
+		if cached is not None and time.monotonic() - cached[0] < self.ttl:
+			return cached[1], cached[2]
+
+		start_time, end_time = self.__range_loader(symbol)
+		with self.__lock:
+			self.__ranges[symbol] = (time.monotonic(), start_time, end_time)
+		return start_time, end_time
+
+	def add(self, pair: dict):
+		"""Add a saved pair document, or merge it into the cached one"""
+		with self.__lock:
+			if self.__pairs is not None:
+				self.__pairs = self.__pairs | {pair['token_id']: self.__pairs.get(pair['token_id'], {}) | pair}
+
+	def update(self, symbol: str, fields: dict):
+		"""Set fields of a cached pair document, nested fields given as dotted paths like Firestore updates"""
+		with self.__lock:
+			if self.__pairs is None or symbol not in self.__pairs:
+				return
+
+			pair = dict(self.__pairs[symbol])
+			for path, value in fields.items():
+				*parents, name = path.split('.')
+				parent = pair
+				for key in parents:
+					parent[key] = dict(parent.get(key) or {})
+					parent = parent[key]
+				parent[name] = value
+			self.__pairs = self.__pairs | {symbol: pair}
+
+	def invalidate(self, symbol: str | None = None):
+		"""Drop the cached range of the symbol, or reload everything on next use unless given"""
+		with self.__lock:
+			if symbol is not None:
+				self.__ranges.pop(symbol, None)
+				return
+			self.__ranges.clear()
+			self.__loaded_at = -float('inf')
+
+	def refresh(self):
+		"""Reload the pairs now"""
+		with self.__load_lock:
+			self.__load()
+
+	def watch(self):
+		"""Start the snapshot listener, if any"""
+		with self.__lock:
+			if self.__watcher is None or self.__watching:
+				return
+			self.__watching = True
+
+		# Outside the lock, as the listener may deliver the first snapshot before returning
+		watch = self.__watcher(self.__replace)
+		with self.__lock:
+			self.__watch = watch
+
+	def close(self):
+		with self.__lock:
+			watch = self.__watch
+			self.__watch = None
+			self.__watching = False
+		if watch is not None:
+			watch.unsubscribe()
+
+	def __load(self):
+		self.__replace(self.__loader())
+
+	def __replace(self, pairs: dict[str, dict]):
+		with self.__lock:
+			self.__pairs = pairs
+			self.__loaded_at = time.monotonic()
+
+	def __reload_in_background(self):
+		with self.__lock:
+			if self.__reloading:
+				return
+			self.__reloading = True
+		threading.Thread(target=self.__reload, name='symbol-registry', daemon=True).start()
+
+	def __reload(self):
+		try:
+			with self.__load_lock:
+				if time.monotonic() - self.__loaded_at >= self.ttl:
+					self.__load()
+		except Exception:
+			# The stale pairs keep being served, the next request tries again
+			log_warning({'message': 'Symbol registry reload failed', 'error': traceback.format_exc()})
+		finally:
+			with self.__lock:
+				self.__reloading = False
@@ -1,3 +1,832 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import pytz
+from django.conf import settings
+from django.test import SimpleTestCase
+from google.api_core.exceptions import PermissionDenied, ServiceUnavailable
+
+from api_v2.batch_writer import BatchWriter, document_size
+from api_v2.candle_arena import CandleArena
+from api_v2.candle_store import CandleStore
+from api_v2.firebase import (
+	FirebaseCandle,
+	bucket_arrays,
+	bucket_candles,
+	bucket_start,
+	candle_hash,
+	merge_arrays,
+	next_bucket,
+	pack_candles,
+	series_metadata,
+	unpack_candles,
+)
+from api_v2.job_queue import DONE, FAILED, QUEUED, RUNNING, JobQueue
+from api_v2.job_worker import JobWorker
+from api_v2.kline_cache import KlineCache
+from api_v2.parallel_reader import ParallelReader
+from api_v2.symbol_registry import SymbolRegistry
+from api_v2.token_verifier import TokenVerifier
+from api_v2.ttl_cache import TTLCache
+from api_v2.write_behind import WriteBehindQueue
+
+ORACLE_DIR = settings.BASE_DIR / 'core' / 'oracles'
+
+
+class FakeCandleSource:
+	def __init__(self, candles: list[dict]):
+		self.candles = candles
+		self.since = []
+
+	def fetch_since(self, timestamp=None):
+		self.since.append(timestamp)
+		return self.candles
+
+
+class TestCandleStore(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+
+	def test_candle_store_sync(self):
+		candles = self.ohlc_data.to_dict('records')
+		with tempfile.TemporaryDirectory() as directory:
+			source = FakeCandleSource(candles[:100])
+			store = CandleStore('BTCUSDT', '1h', directory=directory, source=source)
+			self.assertEqual(len(store.read()), 0)
+			self.assertIsNone(store.watermark())
+
+			self.assertEqual(store.sync(), 100)
+			pd.testing.assert_frame_equal(store.read(), self.ohlc_data.iloc[:100], check_dtype=False)
+
+			# The last candle is fetched again and replaced, an open time in seconds is converted to ms
+			source.candles = [
+				{**candles[99], 'Close': 1.0},
+				*candles[100:200],
+				{**candles[200], 'Open Time': candles[200]['Open Time'] // 1000, 'Volume': None},
+			]
+			self.assertEqual(store.sync(), 102)
+			self.assertEqual(source.since, [None, candles[99]['Open Time']])
+			self.assertEqual(store.sync(max_age=60), 0)
+
+			df = store.read()
+			self.assertEqual(len(df), 201)
+			self.assertEqual(df['Open Time'].dtype, np.int64)
+			self.assertEqual(df['Close'].iloc[99], 1.0)
+			self.assertTrue(np.isnan(df['Volume'].iloc[200]))
+			pd.testing.assert_frame_equal(df.iloc[100:200], self.ohlc_data.iloc[100:200], check_dtype=False)
+
+			# Reads are views of the memory map from the start time and before the end time
+			start_time, end_time = candles[10]['Open Time'], candles[20]['Open Time']
+			df = CandleStore('BTCUSDT', '1h', directory=directory).read(start_time, end_time)
+			self.assertEqual(df['Open Time'].tolist(), self.ohlc_data['Open Time'].iloc[10:20].tolist())
+			self.assertTrue(np.shares_memory(df['Close'].to_numpy(), store.load()))
+			self.assertEqual(len(store.read(end_time, start_time)), 0)
+
+	def test_candle_store_merge(self):
+		stored = CandleStore.to_array(
+			[{'Open Time': 1690848000000, 'Open': 1, 'High': 1, 'Low': 1, 'Close': 1, 'Volume': 1}]
+		)
+		fetched = CandleStore.to_array(
+			[
+				{'Open Time': time, 'Open': value, 'High': value, 'Low': value, 'Close': value, 'Volume': value}
+				for time, value in [(1690851600, 2), (1690840800000, 3), (1690848000000, 4), (1690851600000, 5)]
+			]
+		)
+		merged = CandleStore.merge(stored, fetched)
+		self.assertEqual(merged[0].view(np.int64).tolist(), [1690840800000, 1690848000000, 1690851600000])
+		self.assertEqual(merged[4].tolist(), [3, 4, 5])
+
+
+class TestCandleArena(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.source = FakeCandleSource(self.ohlc_data.to_dict('records')[:100])
+		self.arenas = []
+
+	def tearDown(self):
+		for arena in self.arenas:
+			arena.close()
+		self.directory.cleanup()
+
+	def arena(self, symbols=('BTCUSDT',)) -> CandleArena:
+		arena = CandleArena(
+			'test',
+			list(symbols),
+			'1h',
+			'binance',
+			directory=self.directory.name,
+			sources=lambda *_: self.source,
+		)
+		self.arenas.append(arena)
+		return arena
+
+	def test_candle_arena(self):
+		owner = self.arena()
+		owner.create()
+		reader = self.arena()
+		self.assertFalse(self.arena([]).has('BTCUSDT', '1h', 'binance'))
+		self.assertFalse(reader.has('BTCUSDT', '4h', 'binance'))
+		self.assertIsNone(reader.read('ETHUSDT', '1h', 'binance'))
+		self.assertEqual(reader.generation('BTCUSDT', '1h', 'binance'), 0)
+
+		# A single process owns the refreshes
+		self.assertTrue(owner.owner())
+		self.assertFalse(reader.owner())
+		self.assertEqual(owner.refresh(), 100)
+		self.assertEqual(reader.generation('BTCUSDT', '1h', 'binance'), 1)
+
+		df = reader.read('BTCUSDT', '1h', 'binance')
+		pd.testing.assert_frame_equal(df, self.ohlc_data.iloc[:100], check_dtype=False)
+		start_time, end_time = self.ohlc_data['Open Time'].iloc[10], self.ohlc_data['Open Time'].iloc[20]
+		sliced = reader.read('BTCUSDT', '1h', 'binance', start_time, end_time)
+		self.assertEqual(sliced['Open Time'].tolist(), self.ohlc_data['Open Time'].iloc[10:20].tolist())
+		self.assertTrue(np.shares_memory(sliced['Close'].to_numpy(), df['Close'].to_numpy()))
+		self.assertFalse(df['Close'].to_numpy().flags.writeable)
+
+		# New candles are seen through the generation counter, earlier reads are left as they were
+		self.source.candles = self.ohlc_data.to_dict('records')[99:150]
+		self.assertEqual(owner.refresh(), 51)
+		self.assertEqual(reader.generation('BTCUSDT', '1h', 'binance'), 2)
+		self.assertEqual(len(reader.read('BTCUSDT', '1h', 'binance')), 150)
+		self.assertEqual(len(df), 100)
+
+		# Another owner takes over once the lock is released
+		owner.close()
+		self.assertTrue(reader.owner())
+		self.source.candles = []
+		self.assertEqual(reader.refresh(), 0)
+		self.assertEqual(reader.generation('BTCUSDT', '1h', 'binance'), 2)
+
+	def test_candle_arena_recreated(self):
+		self.arena().refresh()
+		# Counters of a different set of pairs start again, a series left in the arena is published as is
+		arena = self.arena(['ETHUSDT', 'BTCUSDT'])
+		self.source.candles = []
+		arena.refresh()
+		self.assertEqual(arena.generation('BTCUSDT', '1h', 'binance'), 1)
+		self.assertEqual(arena.generation('ETHUSDT', '1h', 'binance'), 0)
+		self.assertEqual(len(arena.read('BTCUSDT', '1h', 'binance')), 100)
+
+
+class TestKlineCache(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+		cls.open_times = df['Open Time'].to_numpy()
+
+	def loader(self, loads: list, delay=0):
+		def load(token_pair, timeframe, platform, start_time, end_time):
+			time.sleep(delay)
+			loads.append((token_pair, start_time, end_time))
+			in_range = np.repeat(True, len(self.ohlc_data))
+			if start_time is not None:
+				in_range &= self.open_times >= start_time
+			if end_time is not None:
+				in_range &= self.open_times < end_time
+			return self.ohlc_data[in_range].reset_index(drop=True)
+
+		return load
+
+	def expected(self, start: int, end: int):
+		return self.ohlc_data.iloc[start:end].reset_index(drop=True)
+
+	def test_kline_cache_ranges(self):
+		cache = KlineCache()
+		loads = []
+		get = partial(cache.get, self.loader(loads), 'BTCUSDT', '1h', 'binance')
+		times = self.open_times
+
+		pd.testing.assert_frame_equal(get(times[100], times[200]), self.expected(100, 200))
+		pd.testing.assert_frame_equal(get(times[120], times[150]), self.expected(120, 150))
+		self.assertEqual(len(loads), 1)
+
+		# A range outside the cached one loads the union of both
+		pd.testing.assert_frame_equal(get(times[150], times[300]), self.expected(150, 300))
+		self.assertEqual(loads[-1], ('BTCUSDT', times[100], times[300]))
+		pd.testing.assert_frame_equal(get(times[100], times[300]), self.expected(100, 300))
+		self.assertEqual(get(None, times[50]).shape, (50, 6))
+		self.assertEqual(loads[-1], ('BTCUSDT', None, times[300]))
+		self.assertEqual(len(get(times[300], times[300])), 0)
+		self.assertEqual(len(loads), 3)
+
+		# Saved candles within the cached range are merged in and bump the version
+		version = cache.version('BTCUSDT', '1h', 'binance')
+		saved = self.expected(299, 301).assign(Close=[1.0, 2.0])
+		cache.merge('BTCUSDT', '1h', 'binance', saved)
+		df = get(times[290], times[300])
+		self.assertEqual(df['Close'].iloc[-1], 1.0)
+		self.assertEqual(len(loads), 3)
+		self.assertEqual(cache.version('BTCUSDT', '1h', 'binance'), version + 1)
+
+		cache.invalidate('BTCUSDT')
+		self.assertEqual(cache.size, 0)
+		pd.testing.assert_frame_equal(get(times[290], times[300]), self.expected(290, 300))
+		self.assertEqual(len(loads), 4)
+
+	def test_kline_cache_eviction(self):
+		loads = []
+		load = self.loader(loads)
+		cache = KlineCache(max_bytes=int(self.expected(0, 1000).memory_usage(index=True).sum()) * 2)
+
+		for symbol in ['BTCUSDT', 'ETHUSDT', 'BTCUSDT', 'SOLUSDT', 'BTCUSDT', 'ETHUSDT']:
+			cache.get(load, symbol, '1h', 'binance', self.open_times[0], self.open_times[1000])
+		self.assertEqual([symbol for symbol, _, _ in loads], ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'ETHUSDT'])
+		self.assertLessEqual(cache.size, cache.max_bytes)
+
+	def test_kline_cache_single_flight(self):
+		cache = KlineCache()
+		loads = []
+		load = self.loader(loads, delay=0.05)
+		results = [None] * 8
+
+		def get(i):
+			results[i] = cache.get(load, 'BTCUSDT', '1h', 'binance', self.open_times[10 + i], self.open_times[100])
+
+		threads = [threading.Thread(target=get, args=(i,)) for i in range(len(results))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertLessEqual(len(loads), 2)
+		for i, result in enumerate(results):
+			pd.testing.assert_frame_equal(result, self.expected(10 + i, 100))
+
+
+class TestSymbolRegistry(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.open_times = df['Open Time'].to_numpy()
+
+	def registry(self, pairs: dict, loads: list, **kwargs):
+		def load():
+			loads.append('pairs')
+			return dict(pairs)
+
+		def load_range(symbol):
+			loads.append(symbol)
+			return int(self.open_times[0]), int(self.open_times[-1])
+
+		return SymbolRegistry(load, load_range, **kwargs)
+
+	def test_symbol_registry_pairs(self):
+		pairs = {'BTCUSDT': {'token_id': 'BTCUSDT', 'from_token': 'BTC', 'to_token': 'USDT'}}
+		loads = []
+		registry = self.registry(pairs, loads)
+
+		self.assertTrue(registry.has('BTCUSDT'))
+		self.assertEqual(registry.get('BTCUSDT')['to_token'], 'USDT')
+		self.assertEqual(registry.symbols(), ['BTCUSDT'])
+		self.assertEqual(loads, ['pairs'])
+
+		# Unknown symbols reload the pairs at most every MISS_RELOAD_SECONDS
+		pairs['ETHUSDT'] = {'token_id': 'ETHUSDT', 'from_token': 'ETH', 'to_token': 'USDT'}
+		self.assertFalse(registry.has('ETHUSDT'))
+		self.assertEqual(loads, ['pairs'])
+		registry.MISS_RELOAD_SECONDS = 0
+		self.assertTrue(registry.has('ETHUSDT'))
+		self.assertFalse(registry.has('XRPUSDT'))
+		self.assertEqual(loads, ['pairs', 'pairs', 'pairs'])
+
+		registry.add({'token_id': 'XRPUSDT', 'from_token': 'XRP', 'to_token': 'USDT'})
+		self.assertEqual(registry.get('XRPUSDT')['from_token'], 'XRP')
+
+		registry.update('BTCUSDT', {'series.binance_1h': {'count': 10}, 'series.binance_1d': {'count': 1}})
+		registry.update('BTCUSDT', {'series.binance_1h': {'count': 20}})
+		self.assertEqual(registry.get('BTCUSDT')['series'], {'binance_1h': {'count': 20}, 'binance_1d': {'count': 1}})
+		registry.add({'token_id': 'BTCUSDT', 'from_token': 'BTC', 'to_token': 'GBP'})
+		self.assertEqual(registry.get('BTCUSDT')['series']['binance_1h'], {'count': 20})
+		self.assertNotIn('series', pairs['BTCUSDT'])
+
+	def test_symbol_registry_reload(self):
+		pairs = {'BTCUSDT': {'token_id': 'BTCUSDT', 'from_token': 'BTC', 'to_token': 'USDT'}}
+		loads = []
+		registry = self.registry(pairs, loads, ttl=0)
+		self.assertEqual(list(registry.pairs()), ['BTCUSDT'])
+
+		# Stale pairs are served while reloaded in the background
+		pairs['ETHUSDT'] = {'token_id': 'ETHUSDT', 'from_token': 'ETH', 'to_token': 'USDT'}
+		self.assertIn(len(registry.pairs()), (1, 2))
+		deadline = time.monotonic() + 5
+		while 'ETHUSDT' not in registry.pairs() and time.monotonic() < deadline:
+			time.sleep(0.01)
+		self.assertIn('ETHUSDT', registry.pairs())
+
+	def test_symbol_registry_watch(self):
+		callbacks = []
+		watch = MagicMock()
+
+		def watcher(callback):
+			callbacks.append(callback)
+			return watch
+
+		registry = self.registry({}, [], watcher=watcher)
+		self.assertFalse(registry.has('BTCUSDT'))
+		self.assertEqual(len(callbacks), 1)
+
+		callbacks[0]({'BTCUSDT': {'token_id': 'BTCUSDT', 'from_token': 'BTC', 'to_token': 'USDT'}})
+		self.assertTrue(registry.has('BTCUSDT'))
+		registry.close()
+		watch.unsubscribe.assert_called_once()
+
+	def test_symbol_registry_ranges(self):
+		loads = []
+		registry = self.registry({}, loads)
+		first, last = int(self.open_times[0]), int(self.open_times[-1])
+
+		self.assertEqual(registry.data_range('BTCUSDT'), (first, last))
+		self.assertEqual(registry.data_range('BTCUSDT'), (first, last))
+		self.assertEqual(loads, ['BTCUSDT'])
+
+		registry.invalidate('BTCUSDT')
+		self.assertEqual(registry.data_range('BTCUSDT'), (first, last))
+		self.assertEqual(loads, ['BTCUSDT', 'BTCUSDT'])
+
+
+class TestPackedCandles(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+
+	def test_pack_candles(self):
+		day = self.ohlc_data.iloc[:24].reset_index(drop=True)
+		packed = pack_candles(day)
+		self.assertIsInstance(packed, bytes)
+		self.assertLess(len(packed), len(json.dumps(day.to_dict('records'))) / 2)
+		pd.testing.assert_frame_equal(unpack_candles(packed), day, check_dtype=False)
+
+		empty = unpack_candles(pack_candles(day.iloc[:0]))
+		self.assertEqual(empty.columns.to_list(), day.columns.to_list())
+		self.assertEqual(len(empty), 0)
+
+		missing = day.astype({'Volume': object})
+		missing.loc[3, 'Volume'] = None
+		self.assertTrue(np.isnan(unpack_candles(pack_candles(missing))['Volume'].iloc[3]))
+		self.assertRaises(ValueError, unpack_candles, b'\x09' + packed[1:])
+
+	def test_candle_hash(self):
+		day = self.ohlc_data.iloc[:24].reset_index(drop=True)
+		self.assertEqual(candle_hash(day), candle_hash(unpack_candles(pack_candles(day))))
+		self.assertEqual(candle_hash(day), candle_hash(pd.DataFrame(day.to_dict('records'))))
+		self.assertNotEqual(candle_hash(day), candle_hash(day.assign(Close=day['Close'] + 0.01)))
+
+		missing = day.astype({'Volume': object})
+		missing.loc[3, 'Volume'] = None
+		self.assertEqual(candle_hash(missing), candle_hash(missing.astype({'Volume': np.float64})))
+		self.assertNotEqual(candle_hash(missing), candle_hash(day))
+
+	def test_bucket_candles(self):
+		days = [self.ohlc_data.iloc[i : i + 24] for i in range(0, 240, 24)]
+		packed = [{'date': None, 'packed': pack_candles(day)} for day in days]
+		listed = [{'date': None, 'candles': day.to_dict('records')} for day in days]
+		expected = self.ohlc_data.iloc[:240]
+
+		pd.testing.assert_frame_equal(bucket_candles(listed), expected, check_dtype=False)
+		pd.testing.assert_frame_equal(bucket_candles(packed), expected, check_dtype=False)
+		mixed = packed[:3] + listed[3:7] + packed[7:]
+		pd.testing.assert_frame_equal(bucket_candles(mixed), expected, check_dtype=False)
+		self.assertEqual(len(bucket_candles([])), 0)
+
+
+class TestCandleBuckets(SimpleTestCase):
+	def test_bucket_start(self):
+		date = datetime(2024, 2, 29, 13, 30, tzinfo=pytz.UTC)
+		self.assertEqual(bucket_start(date, 'day'), datetime(2024, 2, 29, tzinfo=pytz.UTC))
+		self.assertEqual(bucket_start(date, 'week'), datetime(2024, 2, 26, tzinfo=pytz.UTC))
+		self.assertEqual(bucket_start(date, 'month'), datetime(2024, 2, 1, tzinfo=pytz.UTC))
+		self.assertEqual(next_bucket(bucket_start(date, 'week'), 'week'), datetime(2024, 3, 4, tzinfo=pytz.UTC))
+		self.assertEqual(next_bucket(bucket_start(date, 'month'), 'month'), datetime(2024, 3, 1, tzinfo=pytz.UTC))
+		self.assertEqual(next_bucket(datetime(2024, 12, 1, tzinfo=pytz.UTC), 'month').year, 2025)
+		self.assertRaises(ValueError, next_bucket, date, 'year')
+
+	def test_split_buckets(self):
+		start = int(datetime(2024, 1, 30, tzinfo=pytz.UTC).timestamp() * 1000)
+		open_times = np.concatenate([start + np.arange(72) * 3600000, [start + 40 * 86400000]])
+		candles = pd.DataFrame({'Open Time': open_times, 'Close': np.arange(len(open_times), dtype=np.float64)})
+
+		buckets = FirebaseCandle.split_buckets(candles, 'month')
+		self.assertEqual([start.month for start, _ in buckets], [1, 2, 3])
+		self.assertEqual(buckets[0][0], datetime(2024, 1, 1, tzinfo=pytz.UTC))
+		self.assertEqual([len(bucket) for _, bucket in buckets], [48, 24, 1])
+		self.assertEqual([len(bucket) for _, bucket in FirebaseCandle.split_buckets(candles, 'day')], [24, 24, 24, 1])
+		self.assertEqual(FirebaseCandle.split_buckets(candles.iloc[:0], 'week'), [])
+
+	def test_series_metadata(self):
+		start = int(datetime(2024, 1, 1, tzinfo=pytz.UTC).timestamp() * 1000)
+		metadata = series_metadata(start, start + 99 * 3600000, 95, '1h')
+		self.assertEqual(metadata, {'start_time': start, 'end_time': start + 99 * 3600000, 'count': 95, 'gaps': 5})
+		self.assertEqual(series_metadata(start, start + 9 * 86400000, 10, '1d')['gaps'], 0)
+		self.assertEqual(
+			series_metadata(None, None, 0, '1h'), {'start_time': None, 'end_time': None, 'count': 0, 'gaps': 0}
+		)
+
+
+class FakeBatchClient:
+	def __init__(self, failures: list[Exception] = ()):
+		self.failures = list(failures)
+		self.committed = []
+		self.lock = threading.Lock()
+
+	def batch(self):
+		batch = MagicMock()
+		batch.commit.side_effect = lambda: self.commit(batch)
+		return batch
+
+	def commit(self, batch):
+		with self.lock:
+			if len(self.failures) > 0:
+				raise self.failures.pop(0)
+			self.committed.append([(call[0], call.args[0].path) for call in batch.method_calls if call[0] != 'commit'])
+
+
+class TestBatchWriter(SimpleTestCase):
+	def ref(self, i: int):
+		return MagicMock(path=f'Candle/BTCUSDT/binance_1h/{i}')
+
+	def test_batch_writer_chunks(self):
+		client = FakeBatchClient()
+		with BatchWriter(client, max_operations=3, max_workers=4) as writer:
+			for i in range(7):
+				writer.set(self.ref(i), {'value': i})
+			writer.delete(self.ref(7))
+
+		self.assertEqual(writer.operations, 8)
+		self.assertEqual(writer.batches, 3)
+		self.assertEqual(sorted(len(batch) for batch in client.committed), [2, 3, 3])
+		writes = [write for batch in client.committed for write in batch]
+		self.assertIn(('delete', 'Candle/BTCUSDT/binance_1h/7'), writes)
+
+		client = FakeBatchClient()
+		with BatchWriter(client, max_bytes=200, max_workers=1) as writer:
+			for i in range(3):
+				writer.set(self.ref(i), {'packed': bytes(100)})
+		self.assertEqual([len(batch) for batch in client.committed], [1, 1, 1])
+
+		self.assertEqual(document_size({'date': datetime(2024, 1, 1), 'candles': [{'Open': 1.0}, {'Open': None}]}), 40)
+
+	def test_batch_writer_errors(self):
+		client = FakeBatchClient([ServiceUnavailable('retry'), ServiceUnavailable('retry')])
+		with BatchWriter(client, max_workers=2, backoff=0) as writer:
+			writer.set(self.ref(0), {'value': 0})
+		self.assertEqual(len(client.committed), 1)
+
+		client = FakeBatchClient([PermissionDenied('denied')])
+		writer = BatchWriter(client, max_operations=1, max_workers=2, backoff=0)
+		writer.set(self.ref(0), {'value': 0})
+		writer.set(self.ref(1), {'value': 1})
+		self.assertRaises(PermissionDenied, writer.close)
+		self.assertEqual(writer.operations, 1)
+
+		client = FakeBatchClient([ServiceUnavailable('retry')] * 3)
+		with self.assertRaises(ServiceUnavailable):
+			with BatchWriter(client, retries=2, backoff=0, max_workers=1) as writer:
+				writer.set(self.ref(0), {'value': 0})
+
+
+class FakeAsyncQuery:
+	def __init__(self, client: 'FakeAsyncClient', docs: list[dict]):
+		self.client = client
+		self.docs = docs
+
+	def order_by(self, field: str):
+		return FakeAsyncQuery(self.client, sorted(self.docs, key=lambda doc: doc[field]))
+
+	def where(self, filter):
+		compare = {'>=': lambda a, b: a >= b, '<': lambda a, b: a < b}[filter.op_string]
+		return FakeAsyncQuery(self.client, [doc for doc in self.docs if compare(doc[filter.field_path], filter.value)])
+
+	async def stream(self):
+		self.client.running += 1
+		self.client.max_running = max(self.client.max_running, self.client.running)
+		await asyncio.sleep(0.02)
+		self.client.running -= 1
+		for doc in self.docs:
+			yield MagicMock(to_dict=lambda doc=doc: doc)
+
+
+class FakeAsyncClient:
+	def __init__(self, docs: list[dict]):
+		self.docs = docs
+		self.paths = []
+		self.running = 0
+		self.max_running = 0
+
+	def collection(self, *path: str):
+		self.paths.append(path)
+		return FakeAsyncQuery(self, self.docs)
+
+
+class TestParallelReader(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+
+		cls.days = []
+		for i in range(0, len(df), 24):
+			candles = df.iloc[i : i + 24]
+			date = datetime.fromtimestamp(candles['Open Time'].iloc[0] / 1000, tz=pytz.UTC)
+			cls.days.append({'date': date, 'packed': pack_candles(candles)})
+
+	def test_parallel_reader(self):
+		client = FakeAsyncClient(self.days)
+		reader = ParallelReader(client)
+		dates = [day['date'] for day in self.days]
+		partitions = [(None, dates[10]), (dates[10], dates[50]), (dates[50], None)]
+		path = ('Candle', 'BTCUSDT', 'binance_1h')
+
+		parts = reader.read(path, partitions, bucket_arrays)
+		self.assertEqual([len(open_times) for open_times, _ in parts], [240, 960, len(self.ohlc_data) - 1200])
+		self.assertEqual(client.max_running, 3)
+		self.assertEqual(client.paths, [path])
+
+		open_times, prices = merge_arrays(parts)
+		np.testing.assert_array_equal(open_times, self.ohlc_data['Open Time'].to_numpy())
+		np.testing.assert_array_equal(prices[3], self.ohlc_data['Close'].to_numpy())
+
+		open_times, prices = merge_arrays([])
+		self.assertEqual((open_times.shape, prices.shape), ((0,), (5, 0)))
+
+
+class TestTTLCache(SimpleTestCase):
+	def test_ttl_cache(self):
+		cache = TTLCache(ttl=60, max_size=2)
+		loads = []
+
+		def loader(value):
+			def load():
+				loads.append(value)
+				return value
+
+			return load
+
+		self.assertFalse(cache.get('a', loader(False)))
+		self.assertFalse(cache.get('a', loader(True)))
+		self.assertEqual(loads, [False])
+
+		# Expired values and values dropped beyond `max_size` are loaded again
+		cache.set('b', 1, ttl=0)
+		self.assertEqual(cache.get('b', loader(2)), 2)
+		cache.get('c', loader(3))
+		self.assertEqual(len(cache), 2)
+		self.assertEqual(cache.get('a', loader(True)), True)
+
+		cache.invalidate('a')
+		self.assertEqual(cache.get('a', loader(4)), 4)
+		cache.clear()
+		self.assertEqual(len(cache), 0)
+
+		# The TTL of a loaded value may depend on it
+		self.assertEqual(cache.get('d', loader(-1), ttl=lambda value: value), -1)
+		self.assertEqual(cache.get('d', loader(5), ttl=lambda value: value), 5)
+		self.assertEqual(cache.get('d', loader(6)), 5)
+
+		# Values with no TTL left are not kept, e.g. users not found yet
+		cache.get('e', loader(False), ttl=lambda value: None if value else 0)
+		self.assertTrue(cache.get('e', loader(True), ttl=lambda value: None if value else 0))
+		self.assertTrue(cache.get('e', loader(False)))
+
+
+class TestTokenVerifier(SimpleTestCase):
+	def test_token_verifier(self):
+		verified = []
+
+		def verify(token: str) -> dict:
+			verified.append(token)
+			if token == 'invalid':
+				raise ValueError('Invalid token')
+			return {'uid': token, 'exp': time.time() + (-1 if token == 'expired' else 3600)}
+
+		verifier = TokenVerifier(verify, max_size=2)
+		self.assertEqual(verifier.claims('a')['uid'], 'a')
+		self.assertEqual(verifier.claims('a')['uid'], 'a')
+		self.assertEqual(verified, ['a'])
+
+		# Neither expired nor invalid tokens are cached
+		for token in ('expired', 'expired', 'invalid', 'invalid'):
+			try:
+				verifier.claims(token)
+			except ValueError:
+				pass
+		self.assertEqual(verified, ['a', 'expired', 'expired', 'invalid', 'invalid'])
+
+		verifier.claims('b')
+		verifier.claims('c')
+		verifier.claims('a')
+		self.assertEqual(verified[-3:], ['b', 'c', 'a'])
+		verifier.clear()
+		verifier.claims('c')
+		self.assertEqual(verified[-1], 'c')
+
+
+class TestWriteBehindQueue(SimpleTestCase):
+	def ref(self, i: int):
+		return MagicMock(path=f'User/uid/backtest_history/{i}')
+
+	def test_write_behind_queue(self):
+		client = FakeBatchClient()
+		writes = WriteBehindQueue(client, max_operations=3, backoff=0)
+		for i in range(7):
+			writes.set(self.ref(i), {'profit': i})
+		writes.flush()
+
+		self.assertEqual(writes.written, 7)
+		paths = [path for batch in client.committed for _, path in batch]
+		self.assertEqual(paths, [f'User/uid/backtest_history/{i}' for i in range(7)])
+		self.assertTrue(all(len(batch) <= 3 for batch in client.committed))
+
+		# Failed batches are retried, then logged and dropped
+		client.failures = [ServiceUnavailable('retry'), PermissionDenied('denied')]
+		with patch('api_v2.write_behind.log_error') as log_error:
+			writes.set(self.ref(7), {'profit': 7})
+			writes.flush()
+		self.assertEqual((writes.written, writes.failed), (7, 1))
+		self.assertEqual(log_error.call_args.args[0]['documents'], ['User/uid/backtest_history/7'])
+
+		writes.set(self.ref(8), {'profit': 8})
+		writes.close()
+		self.assertEqual(writes.written, 8)
+
+	def test_write_behind_queue_full(self):
+		client = FakeBatchClient()
+		writes = WriteBehindQueue(client, max_size=1)
+		blocked = threading.Event()
+		release = threading.Event()
+
+		# Hold the thread in its first commit so that the queue fills up
+		commit = client.commit
+
+		def slow_commit(batch):
+			blocked.set()
+			release.wait(5)
+			commit(batch)
+
+		client.commit = slow_commit
+		writes.set(self.ref(0), {'profit': 0})
+		blocked.wait(5)
+		writes.set(self.ref(1), {'profit': 1})
+		ref = self.ref(2)
+		writes.set(ref, {'profit': 2})
+		ref.set.assert_called_once_with({'profit': 2})
+
+		release.set()
+		writes.close()
+		self.assertEqual(writes.written, 2)
+
+
+class TestJobQueue(SimpleTestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.queue = JobQueue(f'{self.directory.name}/jobs.sqlite3')
+
+	def tearDown(self):
+		self.queue.close()
+		self.directory.cleanup()
+
+	def test_claim(self):
+		first = self.queue.enqueue('a', 'batch', {'symbol': 'BTCGBP'})
+		second = self.queue.enqueue('a', 'backtest', {})
+		third = self.queue.enqueue('b', 'optimize', {})
+		self.assertRaises(ValueError, self.queue.enqueue, 'a', 'monte-carlo', {})
+		self.assertEqual(self.queue.get(first)['status'], QUEUED)
+		self.assertEqual(self.queue.get(first)['payload'], {'symbol': 'BTCGBP'})
+		self.assertEqual(self.queue.pending('a'), 2)
+
+		# The second job of `a` waits for the first, being limited to one job at once
+		self.assertEqual(self.queue.claim('worker-1', 1)['id'], first)
+		self.assertEqual(self.queue.claim('worker-2', 1)['id'], third)
+		self.assertIsNone(self.queue.claim('worker-3', 1))
+		self.assertEqual(self.queue.claim('worker-3', 2)['id'], second)
+
+		self.queue.progress(first, 0.5)
+		self.assertEqual(self.queue.get(first)['progress'], 0.5)
+		self.queue.complete(first, {'profit': np.float64(1.5)})
+		self.queue.fail(third, 'Invalid symbol')
+		self.assertEqual(self.queue.get(first)['status'], DONE)
+		self.assertEqual(self.queue.get(first)['result'], {'profit': 1.5})
+		self.assertEqual(self.queue.get(third)['status'], FAILED)
+		self.assertEqual(self.queue.get(third)['error'], 'Invalid symbol')
+		self.assertEqual(self.queue.pending('a'), 1)
+
+		self.assertEqual(self.queue.prune(60), 0)
+		self.assertEqual(self.queue.prune(-1), 2)
+		self.assertIsNone(self.queue.get(first))
+		self.assertIsNone(self.queue.get('missing'))
+
+	def test_claim_concurrently(self):
+		jobs = {self.queue.enqueue(str(i), 'backtest', {}) for i in range(50)}
+		claimed = []
+
+		def claim(worker: str):
+			queue = JobQueue(self.queue.path)
+			while (job := queue.claim(worker, 1)) is not None:
+				claimed.append(job['id'])
+			queue.close()
+
+		threads = [threading.Thread(target=claim, args=(str(i),)) for i in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(sorted(claimed), sorted(jobs))
+
+	def test_release(self):
+		job_id = self.queue.enqueue('a', 'backtest', {})
+		self.queue.claim('worker-1', 1)
+		self.queue.progress(job_id, 0.5)
+		self.assertEqual(self.queue.release('worker-2'), 0)
+		self.assertEqual(self.queue.release('worker-1'), 1)
+		self.assertEqual(self.queue.get(job_id)['status'], QUEUED)
+		self.assertEqual(self.queue.get(job_id)['progress'], 0)
+
+		# A job stopping its worker every time fails
+		self.queue.claim('worker-1', 1)
+		self.assertEqual(self.queue.release(max_attempts=2), 0)
+		self.assertEqual(self.queue.get(job_id)['status'], FAILED)
+
+
+class TestJobWorker(SimpleTestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.queue = JobQueue(f'{self.directory.name}/jobs.sqlite3')
+
+	def tearDown(self):
+		self.queue.close()
+		self.directory.cleanup()
+
+	def test_run_once(self):
+		def batch(data: dict, progress):
+			progress(0.5)
+			self.assertEqual(self.queue.get(job_id)['status'], RUNNING)
+			self.assertEqual(self.queue.get(job_id)['progress'], 0.5)
+			return {'results': [data['symbol']]}
+
+		def backtest(data: dict, progress):
+			raise ValueError('There is no OHLC data in the specified period')
+
+		def optimize(data: dict, progress):
+			raise KeyError('token')
+
+		worker = JobWorker('worker', {'batch': batch, 'backtest': backtest, 'optimize': optimize}, queue=self.queue)
+		self.assertFalse(worker.run_once())
+
+		job_id = self.queue.enqueue('a', 'batch', {'symbol': 'BTCGBP'})
+		self.assertTrue(worker.run_once())
+		self.assertEqual(self.queue.get(job_id)['status'], DONE)
+		self.assertEqual(self.queue.get(job_id)['result'], {'results': ['BTCGBP']})
+
+		job_id = self.queue.enqueue('a', 'backtest', {})
+		worker.run_once()
+		self.assertEqual(self.queue.get(job_id)['error'], 'There is no OHLC data in the specified period')
+
+		job_id = self.queue.enqueue('a', 'optimize', {})
+		with patch('api_v2.job_worker.log_error') as log_error:
+			worker.run_once()
+		log_error.assert_called_once()
+		self.assertEqual(self.queue.get(job_id)['status'], FAILED)
+		self.assertEqual(self.queue.get(job_id)['error'], 'Internal server error')
+
+	def test_run(self):
+		stop = threading.Event()
+		job_id = self.queue.enqueue('a', 'batch', {})
+
+		def batch(data: dict, progress):
+			stop.set()
+			return {}
+
+		worker = JobWorker('worker', {'batch': batch}, queue=self.queue, poll=0.01)
+		thread = threading.Thread(target=worker.run, args=(stop,))
+		thread.start()
+		thread.join(5)
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(self.queue.get(job_id)['status'], DONE)
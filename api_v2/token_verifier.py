@@ -0,0 +1,53 @@
+import hashlib
+import time
+from typing import Callable
+
+import cachecontrol
+import firebase_admin.auth
+import requests
+from django.conf import settings
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2 import id_token
+
+from api_v2.ttl_cache import TTLCache
+
+TOKEN_CACHE_SIZE: int = settings.TOKEN_CACHE_SIZE
+# Longest lifetime of a Firebase or Google ID token
+MAX_TOKEN_SECONDS = 60 * 60
+
+
+class TokenVerifier:
+	"""
+	Claims of verified JWTs kept until the tokens expire, for up to `max_size` tokens, so that each is verified once.
+	Tokens failing verification are not cached, raising the error of `verify` every time.
+	"""
+
+	def __init__(self, verify: Callable[[str], dict], max_size: int = TOKEN_CACHE_SIZE):
+		self.__verify = verify
+		self.__claims = TTLCache(MAX_TOKEN_SECONDS, max_size)
+
+	def claims(self, token: str) -> dict:
+		# Hashed so that the cache holds no usable token
+		key = hashlib.sha256(token.encode('utf-8')).digest()
+		return self.__claims.get(key, lambda: self.__verify(token), ttl=lambda claims: claims['exp'] - time.time())
+
+	def clear(self):
+		self.__claims.clear()
+
+
+def verify_firebase_token(token: str) -> dict:
+	"""Claims of a Firebase ID token, verified by the Firebase Admin SDK against its cached public certificates"""
+	return firebase_admin.auth.verify_id_token(token)
+
+
+# Google public certificates are fetched again once expired by their `Cache-Control` header
+GOOGLE_CERTIFICATES = GoogleRequest(session=cachecontrol.CacheControl(requests.Session()))
+
+
+def verify_google_token(token: str) -> dict:
+	"""Claims of a Google-signed OIDC token for this server, e.g. from Cloud Scheduler, verified locally"""
+	return id_token.verify_oauth2_token(token, GOOGLE_CERTIFICATES, audience=settings.SERVER_API_URL)
+
+
+FIREBASE_TOKENS = TokenVerifier(verify_firebase_token)
+GOOGLE_TOKENS = TokenVerifier(verify_google_token)
@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class TTLCache:
+	"""
+	Values kept for `ttl` seconds, or their own TTL when set with one, values with a TTL of 0 or less not being kept.
+	The least recently used values are dropped beyond `max_size`.
+	"""
+
+	def __init__(self, ttl: float, max_size: int = 10000):
+		self.ttl = ttl
+		self.max_size = max_size
+		self.__entries: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+		self.__lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.__entries)
+
+	def get(self, key: Hashable, loader: Callable[[], T], ttl: Callable[[T], float] | None = None) -> T:
+		"""Cached value of `key`, otherwise loaded and cached, for `ttl(value)` seconds if given"""
+		with self.__lock:
+			entry = self.__entries.get(key)
+			if entry is not None and entry[0] > time.monotonic():
+				self.__entries.move_to_end(key)
+				return entry[1]
+
+		value = loader()
+		self.set(key, value, ttl(value) if ttl is not None else None)
+		return value
+
+	def set(self, key: Hashable, value, ttl: float | None = None):
+		if ttl is not None and ttl <= 0:
+			self.invalidate(key)
+			return
+
+		expires = time.monotonic() + (ttl if ttl is not None else self.ttl)
+		with self.__lock:
+			self.__entries[key] = (expires, value)
+			self.__entries.move_to_end(key)
+			while len(self.__entries) > self.max_size:
+				self.__entries.popitem(last=False)
+
+	def invalidate(self, key: Hashable):
+		with self.__lock:
+			self.__entries.pop(key, None)
+
+	def clear(self):
+		with self.__lock:
+			self.__entries.clear()
@@ -9,6 +9,12 @@ urlpatterns = [
 	path('ohlc-data', views.OhlcData.as_view(), name='get-ohlc-data'),
 	path('indicators', views.RunIndicators.as_view(), name='analyse-indicators'),
 	path('backtest', views.RunBacktest.as_view(), name='run-backtest'),
+	path('backtest/batch', views.RunBacktestBatch.as_view(), name='run-backtest-batch'),
+	path('backtest/optimize', views.RunBacktestOptimize.as_view(), name='run-backtest-optimize'),
+	path('backtest/monte-carlo', views.RunBacktestMonteCarlo.as_view(), name='run-backtest-monte-carlo'),
+	path('jobs', views.Jobs.as_view(), name='jobs'),
+	path('jobs/<str:job_id>', views.JobDetail.as_view(), name='job-detail'),
+	path('jobs/<str:job_id>/events', views.JobEvents.as_view(), name='job-events'),
 	path('check-login', views.CheckLoginStatus.as_view(), name='check-login'),
 	path('trade', views.TradeView.as_view(), name='trade'),
 	path('schedule', views.ScheduleView.as_view(), name='schedule'),
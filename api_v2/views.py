@@ -1,46 +1,58 @@
 import asyncio
 import calendar
+import inspect
 import json
+import time
 import traceback
 import urllib.error
 import urllib.request
+from concurrent.futures import Executor
 from datetime import datetime, timedelta
-from functools import lru_cache
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Callable
 
 import aiohttp
-import firebase_admin.auth
 import numpy as np
 import pandas as pd
-import requests
 from aiohttp import ClientSession
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema, inline_serializer
 from firebase_admin.auth import InvalidIdTokenError
-from google.cloud.firestore_v1.batch import WriteBatch
 from google.cloud.firestore_v1.client import Client
 from google.cloud.firestore_v1.collection import CollectionReference
 from google.cloud.firestore_v1.document import DocumentReference
 from rest_framework.authentication import get_authorization_header
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.serializers import BooleanField, CharField, FloatField, IntegerField, ListField
+from rest_framework.serializers import BooleanField, CharField, DictField, FloatField, IntegerField, ListField
 from rest_framework.views import APIView
 
-from api_v2.firebase import FirebaseCandle, FirebaseOrderBook, Platform
+from api_v2.candle_arena import CANDLE_ARENA
+from api_v2.candle_store import CandleStore
+from api_v2.firebase import SERIES_FIELD, SYMBOL_REGISTRY, FirebaseCandle, FirebaseOrderBook, Platform, series_name
+from api_v2.job_queue import FINISHED, JOB_KINDS, JOB_QUEUE, JOB_TIMES, QUEUED
+from api_v2.kline_cache import KLINE_CACHE
+from api_v2.token_verifier import FIREBASE_TOKENS, GOOGLE_TOKENS
+from api_v2.ttl_cache import TTLCache
+from api_v2.write_behind import WRITE_BEHIND
 from core.calculations import (
-	analyse_strategy,
+	IndicatorGraph,
+	StrategyProgram,
 	calculate,
-	calculate_amount,
-	combine_ohlc,
-	evaluate_expressions,
-	evaluate_values,
+	compile_strategy,
+	resample_ohlc,
 	validate_indicators,
-	validate_strategy,
 )
-from core.exceptions import NotEnoughTokenException
+from core.exceptions import ExecutorSaturatedException, NotEnoughTokenException
+from core.execution import BACKTEST_EXECUTOR, program_timeframes, run_backtest, run_batch, run_monte_carlo
+from core.instrumentation import timed
+from core.monte_carlo import METHODS as MONTE_CARLO_METHODS
+from core.optimization import METRICS, optimize_strategy, walk_forward
 from core.technical_analysis import TechnicalAnalysis, TechnicalAnalysisTemplate
 from machd.utils import clean_kraken_pair, log, log_error, log_warning
 
@@ -49,34 +61,53 @@ TA_TEMPLATES: TechnicalAnalysisTemplate = settings.TA_TEMPLATES
 DEFAULT_TIMEFRAME: str = settings.DEFAULT_TIMEFRAME
 DEFAULT_PLATFORM: str = settings.DEFAULT_PLATFORM
 INTERVAL_MAP: dict[str, int] = settings.INTERVAL_MAP
-DB_BATCH: WriteBatch = settings.DB_BATCH
 FIREBASE: Client = settings.FIREBASE
 BASE_DIR: Path = settings.BASE_DIR
+CANDLE_STORE_DIR: Path | None = settings.CANDLE_STORE_DIR
+CANDLE_STORE_SYNC_SECONDS: int = settings.CANDLE_STORE_SYNC_SECONDS
+USER_EXISTS = TTLCache(settings.USER_CACHE_TTL_SECONDS)
+PERIODS_PER_YEAR = 365 * 24 * 60 // INTERVAL_MAP[DEFAULT_TIMEFRAME]
+MAX_BATCH_BACKTESTS = 50
+MAX_OPTIMIZE_RESULTS = 50
+JOB_USER_PENDING: int = settings.JOB_USER_PENDING
+JOB_POLL_SECONDS: float = settings.JOB_POLL_SECONDS
 
 
 def authenticate_jwt(force_auth=False):
-	def decorator(view_func):
-		def wrapper(self, request: Request, *args, **kwargs):
-			if force_auth is False and (settings.DEBUG is True or settings.SKIP_AUTH is True):
-				return view_func(self, request, *args, **kwargs)
+	def authorised(request: Request) -> bool:
+		if force_auth is False and (settings.DEBUG is True or settings.SKIP_AUTH is True):
+			return True
 
-			uid = None
-			if request.method == 'POST':
-				uid = request.data.get('uid')
-			else:
-				uid = request.query_params.get('uid')
+		uid = None
+		if request.method == 'POST':
+			uid = request.data.get('uid')
+		else:
+			uid = request.query_params.get('uid')
 
-			try:
-				if uid is None:
-					raise ValueError
+		try:
+			if uid is None:
+				raise ValueError
 
-				jwt_token = get_authorization_header(request).decode('utf-8').split(' ')[1]
-				if uid != firebase_admin.auth.verify_id_token(jwt_token)['uid']:
-					raise ValueError
+			jwt_token = get_authorization_header(request).decode('utf-8').split(' ')[1]
+			return uid == FIREBASE_TOKENS.claims(jwt_token)['uid']
+		except (InvalidIdTokenError, IndexError, ValueError):
+			return False
 
-				return view_func(self, request, *args, **kwargs)
-			except (InvalidIdTokenError, IndexError, ValueError):
+	def decorator(view_func):
+		if inspect.iscoroutinefunction(view_func):
+
+			async def async_wrapper(self, request: Request, *args, **kwargs):
+				# Verifying a token not cached yet may fetch the Google certificates
+				if not await sync_to_async(authorised, thread_sensitive=False)(request):
+					return Response({'error': 'Unauthorised'}, status=403)
+				return await view_func(self, request, *args, **kwargs)
+
+			return async_wrapper
+
+		def wrapper(self, request: Request, *args, **kwargs):
+			if not authorised(request):
 				return Response({'error': 'Unauthorised'}, status=403)
+			return view_func(self, request, *args, **kwargs)
 
 		return wrapper
 
@@ -95,12 +126,12 @@ def authenticate_scheduler_oicd():
 				if len(token) < 2:
 					return Response({'error': 'Unauthorised'}, status=403)
 
-				auth = requests.get(settings.GOOGLE_AUTH_URL, params={'id_token': token[1]}).json()
+				# Verified locally, the signature and audience of the token raising otherwise
+				auth = GOOGLE_TOKENS.claims(token[1])
 
 				if (
-					'error' in auth.keys()
-					or auth['iss'] != settings.GOOGLE_AUTH_EMAIL
-					or auth['email'] != settings.GCLOUD_EMAIL
+					auth['iss'] != settings.GOOGLE_AUTH_EMAIL
+					or auth.get('email') != settings.GCLOUD_EMAIL
 					or auth['aud'] != settings.SERVER_API_URL
 				):
 					return Response({'error': 'Unauthorised'}, status=403)
@@ -117,11 +148,25 @@ def authenticate_scheduler_oicd():
 
 def error_logger():
 	def decorator(view_func):
+		def log(request: Request):
+			log_error({'query': request.query_params, 'data': request.data, 'error': traceback.format_exc()})
+
+		if inspect.iscoroutinefunction(view_func):
+
+			async def async_wrapper(self, request: Request, *args, **kwargs):
+				try:
+					return await view_func(self, request, *args, **kwargs)
+				except Exception:
+					log(request)
+					raise
+
+			return async_wrapper
+
 		def wrapper(self, request: Request, *args, **kwargs):
 			try:
 				return view_func(self, request, *args, **kwargs)
 			except Exception:
-				log_error({'query': request.query_params, 'data': request.data, 'error': traceback.format_exc()})
+				log(request)
 				raise
 
 		return wrapper
@@ -129,6 +174,38 @@ def error_logger():
 	return decorator
 
 
+class AsyncAPIView(APIView):
+	"""
+	`APIView` with coroutine handlers, which an ASGI server runs on its event loop.
+	Handlers must not block, running blocking calls with `sync_to_async` and CPU bound work in `BACKTEST_EXECUTOR`.
+	"""
+
+	async def dispatch(self, request, *args, **kwargs):
+		self.args = args
+		self.kwargs = kwargs
+		request = self.initialize_request(request, *args, **kwargs)
+		self.request = request
+		self.headers = self.default_response_headers
+
+		try:
+			# Authentication may read the session from the database
+			await sync_to_async(self.initial)(request, *args, **kwargs)
+
+			if request.method.lower() in self.http_method_names:
+				handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+			else:
+				handler = self.http_method_not_allowed
+
+			response = handler(request, *args, **kwargs)
+			if inspect.isawaitable(response):
+				response = await response
+		except Exception as exc:
+			response = self.handle_exception(exc)
+
+		self.response = self.finalize_response(request, response, *args, **kwargs)
+		return self.response
+
+
 def validate_symbol_timeframe(
 	symbol: str,
 	timeframe: str,
@@ -141,9 +218,7 @@ def validate_symbol_timeframe(
 	if timeframe is None or timeframe == '':
 		raise ValueError('Missing "timeframe"!')
 
-	PAIRS = [pair['token_id'] for pair in FirebaseCandle().fetch_pairs()]
-
-	if symbol not in PAIRS:
+	if not SYMBOL_REGISTRY.has(symbol):
 		raise ValueError(f'Invalid symbol "{symbol}"!')
 
 	if timeframe not in settings.INTERVAL_MAP:
@@ -162,24 +237,108 @@ def validate_symbol_timeframe(
 		raise ValueError(f'Invalid end time "{end_time}"!')
 
 
-@lru_cache(maxsize=8)
-def fetch_kline(symbol: str, timeframe: str, start_time: int = None, end_time: int = None):
-	firebase = FirebaseCandle(symbol, timeframe, DEFAULT_PLATFORM)
+def validate_backtest_settings(capital_amount=None, take_profit=None, stop_loss=None, trade_limit=None):
+	try:
+		if capital_amount is None:
+			capital_amount = 10000
+		else:
+			capital_amount = float(capital_amount)
+	except ValueError:
+		raise ValueError(f'Invalid capital amount "{capital_amount}"!')
+
+	if capital_amount <= 0:
+		raise ValueError(f'Invalid capital amount {capital_amount}! (Expected > 0)')
+
+	if capital_amount > 1e7:
+		raise ValueError('Capital amount too big! (Expected < 1,000,000)')
+
+	if take_profit is not None:
+		try:
+			take_profit = float(take_profit)
+		except ValueError:
+			raise ValueError(f'Invalid take profit amount {take_profit}!')
+		if take_profit <= capital_amount:
+			raise ValueError(f'Invalid take profit amount {take_profit}! (Expected > {capital_amount})')
+
+	if stop_loss is not None:
+		try:
+			stop_loss = float(stop_loss)
+		except ValueError:
+			raise ValueError(f'Invalid stop loss amount {stop_loss}!')
+		if stop_loss >= capital_amount:
+			raise ValueError(f'Invalid stop loss amount {stop_loss}! (Expected < {capital_amount})')
+
+	if trade_limit is not None:
+		try:
+			trade_limit = int(trade_limit)
+		except ValueError:
+			raise ValueError(f'Invalid trade limit {trade_limit}!')
+		if trade_limit <= 0:
+			raise ValueError(f'Invalid trade limit {trade_limit}! (Expected > 0)')
+		elif trade_limit > 300:
+			raise ValueError(f'Invalid trade limit {trade_limit}! (Expected <= 300)')
+
+	return capital_amount, take_profit, stop_loss, trade_limit
 
+
+def load_kline(symbol: str, timeframe: str, platform: str, start_time: int = None, end_time: int = None):
+	"""`KlineCache` loader reading from Firestore"""
+	firebase = FirebaseCandle(symbol, timeframe, platform)
+	start_date = datetime.fromtimestamp(start_time / 1000) if start_time is not None else None
+	end_date = datetime.fromtimestamp(end_time / 1000) if end_time is not None else None
+	return pd.DataFrame(firebase.fetch(start_date, end_date))
+
+
+@timed('fetch_kline')
+def fetch_kline(symbol: str, timeframe: str, start_time: int = None, end_time: int = None):
+	"""
+	Candles as a dataframe, read from the shared `CANDLE_ARENA` for hot pairs, from the local `CandleStore`
+	when `CANDLE_STORE_DIR` is set, otherwise from Firestore through `KLINE_CACHE`
+	"""
 	if start_time is not None:
 		try:
-			start_time = datetime.fromtimestamp(int(start_time) / 1000)
+			start_time = int(start_time)
 		except ValueError:
 			raise ValueError(f'Invalid start time "{start_time}"')
 
 	if end_time is not None:
 		try:
-			end_time = datetime.fromtimestamp(int(end_time) / 1000)
+			end_time = int(end_time)
 		except ValueError:
 			raise ValueError(f'Invalid end time "{end_time}"')
 
-	data = firebase.fetch(start_time, end_time)
-	return data
+	data = CANDLE_ARENA.read(symbol, timeframe, DEFAULT_PLATFORM, start_time, end_time)
+	if data is not None:
+		return data
+
+	if CANDLE_STORE_DIR is not None:
+		store = CandleStore(symbol, timeframe, DEFAULT_PLATFORM)
+		store.sync(CANDLE_STORE_SYNC_SECONDS)
+		return store.read(start_time, end_time)
+
+	return KLINE_CACHE.get(load_kline, symbol, timeframe, DEFAULT_PLATFORM, start_time, end_time)
+
+
+def kline_version(symbol: str):
+	"""Changes whenever the `DEFAULT_TIMEFRAME` candles of `symbol` do"""
+	generation = CANDLE_ARENA.generation(symbol, DEFAULT_TIMEFRAME, DEFAULT_PLATFORM)
+	if generation > 0:
+		return ('arena', generation)
+	if CANDLE_STORE_DIR is not None:
+		return CandleStore(symbol, DEFAULT_TIMEFRAME, DEFAULT_PLATFORM).version()
+	return KLINE_CACHE.version(symbol, DEFAULT_TIMEFRAME, DEFAULT_PLATFORM)
+
+
+@lru_cache(maxsize=32)
+def resample_kline(symbol: str, timeframe: str, start_time: int = None, end_time: int = None, version=None):
+	"""`DEFAULT_TIMEFRAME` klines resampled to `timeframe`, cached per symbol, timeframe, range and `kline_version`"""
+	data = fetch_kline(symbol=symbol, timeframe=DEFAULT_TIMEFRAME, start_time=start_time, end_time=end_time)
+	return resample_ohlc(data, timeframe, DEFAULT_TIMEFRAME)
+
+
+def kline_resampler(symbol: str, start_time: int = None, end_time: int = None):
+	"""`IndicatorGraph` resample function reading from the `resample_kline` cache"""
+	return partial(resample_kline, symbol, start_time=start_time, end_time=end_time, version=kline_version(symbol))
 
 
 # Check Login Status
@@ -212,26 +371,17 @@ class BacktestSymbols(APIView):
 	@error_logger()
 	def get(self, request: Request):
 		PAIRS = {}
-		for token in FirebaseCandle().fetch_pairs():
-			symbol = token['token_id']
-			from_token = token['from_token']
-			to_token = token['to_token']
-
-			firebase = FirebaseCandle(symbol, DEFAULT_TIMEFRAME, DEFAULT_PLATFORM)
-			start_time = None
-			end_time = None
-
-			first = firebase.fetch_first()
-			if len(first) > 0:
-				start_time = first[0]['Open Time']
+		for symbol, token in SYMBOL_REGISTRY.pairs().items():
+			metadata = (token.get(SERIES_FIELD) or {}).get(series_name(DEFAULT_TIMEFRAME, DEFAULT_PLATFORM))
+			if metadata is not None:
+				start_time, end_time = metadata['start_time'], metadata['end_time']
 			else:
+				# Pairs saved before the metadata was kept, until the backfill_candle_metadata command is run
+				start_time, end_time = SYMBOL_REGISTRY.data_range(symbol)
+			if start_time is None:
 				continue
 
-			last = firebase.fetch_last()
-			if len(last) > 0:
-				end_time = last[-1]['Open Time']
-
-			PAIRS[symbol] = {'FROM_TOKEN': from_token, 'TO_TOKEN': to_token}
+			PAIRS[symbol] = {'FROM_TOKEN': token['from_token'], 'TO_TOKEN': token['to_token']}
 			PAIRS[symbol][DEFAULT_TIMEFRAME] = {'START_TIME': start_time, 'END_TIME': end_time}
 
 		return Response(
@@ -294,14 +444,12 @@ class OhlcData(APIView):
 		try:
 			validate_symbol_timeframe(symbol, timeframe, start_time, end_time)
 			data = fetch_kline(symbol=symbol, timeframe=DEFAULT_TIMEFRAME, start_time=start_time, end_time=end_time)
-			if timeframe == DEFAULT_TIMEFRAME:
-				return Response({'ohlc_data': data})
-
-			df = pd.DataFrame(data)
-			df = combine_ohlc(df, int(settings.INTERVAL_MAP[timeframe] / settings.INTERVAL_MAP[DEFAULT_TIMEFRAME]))
-			df = df.replace(np.nan, None)
-			data = df.to_dict('records')
-			return Response({'ohlc_data': data})
+			if len(data) == 0:
+				return Response({'ohlc_data': []})
+
+			if timeframe != DEFAULT_TIMEFRAME:
+				data = kline_resampler(symbol, start_time, end_time)(timeframe).ohlc
+			return Response({'ohlc_data': data.replace(np.nan, None).to_dict('records')})
 		except ValueError as e:
 			return Response({'error': str(e)}, 400)
 
@@ -379,22 +527,165 @@ class RunIndicators(APIView):
 		if len(data) == 0:
 			return Response({'error': 'There is no OHLC data in the specified period'}, 400)
 
-		expressions = [
-			{'type': 'indicator', 'timeframe': timeframe, 'name': setting['indicator_name'], 'value': setting}
+		if not isinstance(indicator_settings, list):
+			indicator_settings = [indicator_settings]
+
+		graph = IndicatorGraph(
+			{DEFAULT_TIMEFRAME: data},
+			DEFAULT_TIMEFRAME,
+			resample=kline_resampler(symbol, start_time, end_time),
+		)
+		leaves = {
+			setting['indicator_name']: graph.add_indicator(
+				timeframe, setting['indicator_name'], setting.get('params', {})
+			)
 			for setting in indicator_settings
-		]
+		}
+		graph.compute()
+		results = {name: graph.value(leaf, True) for name, leaf in leaves.items()}
+
+		ohlc_data = data.replace(np.nan, None).to_dict('records') if return_ohlc is True else []
+		return Response({'ohlc_data': ohlc_data, 'indicators': results})
+
+
+def kline_frames(
+	symbol: str, start_time: int | None, end_time: int | None, df: pd.DataFrame, programs: list[StrategyProgram]
+) -> dict[str, pd.DataFrame]:
+	"""
+	`DEFAULT_TIMEFRAME` klines and the other timeframes of the programs, which come from the resample cache
+	of this process rather than being resampled in the worker running them
+	"""
+	resample = kline_resampler(symbol, start_time, end_time)
+	timeframes = set().union(*[program_timeframes(program) for program in programs]) - {DEFAULT_TIMEFRAME}
+	return {DEFAULT_TIMEFRAME: df} | {timeframe: resample(timeframe).ohlc for timeframe in timeframes}
+
+
+def prepare_backtest(data: dict) -> dict:
+	"""Validate the request and read what the backtest needs, raising `ValueError` for a bad request"""
+	uid = data.get('uid')
+	symbol = data.get('symbol', '').strip().upper()
+	buy_strategy = data.get('buy_strategy')
+	sell_strategy = data.get('sell_strategy')
+	return_ohlc = data.get('return_ohlc', 'true')
+	return_ohlc = return_ohlc != 'false' and return_ohlc is not False
+	start_time = data.get('start_time')
+	end_time = data.get('end_time')
+	capital_amount = data.get('capital_amount')
+	take_profit = data.get('take_profit')
+	stop_loss = data.get('stop_loss')
+	trade_limit = data.get('trade_limit')
+	backtest_date = timezone.now()
+
+	user_doc = None
+	if uid is not None and uid != '':
+		collection = FIREBASE.collection('User')
+		user_doc: DocumentReference = collection.document(uid)
+		# Only users found are cached, a user may be created right after a request without one
+		if not USER_EXISTS.get(uid, lambda: user_doc.get().exists, ttl=lambda exists: None if exists else 0):
+			user_doc = None
+
+	capital_amount, take_profit, stop_loss, trade_limit = validate_backtest_settings(
+		capital_amount, take_profit, stop_loss, trade_limit
+	)
 
-		df = pd.DataFrame(data)
-		values = evaluate_values({DEFAULT_TIMEFRAME: df}, expressions, True, DEFAULT_TIMEFRAME)
-		results = {value['name']: value['value'] for value in values}
+	validate_symbol_timeframe(symbol, DEFAULT_TIMEFRAME)
+	buy_program = compile_strategy(buy_strategy)
+	sell_program = compile_strategy(sell_strategy)
+	df = fetch_kline(
+		symbol=symbol,
+		timeframe=DEFAULT_TIMEFRAME,
+		start_time=start_time,
+		end_time=end_time,
+	)
 
-		return Response({'ohlc_data': data if return_ohlc is True else [], 'indicators': results})
+	if len(df) == 0:
+		raise ValueError('There is no OHLC data in the specified period')
+
+	frames = kline_frames(symbol, start_time, end_time, df, [buy_program, sell_program])
+	token = SYMBOL_REGISTRY.get(symbol)
+	return {
+		'date': backtest_date,
+		'symbol': symbol,
+		'from_token': token['from_token'],
+		'to_token': token['to_token'],
+		'start_time': start_time,
+		'end_time': end_time,
+		'trade_limit': trade_limit,
+		'return_ohlc': return_ohlc,
+		'buy_strategy': buy_strategy,
+		'sell_strategy': sell_strategy,
+		'user_doc': user_doc,
+		'frames': frames,
+		'options': {
+			'capital': capital_amount,
+			'unit_types': [token['to_token'], token['from_token']],
+			'stop_loss': stop_loss,
+			'take_profit': take_profit,
+			'trade_limit': trade_limit if trade_limit is not None else 100,  # Default 100 trades
+			'periods_per_year': PERIODS_PER_YEAR,
+		},
+	}
 
 
-class RunBacktest(APIView):
+def backtest_response(backtest: dict, result: dict) -> dict:
+	"""Backtest response of `run_backtest`, saving it to the backtest history of the user"""
+	capital_amount = backtest['options']['capital']
+	from_token, to_token = backtest['from_token'], backtest['to_token']
+	data = {
+		'date': backtest['date'],
+		'symbol': backtest['symbol'],
+		'from_token': from_token,
+		'to_token': to_token,
+		'trade_using': to_token,
+		'start_time': backtest['start_time'],
+		'end_time': backtest['end_time'],
+		'take_profit': backtest['options']['take_profit'],
+		'stop_loss': backtest['options']['stop_loss'],
+		'trade_limit': backtest['trade_limit'],
+		'capital': capital_amount,
+		'final_amount': result['final_amount'],
+		'profit': result['profit'],
+		'trade_events': result['trade_events'],
+		'buy_count': result['buy_count'],
+		'sell_count': result['sell_count'],
+		'buy_strategy': backtest['buy_strategy'],
+		'sell_strategy': backtest['sell_strategy'],
+		'stopped_by': result['stopped_by'],
+		'performance_report': result['performance_report'],
+	}
+
+	backtest_id = None
+	if backtest['user_doc'] is not None:
+		# The id is generated locally, the history is written after responding
+		subcollection: CollectionReference = backtest['user_doc'].collection('backtest_history')
+		doc_ref: DocumentReference = subcollection.document()
+		WRITE_BEHIND.set(doc_ref, data)
+		backtest_id = doc_ref.id
+
+	df = backtest['frames'][DEFAULT_TIMEFRAME]
+	ohlc_data = df.replace(np.nan, None).to_dict('records') if backtest['return_ohlc'] is True else []
+	return {**data, 'ohlc_data': ohlc_data, 'backtest_id': backtest_id}
+
+
+def backtest_job(data: dict, progress: Callable[[float], None] | None = None) -> dict:
+	"""Backtest of a job, run in the job worker itself rather than in `BACKTEST_EXECUTOR`"""
+	backtest = prepare_backtest(data)
+	if progress is not None:
+		progress(0.5)
+	result = run_backtest(
+		backtest['frames'],
+		DEFAULT_TIMEFRAME,
+		backtest['buy_strategy'],
+		backtest['sell_strategy'],
+		backtest['options'],
+	)
+	return backtest_response(backtest, result)
+
+
+class RunBacktest(AsyncAPIView):
 	@extend_schema(description='Get details of the endpoint')
 	@error_logger()
-	def get(self, request: Request):
+	async def get(self, request: Request):
 		return Response(
 			{
 				'example_request': {
@@ -593,6 +884,11 @@ class RunBacktest(APIView):
 						'max_equity_run_up': 94.5598540595347,
 						'max_drawdown': -28.420000000000073,
 						'max_drawdown_percentage': -0.0020064755078670555,
+						'equity_max_drawdown': -61.52000000000044,
+						'equity_max_drawdown_percentage': -0.006104512417546349,
+						'sharpe_ratio': 1.2841932571085493,
+						'sortino_ratio': 1.6942287403513316,
+						'exposure_time': 0.3125,
 						'total_trades': 1,
 						'winning_count': 1,
 						'losing_count': 0,
@@ -719,156 +1015,734 @@ class RunBacktest(APIView):
 	)
 	@authenticate_jwt()
 	@error_logger()
-	def post(self, request: Request):
-		uid = request.data.get('uid')
-		symbol = request.data.get('symbol', '').strip().upper()
-		buy_strategy = request.data.get('buy_strategy')
-		sell_strategy = request.data.get('sell_strategy')
-		return_ohlc = request.data.get('return_ohlc', 'true')
-		return_ohlc = return_ohlc != 'false' and return_ohlc is not False
-		start_time = request.data.get('start_time')
-		end_time = request.data.get('end_time')
-		capital_amount = request.data.get('capital_amount')
-		take_profit = request.data.get('take_profit')
-		stop_loss = request.data.get('stop_loss')
-		trade_limit = request.data.get('trade_limit')
-		backtest_date = timezone.now()
-
-		if uid is None or uid == '':
-			user_exists = False
-		else:
-			collection = FIREBASE.collection('User')
-			user_doc: DocumentReference = collection.document(uid)
-			user_exists = user_doc.get().exists
+	async def post(self, request: Request):
+		try:
+			backtest = await sync_to_async(prepare_backtest, thread_sensitive=False)(request.data)
+		except ValueError as e:
+			return Response({'error': str(e)}, 400)
 
 		try:
-			if capital_amount is None:
-				capital_amount = 10000
-			else:
-				capital_amount = float(capital_amount)
-		except ValueError:
-			return Response({'error': f'Invalid capital amount "{capital_amount}"!'}, 400)
+			result = await BACKTEST_EXECUTOR.run(
+				run_backtest,
+				backtest['frames'],
+				DEFAULT_TIMEFRAME,
+				backtest['buy_strategy'],
+				backtest['sell_strategy'],
+				backtest['options'],
+			)
+		except ExecutorSaturatedException:
+			return Response({'error': 'Too many backtests running, try again later'}, 503, headers={'Retry-After': '5'})
+
+		return Response(backtest_response(backtest, result))
+
+
+def prepare_batch(data: dict) -> dict:
+	"""Validate a batch request and read what its backtests need, raising `ValueError` for a bad request"""
+	symbol = data.get('symbol', '').strip().upper()
+	strategies = data.get('strategies')
+	start_time = data.get('start_time')
+	end_time = data.get('end_time')
+	defaults = {
+		'capital_amount': data.get('capital_amount'),
+		'take_profit': data.get('take_profit'),
+		'stop_loss': data.get('stop_loss'),
+		'trade_limit': data.get('trade_limit'),
+	}
 
-		if capital_amount <= 0:
-			return Response({'error': f'Invalid capital amount {capital_amount}! (Expected > 0)'}, 400)
+	if not isinstance(strategies, list) or len(strategies) == 0:
+		raise ValueError('Missing "strategies"!')
 
-		if capital_amount > 1e7:
-			return Response({'error': 'Capital amount too big! (Expected < 1,000,000)'}, 400)
+	if len(strategies) > MAX_BATCH_BACKTESTS:
+		raise ValueError(f'Too many strategies {len(strategies)}! (Expected <= {MAX_BATCH_BACKTESTS})')
 
-		if take_profit is not None:
-			try:
-				take_profit = float(take_profit)
-			except ValueError:
-				return Response({'error': f'Invalid take profit amount {take_profit}!'}, 400)
-			if take_profit <= capital_amount:
-				return Response(
-					{'error': f'Invalid take profit amount {take_profit}! (Expected > {capital_amount})'}, 400
-				)
+	variants = []
+	validate_symbol_timeframe(symbol, DEFAULT_TIMEFRAME)
+	for i, strategy in enumerate(strategies):
+		if not isinstance(strategy, dict):
+			raise ValueError(f'Strategy {i}: Invalid strategy!')
 
-		if stop_loss is not None:
-			try:
-				stop_loss = float(stop_loss)
-			except ValueError:
-				return Response({'error': f'Invalid stop loss amount {stop_loss}!'}, 400)
-			if stop_loss >= capital_amount:
-				return Response({'error': f'Invalid stop loss amount {stop_loss}! (Expected < {capital_amount})'}, 400)
+		try:
+			# Settings of a variant override the settings of the request
+			capital_amount, take_profit, stop_loss, trade_limit = validate_backtest_settings(
+				*[strategy.get(key, value) for key, value in defaults.items()]
+			)
+			variants.append(
+				{
+					'name': strategy.get('name', str(i)),
+					'capital_amount': capital_amount,
+					'take_profit': take_profit,
+					'stop_loss': stop_loss,
+					'trade_limit': trade_limit if trade_limit is not None else 100,  # Default 100 trades
+					'buy_program': compile_strategy(strategy.get('buy_strategy')),
+					'sell_program': compile_strategy(strategy.get('sell_strategy')),
+				}
+			)
+		except ValueError as e:
+			raise ValueError(f'Strategy {i}: {e}')
+
+	df = pd.DataFrame(
+		fetch_kline(
+			symbol=symbol,
+			timeframe=DEFAULT_TIMEFRAME,
+			start_time=start_time,
+			end_time=end_time,
+		)
+	)
+	if len(df) == 0:
+		raise ValueError('There is no OHLC data in the specified period')
+
+	programs = [program for variant in variants for program in (variant['buy_program'], variant['sell_program'])]
+	token = SYMBOL_REGISTRY.get(symbol)
+	return {
+		'symbol': symbol,
+		'from_token': token['from_token'],
+		'to_token': token['to_token'],
+		'start_time': start_time,
+		'end_time': end_time,
+		'frames': kline_frames(symbol, start_time, end_time, df, programs),
+		'variants': variants,
+	}
 
-		if trade_limit is not None:
-			try:
-				trade_limit = int(trade_limit)
-			except ValueError:
-				return Response({'error': f'Invalid trade limit {trade_limit}!'}, 400)
-			if trade_limit <= 0:
-				return Response({'error': f'Invalid trade limit {trade_limit}! (Expected > 0)'}, 400)
-			elif trade_limit > 300:
-				return Response({'error': f'Invalid trade limit {trade_limit}! (Expected <= 300)'}, 400)
 
+def batch_response(batch: dict, results: list[dict]) -> dict:
+	"""Batch response of `run_batch`"""
+	return {
+		'symbol': batch['symbol'],
+		'from_token': batch['from_token'],
+		'to_token': batch['to_token'],
+		'trade_using': batch['to_token'],
+		'start_time': batch['start_time'],
+		'end_time': batch['end_time'],
+		'results': results,
+	}
+
+
+def backtest_batch(data: dict, progress: Callable[[float], None] | None = None) -> dict:
+	"""Backtests of a batch job, run in the job worker itself rather than in `BACKTEST_EXECUTOR`"""
+	batch = prepare_batch(data)
+	unit_types = [batch['to_token'], batch['from_token']]
+	results = run_batch(
+		batch['frames'], DEFAULT_TIMEFRAME, batch['variants'], unit_types, PERIODS_PER_YEAR, progress=progress
+	)
+	return batch_response(batch, results)
+
+
+class RunBacktestBatch(AsyncAPIView):
+	@error_logger()
+	async def get(self, request: Request):
+		return Response(
+			{
+				'example_request': {
+					'uid': '',
+					'symbol': 'BTCGBP',
+					'start_time': 1672531200000,
+					'end_time': 1704063600000,
+					'capital_amount': 10000,
+					'stop_loss': 9900,
+					'take_profit': 10100,
+					'trade_limit': 100,
+					'strategies': [
+						{
+							'name': 'RSI 30 / 70',
+							'buy_strategy': [
+								{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+								{'type': 'operator', 'value': '<'},
+								{'type': 'value', 'value': 30},
+							],
+							'sell_strategy': [
+								{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+								{'type': 'operator', 'value': '>'},
+								{'type': 'value', 'value': 70},
+							],
+						},
+						{
+							'name': 'RSI template, no stop loss',
+							'stop_loss': None,
+							'buy_strategy': [{'type': 'template', 'timeframe': '4h', 'value': 'rsi_70_30'}],
+							'sell_strategy': [{'type': 'template', 'timeframe': '4h', 'value': 'rsi_70_30'}],
+						},
+					],
+				}
+			}
+		)
+
+	@extend_schema(
+		request=inline_serializer(
+			name='Backtest Batch Form',
+			fields={
+				'uid': CharField(default=''),
+				'symbol': CharField(default='BTCGBP'),
+				'start_time': IntegerField(default=1672531200000),
+				'end_time': IntegerField(default=1704063600000),
+				'capital_amount': FloatField(default=10000),
+				'take_profit': FloatField(default=10100),
+				'stop_loss': FloatField(default=9900),
+				'trade_limit': IntegerField(default=100),
+				'strategies': ListField(
+					default=[
+						{
+							'name': 'RSI 30 / 70',
+							'buy_strategy': [
+								{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+								{'type': 'operator', 'value': '<'},
+								{'type': 'value', 'value': 30},
+							],
+							'sell_strategy': [
+								{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+								{'type': 'operator', 'value': '>'},
+								{'type': 'value', 'value': 70},
+							],
+						},
+					]
+				),
+			},
+		),
+	)
+	@authenticate_jwt()
+	@error_logger()
+	async def post(self, request: Request):
 		try:
-			validate_symbol_timeframe(symbol, DEFAULT_TIMEFRAME)
-			validate_strategy(buy_strategy)
-			validate_strategy(sell_strategy)
-			data = fetch_kline(
-				symbol=symbol,
-				timeframe=DEFAULT_TIMEFRAME,
-				start_time=start_time,
-				end_time=end_time,
-			)
+			batch = await sync_to_async(prepare_batch, thread_sensitive=False)(request.data)
 		except ValueError as e:
 			return Response({'error': str(e)}, 400)
 
-		if len(data) == 0:
-			return Response({'error': 'There is no OHLC data in the specified period'}, 400)
+		try:
+			results = await BACKTEST_EXECUTOR.run(
+				run_batch,
+				batch['frames'],
+				DEFAULT_TIMEFRAME,
+				batch['variants'],
+				[batch['to_token'], batch['from_token']],
+				PERIODS_PER_YEAR,
+			)
+		except ExecutorSaturatedException:
+			return Response({'error': 'Too many backtests running, try again later'}, 503, headers={'Retry-After': '5'})
+
+		return Response(batch_response(batch, results))
+
+
+def backtest_optimize(
+	data: dict, progress: Callable[[float], None] | None = None, executor: Executor | None = None
+) -> dict:
+	"""
+	Parameter optimisation of a strategy template, raising `ValueError` for a bad request.
+	Its runs are split over `executor`, or run in the calling process without one, e.g. a job worker.
+	"""
+	symbol = data.get('symbol', '').strip().upper()
+	buy_strategy = data.get('buy_strategy')
+	sell_strategy = data.get('sell_strategy')
+	start_time = data.get('start_time')
+	end_time = data.get('end_time')
+	method = data.get('method', 'grid')
+	samples = data.get('samples', 100)
+	seed = data.get('seed')
+	metric = data.get('metric', 'total_profit')
+	minimize = data.get('minimize', False)
+	minimize = minimize == 'true' or minimize is True
+	top_k = data.get('top_k', 10)
+	walk_forward_settings = data.get('walk_forward')
+
+	capital_amount, take_profit, stop_loss, trade_limit = validate_backtest_settings(
+		data.get('capital_amount'),
+		data.get('take_profit'),
+		data.get('stop_loss'),
+		data.get('trade_limit'),
+	)
+
+	try:
+		samples = int(samples)
+		seed = int(seed) if seed is not None else None
+		top_k = int(top_k)
+	except ValueError:
+		raise ValueError('Invalid "samples", "seed" or "top_k"!')
 
-		df = pd.DataFrame(data)
-		expressions = evaluate_values({DEFAULT_TIMEFRAME: df}, buy_strategy, True, DEFAULT_TIMEFRAME)
-		buy_results = evaluate_expressions(expressions)
-		expressions = evaluate_values({DEFAULT_TIMEFRAME: df}, sell_strategy, False, DEFAULT_TIMEFRAME)
-		sell_results = evaluate_expressions(expressions)
-
-		token = FirebaseCandle().fetch_pair(symbol)
-		to_token = token['to_token']
-		from_token = token['from_token']
-
-		results = calculate_amount(
-			capital=capital_amount,
-			open_times=df['Open Time'].to_numpy(),
-			close_data=df['Close'].to_numpy(),
-			buy_signals=buy_results,
-			sell_signals=sell_results,
-			unit_types=[to_token, from_token],
-			stop_loss=stop_loss,
-			take_profit=take_profit,
-			trade_limit=trade_limit if trade_limit is not None else 100,  # Default 100 trades
+	if top_k <= 0 or top_k > MAX_OPTIMIZE_RESULTS:
+		raise ValueError(f'Invalid top_k {top_k}! (Expected 1 to {MAX_OPTIMIZE_RESULTS})')
+
+	if not isinstance(buy_strategy, list) or not isinstance(sell_strategy, list):
+		raise ValueError('Missing "buy_strategy" or "sell_strategy"!')
+
+	if walk_forward_settings is not None and not isinstance(walk_forward_settings, dict):
+		raise ValueError('Invalid "walk_forward"!')
+
+	validate_symbol_timeframe(symbol, DEFAULT_TIMEFRAME)
+	df = fetch_kline(
+		symbol=symbol,
+		timeframe=DEFAULT_TIMEFRAME,
+		start_time=start_time,
+		end_time=end_time,
+	)
+	if len(df) == 0:
+		raise ValueError('There is no OHLC data in the specified period')
+
+	token = SYMBOL_REGISTRY.get(symbol)
+	to_token = token['to_token']
+	from_token = token['from_token']
+
+	options = {
+		'capital': capital_amount,
+		'stop_loss': stop_loss,
+		'take_profit': take_profit,
+		'trade_limit': trade_limit if trade_limit is not None else 100,  # Default 100 trades
+		'unit_types': (to_token, from_token),
+		'metric': metric,
+		'minimize': minimize,
+		'method': method,
+		'samples': samples,
+		'seed': seed,
+		'timeframe': DEFAULT_TIMEFRAME,
+		'periods_per_year': PERIODS_PER_YEAR,
+		'progress': progress,
+		'executor': executor,
+	}
+	if walk_forward_settings is None:
+		results = optimize_strategy(df, buy_strategy, sell_strategy, top_k=top_k, **options)
+	else:
+		results = walk_forward(
+			df,
+			buy_strategy,
+			sell_strategy,
+			in_sample=walk_forward_settings.get('in_sample'),
+			out_of_sample=walk_forward_settings.get('out_of_sample'),
+			step=walk_forward_settings.get('step'),
+			anchored=walk_forward_settings.get('anchored') is True,
+			**options,
 		)
 
-		trade_results = results['results']
-		trade_events = results['trades']
-		holdings = results['holdings']
-		trade_types = results['trade_types']
-		stopped_by = results['stopped_by']
-
-		trade_counts = np.array(trade_types)
-		buy_count = int((trade_counts == 'buy').sum())
-		sell_count = int((trade_counts == 'sell').sum())
-
-		data = {
-			'date': backtest_date,
-			'symbol': symbol,
-			'from_token': from_token,
-			'to_token': to_token,
-			'trade_using': to_token,
-			'start_time': start_time,
-			'end_time': end_time,
-			'take_profit': take_profit,
-			'stop_loss': stop_loss,
-			'trade_limit': trade_limit,
-			'capital': capital_amount,
-			'final_amount': trade_results[-1],
-			'profit': holdings[-1] - capital_amount,
-			'trade_events': trade_events,
-			'buy_count': buy_count,
-			'sell_count': sell_count,
-			'buy_strategy': buy_strategy,
-			'sell_strategy': sell_strategy,
-			'stopped_by': stopped_by,
-			'performance_report': analyse_strategy(
-				capital_amount,
-				df['Close'].to_numpy(),
-				holdings,
-				trade_types,
-				trade_events,
-			),
+	return {
+		'symbol': symbol,
+		'from_token': from_token,
+		'to_token': to_token,
+		'trade_using': to_token,
+		'start_time': start_time,
+		'end_time': end_time,
+		'capital': capital_amount,
+		'take_profit': take_profit,
+		'stop_loss': stop_loss,
+		'trade_limit': trade_limit,
+		'method': method,
+		'metric': metric,
+		'minimize': minimize,
+		'walk_forward': walk_forward_settings,
+		**results,
+	}
+
+
+class RunBacktestOptimize(AsyncAPIView):
+	@error_logger()
+	async def get(self, request: Request):
+		return Response(
+			{
+				'example_request': {
+					'uid': '',
+					'symbol': 'BTCGBP',
+					'start_time': 1672531200000,
+					'end_time': 1704063600000,
+					'capital_amount': 10000,
+					'stop_loss': None,
+					'take_profit': None,
+					'trade_limit': 100,
+					'method': 'grid',
+					'samples': 100,
+					'seed': None,
+					'metric': 'sharpe_ratio',
+					'minimize': False,
+					'top_k': 10,
+					'walk_forward': None,
+					'buy_strategy': [
+						{
+							'type': 'indicator',
+							'timeframe': '1h',
+							'value': {
+								'indicator_name': 'rsi',
+								'params': {'timeperiod': {'min': 5, 'max': 50, 'step': 5, 'name': 'rsi_period'}},
+							},
+						},
+						{'type': 'operator', 'value': '<'},
+						{'type': 'value', 'value': {'min': 20, 'max': 40, 'step': 5}},
+					],
+					'sell_strategy': [
+						{
+							'type': 'indicator',
+							'timeframe': '1h',
+							'value': {
+								'indicator_name': 'rsi',
+								'params': {'timeperiod': {'min': 5, 'max': 50, 'step': 5, 'name': 'rsi_period'}},
+							},
+						},
+						{'type': 'operator', 'value': '>'},
+						{'type': 'value', 'value': {'values': [60, 70, 80]}},
+					],
+				},
+				'metrics': METRICS,
+				'example_walk_forward': {
+					'in_sample': 24 * 90,
+					'out_of_sample': 24 * 30,
+					'step': None,
+					'anchored': False,
+				},
+			}
+		)
+
+	@extend_schema(
+		request=inline_serializer(
+			name='Backtest Optimize Form',
+			fields={
+				'uid': CharField(default=''),
+				'symbol': CharField(default='BTCGBP'),
+				'start_time': IntegerField(default=1672531200000),
+				'end_time': IntegerField(default=1704063600000),
+				'capital_amount': FloatField(default=10000),
+				'take_profit': FloatField(default=None),
+				'stop_loss': FloatField(default=None),
+				'trade_limit': IntegerField(default=100),
+				'method': CharField(default='grid'),
+				'samples': IntegerField(default=100),
+				'seed': IntegerField(default=None),
+				'metric': CharField(default='total_profit'),
+				'minimize': BooleanField(default=False),
+				'top_k': IntegerField(default=10),
+				'walk_forward': DictField(default=None),
+				'buy_strategy': ListField(
+					default=[
+						{
+							'type': 'indicator',
+							'timeframe': '1h',
+							'value': {
+								'indicator_name': 'rsi',
+								'params': {'timeperiod': {'min': 5, 'max': 50, 'step': 5}},
+							},
+						},
+						{'type': 'operator', 'value': '<'},
+						{'type': 'value', 'value': {'min': 20, 'max': 40, 'step': 5}},
+					]
+				),
+				'sell_strategy': ListField(
+					default=[
+						{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+						{'type': 'operator', 'value': '>'},
+						{'type': 'value', 'value': {'values': [60, 70, 80]}},
+					]
+				),
+			},
+		),
+	)
+	@authenticate_jwt()
+	@error_logger()
+	async def post(self, request: Request):
+		try:
+			with BACKTEST_EXECUTOR.reserve() as executor:
+				result = await sync_to_async(backtest_optimize, thread_sensitive=False)(request.data, executor=executor)
+		except ValueError as e:
+			return Response({'error': str(e)}, 400)
+		except ExecutorSaturatedException:
+			return Response({'error': 'Too many backtests running, try again later'}, 503, headers={'Retry-After': '5'})
+
+		return Response(result)
+
+
+def prepare_monte_carlo(data: dict) -> dict:
+	"""Validate a Monte Carlo request and read what its backtest needs, raising `ValueError` for a bad request"""
+	symbol = data.get('symbol', '').strip().upper()
+	start_time = data.get('start_time')
+	end_time = data.get('end_time')
+
+	capital_amount, take_profit, stop_loss, trade_limit = validate_backtest_settings(
+		data.get('capital_amount'),
+		data.get('take_profit'),
+		data.get('stop_loss'),
+		data.get('trade_limit'),
+	)
+	buy_program = compile_strategy(data.get('buy_strategy'))
+	sell_program = compile_strategy(data.get('sell_strategy'))
+
+	try:
+		block_size = data.get('block_size')
+		seed = data.get('seed')
+		monte_carlo_options = {
+			'method': data.get('method', 'bootstrap'),
+			'paths': int(data.get('paths', 1000)),
+			'ruin_level': float(data.get('ruin_level', 0.5)),
+			'block_size': int(block_size) if block_size is not None else None,
+			'seed': int(seed) if seed is not None else None,
 		}
+	except (TypeError, ValueError):
+		raise ValueError('Invalid "paths", "ruin_level", "block_size" or "seed"!')
+
+	validate_symbol_timeframe(symbol, DEFAULT_TIMEFRAME)
+	df = pd.DataFrame(
+		fetch_kline(
+			symbol=symbol,
+			timeframe=DEFAULT_TIMEFRAME,
+			start_time=start_time,
+			end_time=end_time,
+		)
+	)
+	if len(df) == 0:
+		raise ValueError('There is no OHLC data in the specified period')
+
+	token = SYMBOL_REGISTRY.get(symbol)
+	return {
+		'symbol': symbol,
+		'from_token': token['from_token'],
+		'to_token': token['to_token'],
+		'start_time': start_time,
+		'end_time': end_time,
+		'trade_limit': trade_limit,
+		'buy_program': buy_program,
+		'sell_program': sell_program,
+		'frames': kline_frames(symbol, start_time, end_time, df, [buy_program, sell_program]),
+		'options': {
+			'capital': capital_amount,
+			'unit_types': [token['to_token'], token['from_token']],
+			'stop_loss': stop_loss,
+			'take_profit': take_profit,
+			'trade_limit': trade_limit if trade_limit is not None else 100,  # Default 100 trades
+		},
+		'monte_carlo': monte_carlo_options,
+	}
+
+
+class RunBacktestMonteCarlo(AsyncAPIView):
+	@error_logger()
+	async def get(self, request: Request):
+		return Response(
+			{
+				'example_request': {
+					'uid': '',
+					'symbol': 'BTCGBP',
+					'start_time': 1672531200000,
+					'end_time': 1704063600000,
+					'capital_amount': 10000,
+					'stop_loss': None,
+					'take_profit': None,
+					'trade_limit': 100,
+					'method': 'bootstrap',
+					'paths': 10000,
+					'ruin_level': 0.5,
+					'block_size': None,
+					'seed': None,
+					'buy_strategy': [
+						{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+						{'type': 'operator', 'value': '<'},
+						{'type': 'value', 'value': 30},
+					],
+					'sell_strategy': [
+						{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+						{'type': 'operator', 'value': '>'},
+						{'type': 'value', 'value': 70},
+					],
+				},
+				'methods': MONTE_CARLO_METHODS,
+			}
+		)
+
+	@extend_schema(
+		request=inline_serializer(
+			name='Backtest Monte Carlo Form',
+			fields={
+				'uid': CharField(default=''),
+				'symbol': CharField(default='BTCGBP'),
+				'start_time': IntegerField(default=1672531200000),
+				'end_time': IntegerField(default=1704063600000),
+				'capital_amount': FloatField(default=10000),
+				'take_profit': FloatField(default=None),
+				'stop_loss': FloatField(default=None),
+				'trade_limit': IntegerField(default=100),
+				'method': CharField(default='bootstrap'),
+				'paths': IntegerField(default=10000),
+				'ruin_level': FloatField(default=0.5),
+				'block_size': IntegerField(default=None),
+				'seed': IntegerField(default=None),
+				'buy_strategy': ListField(
+					default=[
+						{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+						{'type': 'operator', 'value': '<'},
+						{'type': 'value', 'value': 30},
+					]
+				),
+				'sell_strategy': ListField(
+					default=[
+						{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+						{'type': 'operator', 'value': '>'},
+						{'type': 'value', 'value': 70},
+					]
+				),
+			},
+		),
+	)
+	@authenticate_jwt()
+	@error_logger()
+	async def post(self, request: Request):
+		try:
+			backtest = await sync_to_async(prepare_monte_carlo, thread_sensitive=False)(request.data)
+		except ValueError as e:
+			return Response({'error': str(e)}, 400)
+
+		try:
+			result = await BACKTEST_EXECUTOR.run(
+				run_monte_carlo,
+				backtest['frames'],
+				DEFAULT_TIMEFRAME,
+				backtest['buy_program'],
+				backtest['sell_program'],
+				backtest['options'],
+				backtest['monte_carlo'],
+			)
+		except ExecutorSaturatedException:
+			return Response({'error': 'Too many backtests running, try again later'}, 503, headers={'Retry-After': '5'})
+		except ValueError as e:
+			return Response({'error': str(e)}, 400)
+
+		options = backtest['options']
+		return Response(
+			{
+				'symbol': backtest['symbol'],
+				'from_token': backtest['from_token'],
+				'to_token': backtest['to_token'],
+				'trade_using': backtest['to_token'],
+				'start_time': backtest['start_time'],
+				'end_time': backtest['end_time'],
+				'capital': options['capital'],
+				'take_profit': options['take_profit'],
+				'stop_loss': options['stop_loss'],
+				'trade_limit': backtest['trade_limit'],
+				**result,
+			}
+		)
+
+
+def job_data(job: dict, result=True) -> dict:
+	"""Public fields of a job, with its times in ms"""
+	data = {
+		'job_id': job['id'],
+		'kind': job['kind'],
+		'status': job['status'],
+		'progress': job['progress'],
+		'error': job['error'],
+		**{key: int(job[key] * 1000) if job[key] is not None else None for key in JOB_TIMES},
+	}
+	if result is True:
+		data['result'] = job['result']
+	return data
+
 
-		if user_exists:
-			subcollection: CollectionReference = user_doc.collection('backtest_history')
-			doc_ref: DocumentReference = subcollection.document()
-			doc_ref.set(data)
+class Jobs(APIView):
+	"""
+	Backtest, batch and optimize requests queued as jobs, run by the `run_job_workers` command however long they take.
+	A job takes the request of its endpoint along with its `kind`.
+	"""
 
-		data['ohlc_data'] = data if return_ohlc is True else []
-		data['backtest_id'] = doc_ref.id if user_exists else None
+	@error_logger()
+	def get(self, request: Request):
+		return Response(
+			{
+				'example_request': {
+					'uid': '',
+					'kind': 'batch',
+					'symbol': 'BTCGBP',
+					'start_time': 1672531200000,
+					'end_time': 1704063600000,
+					'capital_amount': 10000,
+					'strategies': [
+						{
+							'name': 'RSI template',
+							'buy_strategy': [{'type': 'template', 'timeframe': '4h', 'value': 'rsi_70_30'}],
+							'sell_strategy': [{'type': 'template', 'timeframe': '4h', 'value': 'rsi_70_30'}],
+						},
+					],
+				},
+				'kinds': JOB_KINDS,
+			}
+		)
 
-		return Response(data)
+	@extend_schema(
+		request=inline_serializer(
+			name='Job Form',
+			fields={
+				'uid': CharField(default=''),
+				'kind': CharField(default='batch'),
+			},
+		),
+	)
+	@authenticate_jwt()
+	@error_logger()
+	def post(self, request: Request):
+		uid = request.data.get('uid') or ''
+		kind = request.data.get('kind')
+		payload = {key: value for key, value in request.data.items() if key != 'kind'}
+
+		if JOB_QUEUE.pending(uid) >= JOB_USER_PENDING:
+			return Response({'error': f'Too many jobs queued! (Expected <= {JOB_USER_PENDING})'}, 429)
+
+		try:
+			job_id = JOB_QUEUE.enqueue(uid, kind, payload)
+		except ValueError as e:
+			return Response({'error': str(e)}, 400)
+
+		return Response({'job_id': job_id, 'status': QUEUED}, 202)
+
+
+class JobDetail(APIView):
+	@extend_schema(parameters=[OpenApiParameter(name='uid', type=OpenApiTypes.STR, default='')])
+	@authenticate_jwt()
+	@error_logger()
+	def get(self, request: Request, job_id: str):
+		job = JOB_QUEUE.get(job_id)
+		if job is None or job['uid'] != (request.query_params.get('uid') or ''):
+			return Response({'error': 'Job not found'}, 404)
+		return Response(job_data(job))
+
+
+class JobEvents(AsyncAPIView):
+	"""
+	Server-Sent Events of the status and progress of a job, ending with a `done` or `failed` event.
+	The result is left out of the events, to be read from the job once done.
+	"""
+
+	KEEP_ALIVE_SECONDS = 15
+
+	def perform_content_negotiation(self, request, force=False):
+		# Clients accept `text/event-stream`, which no renderer produces
+		return super().perform_content_negotiation(request, force=True)
+
+	@extend_schema(parameters=[OpenApiParameter(name='uid', type=OpenApiTypes.STR, default='')])
+	@authenticate_jwt()
+	@error_logger()
+	async def get(self, request: Request, job_id: str):
+		get_job = sync_to_async(JOB_QUEUE.get, thread_sensitive=False)
+		job = await get_job(job_id)
+		if job is None or job['uid'] != (request.query_params.get('uid') or ''):
+			return Response({'error': 'Job not found'}, 404)
+
+		async def events():
+			nonlocal job
+			last_state = None
+			last_event = time.monotonic()
+			while True:
+				state = (job['status'], job['progress'])
+				if state != last_state:
+					event = job['status'] if job['status'] in FINISHED else 'progress'
+					yield f'event: {event}\ndata: {json.dumps(job_data(job, result=False))}\n\n'
+					last_state = state
+					last_event = time.monotonic()
+				elif time.monotonic() - last_event >= self.KEEP_ALIVE_SECONDS:
+					yield ': keep-alive\n\n'
+					last_event = time.monotonic()
+
+				if job['status'] in FINISHED:
+					return
+				await asyncio.sleep(JOB_POLL_SECONDS)
+				job = await get_job(job_id)
+				if job is None:
+					# Pruned while streaming
+					return
+
+		return StreamingHttpResponse(
+			events(),
+			content_type='text/event-stream',
+			headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+		)
 
 
 # Live Tradings
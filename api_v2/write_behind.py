@@ -0,0 +1,121 @@
+import atexit
+import queue
+import threading
+import traceback
+
+from django.conf import settings
+from google.cloud.firestore_v1 import Client, DocumentReference
+
+from api_v2.batch_writer import BatchWriter
+from core.instrumentation import stage_timer
+from machd.utils import log_error
+
+WRITE_BEHIND_QUEUE_SIZE: int = settings.WRITE_BEHIND_QUEUE_SIZE
+
+
+class WriteBehindQueue:
+	"""
+	Firestore document sets queued in memory and committed by a background thread, so callers do not wait for them.
+
+	The thread commits whatever is queued in batches of up to `max_operations` through a `BatchWriter`,
+	retrying transient errors, and logs the documents of a batch that still fails.
+	Once `max_size` writes are queued `set` commits in the calling thread instead, as writes did before.
+	Writes still queued at exit are committed for up to `timeout` seconds.
+	"""
+
+	def __init__(
+		self,
+		client: Client = None,
+		max_size: int = WRITE_BEHIND_QUEUE_SIZE,
+		max_operations: int = BatchWriter.MAX_OPERATIONS,
+		retries: int = 3,
+		backoff: float = 0.5,
+		timeout: float = 10,
+	):
+		self.__client = client
+		self.max_operations = max_operations
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+
+		self.written = 0
+		self.failed = 0
+		self.__queue: queue.Queue[tuple[DocumentReference, dict] | None] = queue.Queue(max_size)
+		self.__thread: threading.Thread | None = None
+		self.__lock = threading.Lock()
+
+	@property
+	def client(self) -> Client:
+		return self.__client if self.__client is not None else settings.FIREBASE
+
+	def set(self, ref: DocumentReference, data: dict):
+		"""Queue the write of `data` to `ref`, which must not be changed afterwards"""
+		self.__start()
+		try:
+			self.__queue.put_nowait((ref, data))
+		except queue.Full:
+			with stage_timer('firestore_write'):
+				ref.set(data)
+
+	def flush(self):
+		"""Wait for the writes queued so far"""
+		self.__queue.join()
+
+	def close(self):
+		"""Commit the queued writes and stop the thread, waiting up to `timeout` seconds"""
+		with self.__lock:
+			thread = self.__thread
+			self.__thread = None
+		if thread is None:
+			return
+
+		self.__queue.put(None)
+		thread.join(self.timeout)
+
+	def __start(self):
+		with self.__lock:
+			if self.__thread is not None:
+				return
+			self.__thread = threading.Thread(target=self.__run, name='write-behind', daemon=True)
+			self.__thread.start()
+
+	def __run(self):
+		while True:
+			item = self.__queue.get()
+			items = [item]
+			while item is not None and len(items) < self.max_operations:
+				try:
+					item = self.__queue.get_nowait()
+				except queue.Empty:
+					break
+				items.append(item)
+
+			writes = [item for item in items if item is not None]
+			if len(writes) > 0:
+				self.__commit(writes)
+			for _ in items:
+				self.__queue.task_done()
+			if len(writes) < len(items):
+				return
+
+	def __commit(self, writes: list[tuple[DocumentReference, dict]]):
+		writer = BatchWriter(self.client, max_workers=1, retries=self.retries, backoff=self.backoff)
+		try:
+			with writer:
+				for ref, data in writes:
+					writer.set(ref, data)
+			self.written += len(writes)
+		except Exception:
+			self.written += writer.operations
+			self.failed += len(writes) - writer.operations
+			log_error(
+				{
+					'message': 'Write-behind commit failed',
+					'documents': [ref.path for ref, _ in writes],
+					'error': traceback.format_exc(),
+				}
+			)
+
+
+WRITE_BEHIND = WriteBehindQueue()
+atexit.register(WRITE_BEHIND.close)
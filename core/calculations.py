@@ -1,14 +1,18 @@
-import math
+import hashlib
+import json
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
 from decimal import ROUND_DOWN, Decimal
-from typing import Literal
+from threading import Lock
+from typing import Callable, Literal, NamedTuple
 
 import numpy as np
 import pandas as pd
 import pytz
 from django.conf import settings
 
+from core.instrumentation import stage_timer, timed
 from core.technical_analysis import TechnicalAnalysis, TechnicalAnalysisTemplate
 
 TA = TechnicalAnalysis()
@@ -19,6 +23,7 @@ BACKTEST_PARAMS = ['Open', 'High', 'Low', 'Close', 'Volume']
 OPERATORS = ['>', '>=', '<', '<=', '==', '!=', '=', '+', '-', '*', '/', '^', 'and', 'or', '(', ')']
 MATH_FUNCS = ['max', 'min', 'abs']
 TIMEFRAMES = list(INTERVAL_MAP.values())
+PROGRAM_CACHE_SIZE = 256
 
 
 def combine_ohlc(df: pd.DataFrame, merge_interval: int):
@@ -57,6 +62,55 @@ def combine_ohlc(df: pd.DataFrame, merge_interval: int):
 	)
 
 
+class Resampled(NamedTuple):
+	"""OHLC data resampled to a higher timeframe, see `resample_ohlc`
+
+	Attributes:
+		`ohlc`:
+			One row per bucket holding at least one base row, `Open Time` being the bucket boundary
+		`index`:
+			Row of `ohlc` of each base row, so `values[index]` broadcasts higher timeframe values to the base rows
+	"""
+
+	ohlc: pd.DataFrame
+	index: np.ndarray[np.int64]
+
+
+def resample_ohlc(df: pd.DataFrame, timeframe: str, base_timeframe='1h') -> Resampled:
+	"""
+	Aggregate `df` into buckets of `timeframe` aligned on UTC epoch boundaries of `Open Time`, e.g. UTC days for `1d`.
+	Unlike `combine_ohlc`, gaps and series starting mid-bucket are handled: a bucket only aggregates the rows it holds.
+	Rows must be sorted by `Open Time`.
+	"""
+	if INTERVAL_MAP[timeframe] < INTERVAL_MAP[base_timeframe]:
+		raise ValueError(f'Cannot resample {base_timeframe} data to {timeframe}!')
+
+	open_time = df['Open Time'].to_numpy().astype(np.int64)
+	if timeframe == base_timeframe:
+		return Resampled(df, np.arange(len(open_time)))
+
+	interval = INTERVAL_MAP[timeframe] * 60 * 1000
+	buckets = open_time // interval * interval
+	if len(buckets) == 0:
+		return Resampled(df.iloc[:0][['Open Time', *BACKTEST_PARAMS]], np.array([], dtype=np.int64))
+
+	starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+	ends = np.append(starts[1:], len(buckets)) - 1
+	return Resampled(
+		pd.DataFrame(
+			{
+				'Open Time': buckets[starts],
+				'Open': df['Open'].to_numpy()[starts],
+				'High': np.fmax.reduceat(df['High'].to_numpy(), starts),
+				'Low': np.fmin.reduceat(df['Low'].to_numpy(), starts),
+				'Close': df['Close'].to_numpy()[ends],
+				'Volume': np.add.reduceat(np.nan_to_num(df['Volume'].to_numpy(dtype=np.float64)), starts),
+			}
+		),
+		np.cumsum(np.diff(buckets, prepend=buckets[0]) != 0),
+	)
+
+
 def validate_indicator(indicator: dict):
 	if not isinstance(indicator, dict):
 		raise ValueError('Invalid indicator settings!')
@@ -496,253 +550,651 @@ def evaluate_expressions(expressions: list):
 	return result
 
 
-def calculate_amount(
-	capital: float,
-	open_times: np.ndarray[np.int64],
-	close_data: np.ndarray[np.float64],
-	buy_signals: np.ndarray[np.int8],
-	sell_signals: np.ndarray[np.int8],
-	unit_types: tuple[str, str],
-	stop_loss: float = None,
-	take_profit: float = None,
-	trade_limit: int = 300,
-) -> list[float]:
-	base_amount = capital
-	sec_amount = 0
+class StrategyProgram(NamedTuple):
+	"""Compiled strategy, see `compile_strategy`
 
-	try:
-		len(buy_signals)
-	except TypeError:
-		buy_signals = np.array([buy_signals])
+	Attributes:
+		`key`:
+			Canonical hash of the strategy JSON
+		`root`:
+			Immutable expression tree made of tuples, e.g.
+			`('operator', '>', ('ohlc', 'Close'), ('indicator', '1h', 'macd', (('fastperiod', 2),)))`
+	"""
 
-	try:
-		len(sell_signals)
-	except TypeError:
-		sell_signals = np.array([sell_signals])
+	key: str
+	root: tuple
 
-	if len(buy_signals) == 1 and len(sell_signals) == 1:
-		buy_signals = buy_signals.repeat(len(close_data))
-		sell_signals = sell_signals.repeat(len(close_data))
-	elif len(buy_signals) == 1:
-		buy_signals = buy_signals.repeat(len(close_data))
-	elif len(sell_signals) == 1:
-		sell_signals = sell_signals.repeat(len(close_data))
 
-	holdings = [0] * min(len(buy_signals), len(sell_signals))
-	units = [unit_types[0]] * len(holdings)
-	trade_types = ['hold'] * len(holdings)
-	results = [''] * len(holdings)
-	trades = []
+_program_cache: OrderedDict[str, StrategyProgram] = OrderedDict()
+_program_cache_lock = Lock()
 
-	bought = False
-	last_price = None
-	stopped = False
-	stopped_by = None
-	trade_count = 0
 
-	for i in range(len(holdings)):
-		if stopped:
-			holdings[i] = holdings[i - 1] if i > 0 else capital
-			units[i] = units[i - 1] if i > 0 else unit_types[0]
-		elif np.isnan(close_data[i]) or close_data[i] is None:
-			holdings[i] = holdings[i - 1] if i > 0 else capital
-			units[i] = units[i - 1] if i > 0 else unit_types[0]
-		elif bought and stop_loss is not None and sec_amount * close_data[i] <= stop_loss:
-			old_amount = sec_amount
-			base_amount = sec_amount * close_data[i]
-			sec_amount = 0
-			holdings[i] = base_amount
-
-			trade_types[i] = 'sell'
-			trade_count += 1
-			bought = False
-			stopped = True
-			stopped_by = 'loss'
-
-			trade_time = datetime.fromtimestamp(open_times[i] / 1000).astimezone(pytz.UTC)
-			trades.append(
-				{
-					'timestamp': int(open_times[i]),
-					'datetime': trade_time,
-					'from_amount': float(old_amount),
-					'from_token': unit_types[1],
-					'to_amount': float(base_amount),
-					'to_token': unit_types[0],
-					'price': float(close_data[i]),
-				}
-			)
-		elif bought and take_profit is not None and sec_amount * close_data[i] >= take_profit:
-			old_amount = sec_amount
-			base_amount = sec_amount * close_data[i]
-			sec_amount = 0
-			holdings[i] = base_amount
-
-			trade_types[i] = 'sell'
-			trade_count += 1
-			bought = False
-			stopped = True
-			stopped_by = 'profit'
-
-			trade_time = datetime.fromtimestamp(open_times[i] / 1000).astimezone(pytz.UTC)
-			trades.append(
-				{
-					'timestamp': int(open_times[i]),
-					'datetime': trade_time,
-					'from_amount': float(old_amount),
-					'from_token': unit_types[1],
-					'to_amount': float(base_amount),
-					'to_token': unit_types[0],
-					'price': float(close_data[i]),
-				}
-			)
-		elif not bought and buy_signals[i] != 0:
-			old_amount = base_amount
-			sec_amount = base_amount / close_data[i]
-			base_amount = 0
-			holdings[i] = sec_amount
-			units[i] = unit_types[1]
+def strategy_key(strategy: list) -> str:
+	"""Canonical hash of a strategy, independent of the key order of its expressions"""
+	canonical = json.dumps(strategy, sort_keys=True, separators=(',', ':'), default=str)
+	return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
-			trade_types[i] = 'buy'
-			bought = True
 
-			trade_time = datetime.fromtimestamp(open_times[i] / 1000).astimezone(pytz.UTC)
-			trades.append(
-				{
-					'timestamp': int(open_times[i]),
-					'datetime': trade_time,
-					'from_amount': float(old_amount),
-					'from_token': unit_types[0],
-					'to_amount': float(sec_amount),
-					'to_token': unit_types[1],
-					'price': float(close_data[i]),
-				}
-			)
-		elif bought and sell_signals[i] != 0:
-			old_amount = sec_amount
-			base_amount = sec_amount * close_data[i]
-			sec_amount = 0
-			holdings[i] = base_amount
+def _combine_nodes(left: tuple | None, op: str | None, right: tuple):
+	if op is None:
+		return right
+	return ('operator', op, left, right)
+
+
+def _build_leaf(exp: dict):
+	match exp['type']:
+		case 'value':
+			return ('value', exp['value'])
+
+		case 'ohlc':
+			return ('ohlc', exp['value'].title())
+
+		case 'indicator':
+			indicator = exp['value']
+			params = tuple(sorted(indicator.get('params', {}).items()))
+			return ('indicator', exp['timeframe'], indicator['indicator_name'], params)
+
+		case 'template':
+			return ('template', exp['timeframe'], exp['value'])
+
+
+def _build_tree(expressions: list):
+	"""Mirrors `evaluate_expressions`, building nodes instead of evaluating them"""
+	result_stack = []
+	operation_stack = []
+	result = None
+	operation = None
+	for exp in arrange_expressions(expressions):
+		if exp['type'] == 'operator':
+			if exp['value'] == '(':
+				if result is None:
+					result_stack.append(('value', 0))
+					operation_stack.append('+')
+				else:
+					result_stack.append(result)
+					operation_stack.append(operation)
+				result = None
+				operation = None
+			elif exp['value'] == ')':
+				temp_result = result_stack.pop()
+				operation = operation_stack.pop()
+				result = _combine_nodes(temp_result, operation, result)
+				operation = None
+			else:
+				operation = exp['value']
+		elif exp['type'] == 'math_func':
+			value = ('math_func', exp['value']['type'].lower(), _build_tree(exp['value']['value']))
+			result = _combine_nodes(result, operation, value)
+		else:
+			result = _combine_nodes(result, operation, _build_leaf(exp))
+			operation = None
+
+	while len(result_stack) > 0:
+		if len(operation_stack) > 0:
+			operation = operation_stack.pop()
+		else:
+			operation = '+'
+
+		if result is None:
+			result = ('value', 0)
+
+		result = ('operator', operation, result_stack.pop(), result)
+
+	return result
+
+
+def compile_strategy(strategy: list) -> StrategyProgram:
+	"""
+	Validate a strategy and compile it into an immutable expression tree.
+	Programs are cached by `strategy_key`, so resubmitting the same strategy skips validation and parsing.
+
+	Raises:
+		ValueError: Same errors as `validate_strategy`
+	"""
+	key = strategy_key(strategy)
+	with _program_cache_lock:
+		program = _program_cache.get(key)
+		if program is not None:
+			_program_cache.move_to_end(key)
+			return program
+
+	strategy = deepcopy(strategy)
+	validate_strategy(strategy)
+	program = StrategyProgram(key, _build_tree(strategy))
+
+	with _program_cache_lock:
+		_program_cache[key] = program
+		while len(_program_cache) > PROGRAM_CACHE_SIZE:
+			_program_cache.popitem(last=False)
 
-			trade_types[i] = 'sell'
-			trade_count += 1
-			bought = False
+	return program
 
-			trade_time = datetime.fromtimestamp(open_times[i] / 1000).astimezone(pytz.UTC)
+
+class IndicatorGraph:
+	"""Request-scoped dependency graph of the indicators used by one or more strategy programs
+
+	Indicator nodes are deduplicated by `(timeframe, function, canonical params)`, where `function` is the
+	multi-output TA function (e.g. `_macd`) for indicators listed in `TechnicalAnalysis.outputs`,
+	so `macd` and `macdsignal`, or the same RSI in the buy and sell legs, share a single TA-Lib call.
+	"""
+
+	def __init__(
+		self,
+		df: dict[str, pd.DataFrame] | pd.DataFrame,
+		default_timeframe='1h',
+		resample: Callable[[str], Resampled] | None = None,
+	):
+		"""`resample` returns the `default_timeframe` data resampled to a timeframe, e.g. from a cache"""
+		if isinstance(df, pd.DataFrame):
+			df = {default_timeframe: df}
+
+		self.default_timeframe = default_timeframe
+		self.max_length = len(df[default_timeframe]['Close'])
+		self.__data = df
+		self.__index: dict[str, np.ndarray] = {}
+		self.__resample = resample
+		self.__indicators: dict[tuple, tuple[tuple, int | None]] = {}
+		self.__templates: set[tuple] = set()
+		self.__sources = {}
+		self.__results = {}
+
+	def source_key(self, timeframe: str, indicator_name: str, params: dict):
+		"""Returns `((timeframe, function, canonical params), output index)`"""
+		params = {**TA.options[indicator_name]['params'], **params}
+		function, output = TA.outputs.get(indicator_name, (indicator_name, None))
+		return (timeframe, function, tuple(sorted(params.items()))), output
+
+	def add(self, program: StrategyProgram):
+		self.__add_node(program.root)
+
+	def __add_node(self, node: tuple):
+		match node[0]:
+			case 'operator':
+				self.__add_node(node[2])
+				self.__add_node(node[3])
+
+			case 'math_func':
+				self.__add_node(node[2])
+
+			case 'indicator':
+				self.add_indicator(node[1], node[2], dict(node[3]))
+
+			case 'template':
+				self.__templates.add((node[1], node[2]))
+
+	def add_indicator(self, timeframe: str, indicator_name: str, params: dict):
+		leaf = ('indicator', timeframe, indicator_name, tuple(sorted(params.items())))
+		if leaf not in self.__indicators:
+			self.__indicators[leaf] = self.source_key(timeframe, indicator_name, params)
+		return leaf
+
+	def ohlc(self, timeframe: str):
+		if timeframe not in self.__data:
+			if self.__resample is not None:
+				resampled = self.__resample(timeframe)
+			else:
+				resampled = resample_ohlc(self.__data[self.default_timeframe], timeframe, self.default_timeframe)
+			self.__data[timeframe], self.__index[timeframe] = resampled
+		return self.__data[timeframe]
+
+	def index(self, timeframe: str):
+		"""Row of the `timeframe` data of each default timeframe row"""
+		if timeframe not in self.__index:
+			# Data given for the timeframe, rows are matched by open time
+			open_times = self.ohlc(timeframe)['Open Time'].to_numpy()
+			base_open_times = self.__data[self.default_timeframe]['Open Time'].to_numpy()
+			self.__index[timeframe] = np.maximum(np.searchsorted(open_times, base_open_times, side='right') - 1, 0)
+		return self.__index[timeframe]
+
+	def compute(self):
+		"""Compute every registered node once"""
+		for source, _ in self.__indicators.values():
+			self.__compute_source(source)
+		for template in self.__templates:
+			self.__compute_source(('template', *template))
+
+	def __compute_source(self, source: tuple):
+		if source in self.__sources:
+			return self.__sources[source]
+
+		with stage_timer('indicators'):
+			if source[0] == 'template':
+				_, timeframe, template_name = source
+				result = TA_TEMPLATES.templates[template_name]['function'](self.ohlc(timeframe))
+			else:
+				timeframe, function, params = source
+				result = getattr(TA, function)(self.ohlc(timeframe), **dict(params))
+
+		self.__sources[source] = result
+		return result
+
+	def __align(self, timeframe: str, result: np.ndarray):
+		if timeframe != self.default_timeframe:
+			result = np.asarray(result)[self.index(timeframe)]
+		return result
+
+	def indicator(self, timeframe: str, indicator_name: str, params: dict | None = None):
+		leaf = self.add_indicator(timeframe, indicator_name, params or {})
+		return self.value(leaf, True)
+
+	def value(self, node: tuple, is_buy: bool):
+		"""Value of a leaf node, aligned to the default timeframe"""
+		match node[0]:
+			case 'value':
+				return node[1]
+
+			case 'ohlc':
+				return self.__data[self.default_timeframe][node[1]].to_numpy()
+
+			case 'indicator':
+				key = node
+				if key not in self.__results:
+					if node not in self.__indicators:
+						self.add_indicator(node[1], node[2], dict(node[3]))
+					source, output = self.__indicators[node]
+					result = self.__compute_source(source)
+					if output is not None:
+						result = result[output]
+					result = np.nan_to_num(np.array(result))
+					self.__results[key] = self.__align(node[1], result)
+
+			case 'template':
+				key = (node, is_buy)
+				if key not in self.__results:
+					result = self.__compute_source(('template', node[1], node[2]))
+					result = np.where(result == (1 if is_buy else -1), 1, 0)
+					self.__results[key] = self.__align(node[1], result)
+
+		return self.__results[key]
+
+
+def _evaluate_math_func(func: str, value: np.ndarray | float | int):
+	# ndarray.max/min matches the builtins when there is no NaN, without iterating in Python
+	if func in ['max', 'min'] and isinstance(value, np.ndarray) and not np.isnan(value).any():
+		return value.max() if func == 'max' else value.min()
+	return evaluate_math_func(func, value)
+
+
+def _evaluate_node(node: tuple, graph: IndicatorGraph, is_buy: bool):
+	match node[0]:
+		case 'operator':
+			value_1 = _evaluate_node(node[2], graph, is_buy)
+			value_2 = _evaluate_node(node[3], graph, is_buy)
+			return evaluate_expression(value_1, node[1], value_2)
+
+		case 'math_func':
+			value = _evaluate_node(node[2], graph, is_buy)
+			return _evaluate_math_func(node[1], value)
+
+		case _:
+			return graph.value(node, is_buy)
+
+
+def evaluate_program(
+	program: StrategyProgram,
+	df: IndicatorGraph | dict[str, pd.DataFrame] | pd.DataFrame,
+	is_buy: bool,
+	default_timeframe='1h',
+):
+	"""
+	Evaluate a compiled strategy against the OHLC data.
+	Pass the same `IndicatorGraph` for the buy and sell programs to share indicator results between them.
+
+	Returns:
+		result:
+		Same as `evaluate_expressions(evaluate_values(df, strategy, is_buy, default_timeframe))`
+	"""
+	if isinstance(df, IndicatorGraph):
+		graph = df
+	else:
+		graph = IndicatorGraph(df, default_timeframe)
+
+	graph.add(program)
+	graph.compute()
+	# Timed apart from the indicators, so that their time is not counted twice
+	with stage_timer('evaluate'):
+		return _evaluate_node(program.root, graph, is_buy)
+
+
+HOLD = 0
+BUY = 1
+SELL = 2
+TRADE_TYPES = np.array(['hold', 'buy', 'sell'])
+
+
+class TradeSimulation:
+	"""Compact result of `simulate_trades`
+
+	Attributes:
+		holdings: Amount held at each bar, in the unit given by `units`
+		units: 0 when holding `unit_types[0]`, 1 when holding `unit_types[1]`
+		trade_types: `HOLD`, `BUY` or `SELL` at each bar
+		trade_bars, trade_sides, trade_from_amounts, trade_to_amounts, trade_prices: One row per trade
+		stopped_by: `'loss'`, `'profit'`, `'trade limit hit'` or `None`
+
+	Result strings and trade dicts are only built when requested.
+	"""
+
+	def __init__(
+		self,
+		capital: float,
+		open_times: np.ndarray[np.int64],
+		unit_types: tuple[str, str],
+		holdings: np.ndarray[np.float64],
+		units: np.ndarray[np.int8],
+		trade_types: np.ndarray[np.int8],
+		trades: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+		stopped_by: str | None,
+	):
+		self.capital = capital
+		self.open_times = open_times
+		self.unit_types = unit_types
+		self.holdings = holdings
+		self.units = units
+		self.trade_types = trade_types
+		self.trade_bars, self.trade_sides, self.trade_from_amounts, self.trade_to_amounts, self.trade_prices = trades
+		self.stopped_by = stopped_by
+		self.__first_trade = int(self.trade_bars[0]) if len(self.trade_bars) > 0 else len(holdings)
+
+	@property
+	def buy_count(self):
+		return int(np.count_nonzero(self.trade_types == BUY))
+
+	@property
+	def sell_count(self):
+		return int(np.count_nonzero(self.trade_types == SELL))
+
+	def result(self, index: int) -> str:
+		"""Holding at `index` formatted as `'<amount> <unit>'`"""
+		if index < 0:
+			index += len(self.holdings)
+
+		if index < self.__first_trade:
+			return f'{self.capital} {self.unit_types[0]}'
+		return f'{self.holdings[index]} {self.unit_types[self.units[index]]}'
+
+	def results(self) -> list[str]:
+		return [self.result(i) for i in range(len(self.holdings))]
+
+	def trade_type_names(self) -> list[str]:
+		return TRADE_TYPES[self.trade_types].tolist()
+
+	def trades(self) -> list[dict]:
+		trades = []
+		for bar, side, from_amount, to_amount, price in zip(
+			self.trade_bars,
+			self.trade_sides,
+			self.trade_from_amounts,
+			self.trade_to_amounts,
+			self.trade_prices,
+		):
+			from_token, to_token = self.unit_types if side == BUY else self.unit_types[::-1]
+			trade_time = datetime.fromtimestamp(self.open_times[bar] / 1000).astimezone(pytz.UTC)
 			trades.append(
 				{
-					'timestamp': int(open_times[i]),
+					'timestamp': int(self.open_times[bar]),
 					'datetime': trade_time,
-					'from_amount': float(old_amount),
-					'from_token': unit_types[1],
-					'to_amount': float(base_amount),
-					'to_token': unit_types[0],
-					'price': float(close_data[i]),
+					'from_amount': float(from_amount),
+					'from_token': from_token,
+					'to_amount': float(to_amount),
+					'to_token': to_token,
+					'price': float(price),
 				}
 			)
-		else:
-			holdings[i] = holdings[i - 1] if i > 0 else capital
-			units[i] = units[i - 1] if i > 0 else unit_types[0]
+		return trades
+
+	def to_dict(self):
+		return {
+			'results': self.results(),
+			'trades': self.trades(),
+			'holdings': self.holdings.tolist(),
+			'units': [self.unit_types[unit] for unit in self.units],
+			'trade_types': self.trade_type_names(),
+			'stopped_by': self.stopped_by,
+		}
+
+
+def _position_arrays(capital: float, length: int, trade_bars: np.ndarray[np.int64], amounts: list[float]):
+	"""Holdings and units per bar, for trades alternating buy / sell starting with a buy"""
+	segments = np.diff(trade_bars, prepend=0, append=length)
+	holdings = np.repeat(np.array([capital, *amounts], dtype=np.float64), segments)
+	units = np.zeros(len(trade_bars) + 1, dtype=np.int8)
+	units[1::2] = 1
+	return holdings, np.repeat(units, segments)
+
+
+@timed('simulate')
+def simulate_trades(
+	capital: float,
+	open_times: np.ndarray[np.int64],
+	close_data: np.ndarray[np.float64],
+	buy_signals: np.ndarray[np.int8],
+	sell_signals: np.ndarray[np.int8],
+	unit_types: tuple[str, str],
+	stop_loss: float = None,
+	take_profit: float = None,
+	trade_limit: int = 300,
+) -> TradeSimulation:
+	"""
+	Same semantics as the bar by bar simulation, but only visits trade events:
+	the buy / sell chain is followed through `searchsorted` lookups, and stop loss / take profit,
+	which end the simulation, are found with one vectorised pass over the bars holding a position.
+	Bars with NaN close never trade, stop loss is checked before take profit, which is checked before the sell signal.
+	"""
+	buy_signals = np.atleast_1d(np.asarray(buy_signals))
+	sell_signals = np.atleast_1d(np.asarray(sell_signals))
+	if len(buy_signals) == 1:
+		buy_signals = buy_signals.repeat(len(close_data))
+	if len(sell_signals) == 1:
+		sell_signals = sell_signals.repeat(len(close_data))
 
-		results[i] = f'{holdings[i]} {units[i]}'
+	length = min(len(buy_signals), len(sell_signals))
+	close_data = np.asarray(close_data, dtype=np.float64)[:length]
+	valid = ~np.isnan(close_data)
+	stopped_by = None
+
+	first_bar_only = trade_limit is not None and trade_limit <= 0
+	if first_bar_only:
+		# Trade limit is checked after each bar, so only a buy on the first bar can happen
+		buy_bars = np.flatnonzero((buy_signals[:1] != 0) & valid[:1])
+		sell_bars = np.array([], dtype=np.int64)
+		stopped_by = 'trade limit hit'
+	else:
+		buy_bars = np.flatnonzero((buy_signals[:length] != 0) & valid)
+		sell_bars = np.flatnonzero((sell_signals[:length] != 0) & valid)
 
-		if not (np.isnan(close_data[i]) or close_data[i] is None):
-			last_price = close_data[i]
+	# First sell after each buy, and first buy after each sell
+	next_sells = np.searchsorted(sell_bars, buy_bars, side='right')
+	next_buys = np.searchsorted(buy_bars, sell_bars, side='right')
 
-		if trade_limit is not None and not stopped and trade_count >= trade_limit:
-			stopped = True
+	bars = []
+	buy_index = 0
+	trade_count = 0
+	while buy_index < len(buy_bars):
+		bars.append(buy_bars[buy_index])
+		sell_index = next_sells[buy_index]
+		if sell_index == len(sell_bars):
+			break
+
+		bars.append(sell_bars[sell_index])
+		trade_count += 1
+		if trade_limit is not None and trade_count >= trade_limit:
 			stopped_by = 'trade limit hit'
+			break
+		buy_index = next_buys[sell_index]
+
+	trade_bars = np.array(bars, dtype=np.int64)
+	prices = close_data[trade_bars].tolist()
+	amounts = []
+	amount = capital
+	for i, price in enumerate(prices):
+		amount = amount / price if i % 2 == 0 else amount * price
+		amounts.append(amount)
+
+	holdings, units = _position_arrays(capital, length, trade_bars, amounts)
+
+	if (stop_loss is not None or take_profit is not None) and len(bars) > 0 and length > 1 and not first_bar_only:
+		# Value at each bar of the position held since the previous bar
+		held = units[:-1] == 1
+		values = holdings[:-1] * close_data[1:]
+		loss_hits = held & (values <= stop_loss) if stop_loss is not None else np.zeros(length - 1, dtype=bool)
+		profit_hits = held & (values >= take_profit) if take_profit is not None else np.zeros(length - 1, dtype=bool)
+		hits = loss_hits | profit_hits
+		hit = int(np.argmax(hits))
+		if hits[hit]:
+			bar = hit + 1
+			events = int(np.searchsorted(trade_bars, bar))
+			stopped_by = 'loss' if loss_hits[hit] else 'profit'
+			trade_bars = np.append(trade_bars[:events], bar)
+			prices = prices[:events] + [close_data[bar]]
+			amounts = amounts[:events] + [amounts[events - 1] * close_data[bar]]
+			holdings, units = _position_arrays(capital, length, trade_bars, amounts)
+
+	trade_types = np.zeros(length, dtype=np.int8)
+	trade_sides = np.tile(np.array([BUY, SELL], dtype=np.int8), len(trade_bars) // 2 + 1)[: len(trade_bars)]
+	trade_types[trade_bars] = trade_sides
 
 	# Final value if still holding coins
-	base_amount += sec_amount * last_price
-	holdings[-1] = base_amount
+	if len(trade_bars) % 2 == 1:
+		last_price = close_data[length - 1 - np.argmax(valid[::-1])]
+		holdings[-1] = amounts[-1] * last_price
+		units[-1] = 0
+		trade_types[-1] = SELL
+
+		trade_bars = np.append(trade_bars, length - 1)
+		trade_sides = np.append(trade_sides, np.int8(SELL))
+		prices.append(last_price)
+		amounts.append(holdings[-1])
+
+	trades = (
+		trade_bars,
+		trade_sides,
+		np.array([capital, *amounts[:-1]], dtype=np.float64)[: len(amounts)],
+		np.array(amounts, dtype=np.float64),
+		np.array(prices, dtype=np.float64),
+	)
+	return TradeSimulation(capital, open_times, unit_types, holdings, units, trade_types, trades, stopped_by)
 
-	if units[-1] != unit_types[0]:
-		units[-1] = unit_types[0]
-		results[-1] = f'{holdings[-1]} {units[-1]}'
 
-		trade_types[-1] = 'sell'
+def calculate_amount(
+	capital: float,
+	open_times: np.ndarray[np.int64],
+	close_data: np.ndarray[np.float64],
+	buy_signals: np.ndarray[np.int8],
+	sell_signals: np.ndarray[np.int8],
+	unit_types: tuple[str, str],
+	stop_loss: float = None,
+	take_profit: float = None,
+	trade_limit: int = 300,
+) -> dict:
+	return simulate_trades(
+		capital,
+		open_times,
+		close_data,
+		buy_signals,
+		sell_signals,
+		unit_types,
+		stop_loss,
+		take_profit,
+		trade_limit,
+	).to_dict()
 
-		trade_time = datetime.fromtimestamp(open_times[-1] / 1000).astimezone(pytz.UTC)
-		trades.append(
-			{
-				'timestamp': int(open_times[-1]),
-				'datetime': trade_time,
-				'from_amount': float(sec_amount),
-				'from_token': unit_types[1],
-				'to_amount': float(base_amount),
-				'to_token': unit_types[0],
-				'price': float(last_price),
-			}
-		)
 
-	return {
-		'results': results,
-		'trades': trades,
-		'holdings': [float(holding) for holding in holdings],
-		'units': units,
-		'trade_types': trade_types,
-		'stopped_by': stopped_by,
-	}
+def _trade_type_codes(trade_types: np.ndarray[np.int8] | list[str]) -> np.ndarray[np.int8]:
+	trade_types = np.asarray(trade_types)
+	if trade_types.dtype.kind in 'iu':
+		return trade_types
+	return np.select([trade_types == 'buy', trade_types == 'sell'], [BUY, SELL], HOLD).astype(np.int8)
+
 
+def _segment_starts(values: np.ndarray) -> np.ndarray[np.int64]:
+	"""Start index of each run of equal values in a sorted array"""
+	return np.flatnonzero(np.diff(values, prepend=-1))
 
+
+@timed('analyse')
 def analyse_strategy(
 	capital: float,
 	close_prices: np.ndarray[np.float64],
-	holdings: list[float],
-	trade_types: list[str],
+	holdings: np.ndarray[np.float64] | list[float],
+	trade_types: np.ndarray[np.int8] | list[str],
 	trades: list,
+	periods_per_year: int = 365 * 24,
 ):
-	max_run_up = None
-	run_ups = []  # Max Equity Run-Up: Maximum potential profit within trades
-	max_drawdowns = []  # Max Equity Drawdowns: Largest peak-to-trough decline within trades
-	max_drawdowns_perc = []  # Max Equity Drawdowns: Largest peak-to-trough decline within trades
-	drawdowns = []
-	drawdowns_perc = []
-	buy_amounts = []
-
-	profits = []
-	buy_amount = None
-	highest = None
-	lowest = None
-	total_bars = 0
-
-	for i in range(len(trade_types)):
-		if trade_types[i] == 'buy':
-			buy_amount = holdings[i - 1] if i > 0 else capital
-			highest = close_prices[i]
-			lowest = close_prices[i]
-		elif trade_types[i] == 'sell':
-			total_bars += 1
-			buy_amounts.append(buy_amount)
-			this_profit = holdings[i] - buy_amount
-			profits.append(this_profit)
-			buy_amount = None
-
-			run_ups.append(max_run_up)
-			max_run_up = None
-			max_drawdowns.append(float(np.min(drawdowns)) if len(drawdowns) > 0 else None)
-			drawdowns = []
-			max_drawdowns_perc.append(float(np.min(drawdowns_perc)) if len(drawdowns_perc) > 0 else None)
-			drawdowns_perc = []
-		elif buy_amount is not None:
-			total_bars += 1
-			amount_if_traded = holdings[i] * close_prices[i]
-			profit_if_traded = amount_if_traded - buy_amount
-			max_run_up = float(max(max_run_up if max_run_up is not None else -math.inf, profit_if_traded))
-			if max_run_up < 0:
-				max_run_up = None
-
-			if close_prices[i] >= highest:
-				if highest != lowest:
-					drawdowns.append(lowest - highest)
-					drawdowns_perc.append((lowest - highest) / highest)
-				highest = close_prices[i]
-				lowest = close_prices[i]
-			else:
-				lowest = min(lowest, close_prices[i])
+	"""
+	Performance report of a simulation, computed per trade segment (buy bar to sell bar) with NumPy.
+	`trade_types` can either be `TRADE_TYPES` names or `HOLD` / `BUY` / `SELL` codes.
+	`periods_per_year` is used to annualise the Sharpe and Sortino ratios of the per bar equity returns.
+	"""
+	close_prices = np.asarray(close_prices, dtype=np.float64)
+	holdings = np.asarray(holdings, dtype=np.float64)
+	trade_types = _trade_type_codes(trade_types)
+	length = len(trade_types)
+	close_prices = close_prices[:length]
+
+	buy_bars = np.flatnonzero(trade_types == BUY)
+	sell_bars = np.flatnonzero(trade_types == SELL)
+	if len(sell_bars) > len(buy_bars):
+		# Bought on the last bar, then sold by the final sell on the same bar
+		buy_bars = np.append(buy_bars, sell_bars[-1])
+
+	closed = len(sell_bars)
+	is_open = len(buy_bars) > closed
+	ends = np.append(sell_bars, length) if is_open else sell_bars
+	buy_amounts = np.where(buy_bars > 0, holdings[np.maximum(buy_bars - 1, 0)], capital)
+	profits = holdings[sell_bars] - buy_amounts[:closed]
+
+	# Bars holding a position, excluding the buy and sell bars
+	held = np.cumsum(np.bincount(buy_bars + 1, minlength=length + 2) - np.bincount(ends, minlength=length + 2))
+	held = held[:length] > 0
+	total_bars = int(np.count_nonzero(held)) + closed
+
+	# Max Equity Run-Up: Maximum potential profit within trades
+	values = np.append(holdings * close_prices, np.nan)
+	bounds = np.column_stack((buy_bars + 1, ends)).ravel()
+	run_ups = np.fmax.reduceat(values, bounds)[::2] - buy_amounts if len(bounds) > 0 else np.array([])
+	run_ups = [
+		float(run_up) if start < end and run_up >= 0 else None
+		for run_up, start, end in zip(run_ups[:closed].tolist(), buy_bars + 1, ends)
+	]
+
+	# Max Equity Drawdowns: Largest peak-to-trough decline within trades, between a high and the next higher high
+	max_drawdowns = [None] * closed
+	max_drawdowns_perc = [None] * closed
+	if closed > 0:
+		valid_prices = np.where(np.isnan(close_prices), -np.inf, close_prices)
+		running_highs = np.full(length, np.inf)
+		for start, end in zip(buy_bars[:closed], ends[:closed]):
+			np.maximum.accumulate(valid_prices[start:end], out=running_highs[start:end])
+
+		highs = np.flatnonzero(valid_prices == running_highs)
+		bounds = np.union1d(highs, ends)
+		is_high = np.isin(bounds, highs)
+		lows = np.minimum.reduceat(np.append(np.where(np.isnan(close_prices), np.inf, close_prices), np.inf), bounds)
+
+		# A drawdown is recorded when the next boundary is a higher high of the same trade
+		recorded = np.flatnonzero(is_high[:-1] & is_high[1:])
+		highest = close_prices[bounds[recorded]]
+		lowest = lows[recorded]
+		recorded = recorded[lowest < highest]
+		highest = close_prices[bounds[recorded]]
+		drawdowns = lows[recorded] - highest
+		drawdowns_perc = drawdowns / highest
+
+		trade_ids = np.searchsorted(buy_bars, bounds[recorded], side='right') - 1
+		segments = _segment_starts(trade_ids)
+		if len(segments) > 0:
+			trade_ids = trade_ids[segments]
+			for trade_id, drawdown, drawdown_perc in zip(
+				trade_ids.tolist(),
+				np.minimum.reduceat(drawdowns, segments).tolist(),
+				np.minimum.reduceat(drawdowns_perc, segments).tolist(),
+			):
+				max_drawdowns[trade_id] = drawdown
+				max_drawdowns_perc[trade_id] = drawdown_perc
 
 	# Open P&L: Profit/Loss of remaining open trades
-	open_profit = buy_amount * close_prices[-1] if buy_amount is not None else 0
+	open_profit = buy_amounts[-1] * close_prices[-1] if is_open else 0
 
 	max_drawdown = None
 	max_drawdown_perc = None
@@ -757,6 +1209,38 @@ def analyse_strategy(
 	if len(valid_run_ups) > 0:
 		max_run_up = float(max(valid_run_ups))
 
+	# Equity curve: value of the holdings at each bar, carrying the last value over missing prices
+	in_position = held.copy()
+	in_position[buy_bars] = True
+	in_position[sell_bars] = False
+	equity = np.where(in_position, holdings * close_prices, holdings)
+	missing = np.isnan(equity)
+	if missing.any():
+		equity = equity[np.maximum.accumulate(np.where(missing, 0, np.arange(length)))]
+
+	equity_max_drawdown = None
+	equity_max_drawdown_perc = None
+	sharpe_ratio = None
+	sortino_ratio = None
+	exposure_time = None
+	if length > 0:
+		peaks = np.maximum.accumulate(equity)
+		equity_max_drawdown = float(np.min(equity - peaks))
+		equity_max_drawdown_perc = float(np.min((equity - peaks) / peaks))
+		exposure_time = float(np.count_nonzero(in_position) / length)
+
+	returns = np.diff(equity) / equity[:-1] if length > 1 else np.array([])
+	if len(returns) > 1:
+		average_return = np.mean(returns)
+		deviation = np.std(returns, ddof=1)
+		downside_deviation = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+		if deviation > 0:
+			sharpe_ratio = float(average_return / deviation * np.sqrt(periods_per_year))
+		if downside_deviation > 0:
+			sortino_ratio = float(average_return / downside_deviation * np.sqrt(periods_per_year))
+
+	profits = profits.tolist()
+	buy_amounts = buy_amounts[:closed].tolist()
 	total_trades = len(profits)
 	winning_trades = [profit for profit in profits if profit >= 0]
 	losing_trades = [profit for profit in profits if profit < 0]
@@ -829,6 +1313,11 @@ def analyse_strategy(
 		'max_equity_run_up': max_run_up,
 		'max_drawdown': max_drawdown,
 		'max_drawdown_percentage': max_drawdown_perc,
+		'equity_max_drawdown': equity_max_drawdown,
+		'equity_max_drawdown_percentage': equity_max_drawdown_perc,
+		'sharpe_ratio': sharpe_ratio,
+		'sortino_ratio': sortino_ratio,
+		'exposure_time': exposure_time,
 		# Trade analysis
 		'total_trades': total_trades,
 		'winning_count': winning_count,
@@ -1,2 +1,6 @@
 class NotEnoughTokenException(Exception):
 	pass
+
+
+class ExecutorSaturatedException(Exception):
+	pass
@@ -0,0 +1,320 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import talib
+from django.conf import settings
+
+from core import instrumentation
+from core.calculations import (
+	IndicatorGraph,
+	StrategyProgram,
+	analyse_strategy,
+	compile_strategy,
+	evaluate_program,
+	simulate_trades,
+)
+from core.exceptions import ExecutorSaturatedException
+from core.monte_carlo import monte_carlo
+
+BACKTEST_WORKERS: int = settings.BACKTEST_WORKERS
+BACKTEST_QUEUE_SIZE: int = settings.BACKTEST_QUEUE_SIZE
+
+
+def program_timeframes(program: StrategyProgram) -> set[str]:
+	"""Timeframes of the indicators and templates of a compiled strategy"""
+	timeframes = set()
+	nodes = [program.root]
+	while len(nodes) > 0:
+		node = nodes.pop()
+		match node[0]:
+			case 'operator':
+				nodes.extend((node[2], node[3]))
+			case 'math_func':
+				nodes.append(node[2])
+			case 'indicator' | 'template':
+				timeframes.add(node[1])
+	return timeframes
+
+
+def run_backtest(
+	frames: dict[str, pd.DataFrame],
+	timeframe: str,
+	buy_strategy: list,
+	sell_strategy: list,
+	options: dict,
+) -> dict:
+	"""
+	Evaluate, simulate and analyse a strategy over `frames[timeframe]`, the pipeline of a backtest request.
+	`frames` may hold the data of other timeframes already resampled, others are resampled here.
+	"""
+	buy_program = compile_strategy(buy_strategy)
+	sell_program = compile_strategy(sell_strategy)
+	graph = IndicatorGraph(dict(frames), timeframe)
+	graph.add(buy_program)
+	graph.add(sell_program)
+	buy_results = evaluate_program(buy_program, graph, True)
+	sell_results = evaluate_program(sell_program, graph, False)
+
+	df = frames[timeframe]
+	close_data = df['Close'].to_numpy()
+	simulation = simulate_trades(
+		capital=options['capital'],
+		open_times=df['Open Time'].to_numpy(),
+		close_data=close_data,
+		buy_signals=buy_results,
+		sell_signals=sell_results,
+		unit_types=options['unit_types'],
+		stop_loss=options['stop_loss'],
+		take_profit=options['take_profit'],
+		trade_limit=options['trade_limit'],
+	)
+
+	trade_events = simulation.trades()
+	return {
+		'final_amount': simulation.result(-1),
+		'profit': float(simulation.holdings[-1]) - options['capital'],
+		'trade_events': trade_events,
+		'buy_count': simulation.buy_count,
+		'sell_count': simulation.sell_count,
+		'stopped_by': simulation.stopped_by,
+		'performance_report': analyse_strategy(
+			options['capital'],
+			close_data,
+			simulation.holdings,
+			simulation.trade_types,
+			trade_events,
+			periods_per_year=options['periods_per_year'],
+		),
+	}
+
+
+def run_batch(
+	frames: dict[str, pd.DataFrame],
+	timeframe: str,
+	variants: list[dict],
+	unit_types: list[str],
+	periods_per_year: float,
+	progress: Callable[[float], None] | None = None,
+) -> list[dict]:
+	"""
+	Backtests of several compiled strategy variants over the same `frames[timeframe]`, sharing their indicators.
+	Each variant holds its `name`, `capital_amount`, `take_profit`, `stop_loss`, `trade_limit`,
+	`buy_program` and `sell_program`.
+	"""
+	graph = IndicatorGraph(dict(frames), timeframe)
+	for variant in variants:
+		graph.add(variant['buy_program'])
+		graph.add(variant['sell_program'])
+	graph.compute()
+
+	df = frames[timeframe]
+	open_times = df['Open Time'].to_numpy()
+	close_data = df['Close'].to_numpy()
+
+	# Variants often share a leg, e.g. the same sell strategy with different buy strategies
+	signals = {}
+	results = []
+	for variant in variants:
+		for program, is_buy in ((variant['buy_program'], True), (variant['sell_program'], False)):
+			if (program.key, is_buy) not in signals:
+				signals[(program.key, is_buy)] = evaluate_program(program, graph, is_buy)
+
+		simulation = simulate_trades(
+			capital=variant['capital_amount'],
+			open_times=open_times,
+			close_data=close_data,
+			buy_signals=signals[(variant['buy_program'].key, True)],
+			sell_signals=signals[(variant['sell_program'].key, False)],
+			unit_types=unit_types,
+			stop_loss=variant['stop_loss'],
+			take_profit=variant['take_profit'],
+			trade_limit=variant['trade_limit'],
+		)
+		report = analyse_strategy(
+			variant['capital_amount'],
+			close_data,
+			simulation.holdings,
+			simulation.trade_types,
+			simulation.trades(),
+			periods_per_year=periods_per_year,
+		)
+		report.pop('trade_reports')
+
+		results.append(
+			{
+				'name': variant['name'],
+				'capital': variant['capital_amount'],
+				'take_profit': variant['take_profit'],
+				'stop_loss': variant['stop_loss'],
+				'trade_limit': variant['trade_limit'],
+				'final_amount': simulation.result(-1),
+				'profit': float(simulation.holdings[-1]) - variant['capital_amount'],
+				'buy_count': simulation.buy_count,
+				'sell_count': simulation.sell_count,
+				'stopped_by': simulation.stopped_by,
+				'performance_report': report,
+			}
+		)
+		if progress is not None:
+			progress(len(results) / len(variants))
+	return results
+
+
+def run_monte_carlo(
+	frames: dict[str, pd.DataFrame],
+	timeframe: str,
+	buy_program: StrategyProgram,
+	sell_program: StrategyProgram,
+	options: dict,
+	monte_carlo_options: dict,
+) -> dict:
+	"""Backtest of a compiled strategy over `frames[timeframe]` followed by a `monte_carlo` test of its trades"""
+	graph = IndicatorGraph(dict(frames), timeframe)
+	graph.add(buy_program)
+	graph.add(sell_program)
+	graph.compute()
+
+	df = frames[timeframe]
+	open_times = df['Open Time'].to_numpy()
+	close_data = df['Close'].to_numpy()
+	simulation = simulate_trades(
+		capital=options['capital'],
+		open_times=open_times,
+		close_data=close_data,
+		buy_signals=evaluate_program(buy_program, graph, True),
+		sell_signals=evaluate_program(sell_program, graph, False),
+		unit_types=options['unit_types'],
+		stop_loss=options['stop_loss'],
+		take_profit=options['take_profit'],
+		trade_limit=options['trade_limit'],
+	)
+	results = monte_carlo(
+		options['capital'],
+		simulation.trades(),
+		close_prices=close_data,
+		open_times=open_times,
+		**monte_carlo_options,
+	)
+	return {'final_amount': simulation.result(-1), 'stopped_by': simulation.stopped_by, **results}
+
+
+def _initialize_worker():
+	# Unpickling this function imported `core.calculations`, building the TA registries,
+	# and a first call maps in TA-Lib, so that the first task does not pay for either
+	talib.SMA(np.arange(32, dtype=np.float64))
+
+
+def _ready():
+	return os.getpid()
+
+
+def _timed_call(fn, *args, **kwargs):
+	# Timings of the worker, returned to be added to those of the request which submitted the task
+	instrumentation.enable()
+	with instrumentation.collect() as timings:
+		result = fn(*args, **kwargs)
+	return result, timings
+
+
+class BacktestExecutor:
+	"""
+	Warm pool of worker processes for CPU bound work such as `run_backtest`, keeping it off the GIL of the server.
+
+	At most `max_pending` tasks are queued or running at once, further ones raise `ExecutorSaturatedException`
+	rather than waiting behind them. Without workers tasks run in a thread pool of the calling process.
+	Work submitting tasks of its own, such as an optimisation, holds a slot with `reserve` for as long as it runs.
+	"""
+
+	def __init__(self, max_workers: int = BACKTEST_WORKERS, max_pending: int = BACKTEST_QUEUE_SIZE):
+		self.max_workers = max_workers
+		self.max_pending = max_pending
+		self.__executor: Executor | None = None
+		self.__slots = threading.BoundedSemaphore(max(max_pending, 1))
+		self.__lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.shutdown()
+
+	def __pool(self, broken: Executor | None = None) -> Executor:
+		with self.__lock:
+			if broken is not None and self.__executor is broken:
+				# A worker died, e.g. killed for memory, which breaks the whole pool
+				broken.shutdown(wait=False, cancel_futures=True)
+				self.__executor = None
+
+			if self.__executor is None:
+				if self.max_workers > 0:
+					# Spawn, as forking a process with Firestore / gRPC threads is unsafe
+					self.__executor = ProcessPoolExecutor(
+						max_workers=self.max_workers,
+						mp_context=multiprocessing.get_context('spawn'),
+						initializer=_initialize_worker,
+					)
+				else:
+					self.__executor = ThreadPoolExecutor(thread_name_prefix='backtest')
+			return self.__executor
+
+	def warm(self):
+		"""Start every worker process now instead of on the first tasks"""
+		if self.max_workers > 0:
+			pool = self.__pool()
+			for _ in range(self.max_workers):
+				pool.submit(_ready)
+
+	def __acquire(self):
+		if not self.__slots.acquire(blocking=False):
+			raise ExecutorSaturatedException(f'{self.max_pending} backtests are already running!')
+
+	@contextmanager
+	def reserve(self):
+		"""The pool itself, while holding a slot, for work submitting many tasks to it"""
+		self.__acquire()
+		try:
+			yield self.__pool()
+		finally:
+			self.__slots.release()
+
+	def submit(self, fn, *args, **kwargs) -> Future:
+		self.__acquire()
+		try:
+			pool = self.__pool()
+			try:
+				future = pool.submit(fn, *args, **kwargs)
+			except BrokenProcessPool:
+				future = self.__pool(broken=pool).submit(fn, *args, **kwargs)
+		except BaseException:
+			self.__slots.release()
+			raise
+
+		future.add_done_callback(lambda _: self.__slots.release())
+		return future
+
+	async def run(self, fn, *args, **kwargs):
+		"""Result of `fn(*args, **kwargs)`, awaited without blocking the event loop"""
+		if not instrumentation.collecting():
+			return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+		result, timings = await asyncio.wrap_future(self.submit(_timed_call, fn, *args, **kwargs))
+		instrumentation.merge(timings)
+		return result
+
+	def shutdown(self):
+		with self.__lock:
+			executor = self.__executor
+			self.__executor = None
+		if executor is not None:
+			executor.shutdown(wait=True)
+
+
+BACKTEST_EXECUTOR = BacktestExecutor()
@@ -0,0 +1,149 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Upper bounds in seconds of the histogram buckets, from a cached read to a long Firestore fetch
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Off until `enable` is called, so that a timed stage only costs a check of this flag
+ENABLED = False
+_timings: ContextVar[dict[str, float] | None] = ContextVar('timings', default=None)
+
+
+class Histogram:
+	"""Cumulative histogram of durations in seconds per value of a label, rendered in the Prometheus text format"""
+
+	def __init__(self, name: str, description: str, label: str, buckets: tuple[float, ...] = BUCKETS):
+		self.name = name
+		self.description = description
+		self.label = label
+		self.buckets = buckets
+		self.__series: dict[str, tuple[list[int], list[float]]] = {}
+		self.__lock = threading.Lock()
+
+	def observe(self, value: str, seconds: float):
+		with self.__lock:
+			series = self.__series.get(value)
+			if series is None:
+				series = ([0] * (len(self.buckets) + 1), [0.0])
+				self.__series[value] = series
+			counts, total = series
+			for i, bound in enumerate(self.buckets):
+				if seconds <= bound:
+					counts[i] += 1
+					break
+			else:
+				counts[-1] += 1
+			total[0] += seconds
+
+	def count(self, value: str) -> int:
+		with self.__lock:
+			series = self.__series.get(value)
+			return sum(series[0]) if series is not None else 0
+
+	def render(self) -> str:
+		lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+		with self.__lock:
+			series = sorted((value, list(counts), total[0]) for value, (counts, total) in self.__series.items())
+
+		for value, counts, total in series:
+			label = f'{self.label}="{_escape(value)}"'
+			cumulative = 0
+			for bound, count in zip((*self.buckets, '+Inf'), counts):
+				cumulative += count
+				lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+			lines.append(f'{self.name}_sum{{{label}}} {total}')
+			lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+		return '\n'.join(lines) + '\n'
+
+	def clear(self):
+		with self.__lock:
+			self.__series.clear()
+
+
+def _escape(value: str) -> str:
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_SECONDS = Histogram('machd_stage_seconds', 'Seconds spent in each stage of a request or background task', 'stage')
+
+
+def enable(enabled=True):
+	global ENABLED
+	ENABLED = enabled
+
+
+def enabled() -> bool:
+	return ENABLED
+
+
+def observe(stage: str, seconds: float):
+	"""
+	Add the duration of a stage to the timings of the current request, which are observed once it finishes,
+	or observe it in `STAGE_SECONDS` now outside of any, e.g. in a background thread
+	"""
+	timings = _timings.get()
+	if timings is not None:
+		timings[stage] = timings.get(stage, 0.0) + seconds
+	else:
+		STAGE_SECONDS.observe(stage, seconds)
+
+
+def timed(stage: str):
+	"""Decorator timing every call of a function as `stage`, while timings are enabled"""
+
+	def decorator(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			if not ENABLED:
+				return func(*args, **kwargs)
+
+			start = time.perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				observe(stage, time.perf_counter() - start)
+
+		return wrapper
+
+	return decorator
+
+
+@contextmanager
+def stage_timer(stage: str):
+	"""Time a block as `stage`, while timings are enabled"""
+	if not ENABLED:
+		yield
+		return
+
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		observe(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+	"""
+	Collect the timings of the stages run in this context, summed per stage, e.g. for a request.
+	Threads started with a copy of the context add to them too, so that stages run in parallel add up.
+	"""
+	timings = {}
+	token = _timings.set(timings)
+	try:
+		yield timings
+	finally:
+		_timings.reset(token)
+
+
+def collecting() -> bool:
+	return ENABLED and _timings.get() is not None
+
+
+def merge(timings: dict[str, float]):
+	"""Add timings collected elsewhere, e.g. in a worker process, to the current ones"""
+	for stage, seconds in timings.items():
+		observe(stage, seconds)
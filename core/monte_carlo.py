@@ -0,0 +1,207 @@
+import numpy as np
+
+MAX_PATHS = 100000
+# Upper bound of paths x trades, as the path metrics take several float64 arrays of that size, about 40MB each
+MAX_CELLS = 5_000_000
+METHODS = ['shuffle', 'bootstrap', 'block']
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+# Upper bound of paths x blocks generated at once by the block bootstrap, about 32MB per float64 array
+BLOCK_CHUNK_CELLS = 4_000_000
+
+
+def trade_returns(trades: list[dict]) -> np.ndarray[np.float64]:
+	"""
+	Growth factor of each round trip of a trade list from `calculate_amount`,
+	i.e. the amount received by a sell divided by the amount spent by the buy before it
+	"""
+	spent = np.array([trade['from_amount'] for trade in trades[0::2]], dtype=np.float64)
+	received = np.array([trade['to_amount'] for trade in trades[1::2]], dtype=np.float64)
+	return received / spent[: len(received)]
+
+
+def trade_bars(trades: list[dict], open_times: np.ndarray[np.int64]) -> tuple[np.ndarray, np.ndarray]:
+	"""Buy and sell bar of each round trip, found by timestamp"""
+	timestamps = np.array([trade['timestamp'] for trade in trades], dtype=np.int64)
+	bars = np.searchsorted(np.asarray(open_times, dtype=np.int64), timestamps)
+	count = len(bars) // 2
+	return bars[0 : count * 2 : 2], bars[1 : count * 2 : 2]
+
+
+def shuffle_paths(returns: np.ndarray[np.float64], paths: int, rng: np.random.Generator) -> np.ndarray[np.float64]:
+	"""`paths x trades` matrix of the trade returns, each row in a random order"""
+	return rng.permuted(np.broadcast_to(returns, (paths, len(returns))), axis=1)
+
+
+def bootstrap_paths(returns: np.ndarray[np.float64], paths: int, rng: np.random.Generator) -> np.ndarray[np.float64]:
+	"""`paths x trades` matrix of trade returns drawn with replacement"""
+	return returns[rng.integers(0, len(returns), size=(paths, len(returns)))]
+
+
+def block_bootstrap_paths(
+	close_prices: np.ndarray[np.float64],
+	buy_bars: np.ndarray[np.int64],
+	sell_bars: np.ndarray[np.int64],
+	paths: int,
+	block_size: int,
+	rng: np.random.Generator,
+) -> np.ndarray[np.float64]:
+	"""
+	`paths x trades` matrix of the trade returns replayed over price paths
+	made of blocks of `block_size` consecutive log returns of `close_prices`, drawn with replacement.
+
+	The price paths are never built bar by bar: from the prefix sums of the log returns,
+	the log price change of a path up to bar `t` is the sum of the blocks before `t // block_size`
+	plus the first `t % block_size` returns of the block at `t // block_size`,
+	so only the blocks and the trade bars are evaluated.
+	"""
+	close_prices = np.asarray(close_prices, dtype=np.float64)
+	valid = ~np.isnan(close_prices)
+	close_prices = close_prices[np.maximum.accumulate(np.where(valid, np.arange(len(close_prices)), 0))]
+	increments = np.diff(np.log(close_prices))
+	increments[np.isnan(increments)] = 0
+	prefix = np.concatenate(([0.0], np.cumsum(increments)))
+
+	block_count = len(increments) // block_size + 1
+	max_start = len(increments) - block_size
+	bars = np.concatenate((buy_bars, sell_bars))
+	blocks = bars // block_size
+	offsets = bars % block_size
+
+	returns = np.empty((paths, len(buy_bars)), dtype=np.float64)
+	chunk = max(1, BLOCK_CHUNK_CELLS // block_count)
+	for first in range(0, paths, chunk):
+		# Chunks of paths bound the memory used, each chunk is one vectorised computation
+		starts = rng.integers(0, max_start + 1, size=(min(chunk, paths - first), block_count))
+		block_sums = prefix[starts + block_size] - prefix[starts]
+		before = np.cumsum(block_sums, axis=1) - block_sums
+		block_starts = starts[:, blocks]
+		changes = before[:, blocks] + prefix[block_starts + offsets] - prefix[block_starts]
+		returns[first : first + len(starts)] = np.exp(changes[:, len(buy_bars) :] - changes[:, : len(buy_bars)])
+	return returns
+
+
+def _equity_paths(capital: float, returns: np.ndarray[np.float64]) -> np.ndarray[np.float64]:
+	"""Equity after each trade of each path, starting with `capital`"""
+	equity = np.empty((returns.shape[0], returns.shape[1] + 1), dtype=np.float64)
+	equity[:, 0] = capital
+	np.cumprod(returns, axis=1, out=equity[:, 1:])
+	equity[:, 1:] *= capital
+	return equity
+
+
+def distribution(values: np.ndarray[np.float64]) -> dict | None:
+	if len(values) == 0:
+		return None
+
+	percentiles = np.percentile(values, PERCENTILES)
+	return {
+		'mean': float(np.mean(values)),
+		'std': float(np.std(values)),
+		'min': float(np.min(values)),
+		'max': float(np.max(values)),
+		'percentiles': {str(q): float(value) for q, value in zip(PERCENTILES, percentiles)},
+	}
+
+
+def _path_metrics(capital: float, returns: np.ndarray[np.float64], ruin_level: float):
+	equity = _equity_paths(capital, returns)
+	running_high = np.maximum.accumulate(equity, axis=1)
+	drawdowns = running_high - equity
+	ruined = equity <= capital * ruin_level
+	time_to_ruin = np.where(ruined.any(axis=1), ruined.argmax(axis=1), -1)
+	return equity[:, -1], drawdowns.max(axis=1), (drawdowns / running_high).max(axis=1) * 100, time_to_ruin
+
+
+def analyse_paths(capital: float, returns: np.ndarray[np.float64], ruin_level: float = 0.5) -> dict:
+	"""
+	Distributions of the final equity, max drawdown and time to ruin of a `paths x trades` return matrix.
+	A path is ruined once its equity falls to `capital * ruin_level` or below,
+	and its time to ruin is the number of trades taken to get there.
+	"""
+	final_equity, max_drawdown, max_drawdown_percentage, time_to_ruin = _path_metrics(capital, returns, ruin_level)
+	is_ruined = time_to_ruin >= 0
+	return {
+		'paths': len(final_equity),
+		'trades': returns.shape[1],
+		'final_equity': distribution(final_equity),
+		'max_drawdown': distribution(max_drawdown),
+		'max_drawdown_percentage': distribution(max_drawdown_percentage),
+		'time_to_ruin': distribution(time_to_ruin[is_ruined]),
+		'probability_of_profit': float(np.mean(final_equity > capital)),
+		'probability_of_loss': float(np.mean(final_equity < capital)),
+		'probability_of_ruin': float(np.mean(is_ruined)),
+	}
+
+
+def monte_carlo(
+	capital: float,
+	trades: list[dict],
+	method: str = 'shuffle',
+	paths: int = 1000,
+	ruin_level: float = 0.5,
+	seed: int | None = None,
+	close_prices: np.ndarray[np.float64] | None = None,
+	open_times: np.ndarray[np.int64] | None = None,
+	block_size: int | None = None,
+):
+	"""
+	Monte Carlo robustness test of a finished backtest, `trades` being the trade list of `calculate_amount`.
+
+	Methods:
+		`shuffle`: Trade returns in a random order, the final equity is unchanged but drawdowns and ruin vary
+		`bootstrap`: Trade returns drawn with replacement
+		`block`: Trades replayed at the same bars over block bootstrapped price paths,
+		which needs `close_prices` and `open_times`, `block_size` defaults to the cube root of the bar count
+
+	All paths are simulated at once as a `paths x trades` matrix, of at most `MAX_CELLS` cells.
+	"""
+	if method not in METHODS:
+		raise ValueError(f'Invalid method "{method}"! (Expected one of {", ".join(METHODS)})')
+	if not isinstance(paths, int) or isinstance(paths, bool) or not 0 < paths <= MAX_PATHS:
+		raise ValueError(f'Invalid paths {paths}! (Expected 1 to {MAX_PATHS})')
+	if not isinstance(ruin_level, (int, float)) or isinstance(ruin_level, bool) or not 0 <= ruin_level < 1:
+		raise ValueError(f'Invalid ruin_level {ruin_level}! (Expected >= 0 and < 1)')
+
+	returns = trade_returns(trades)
+	if len(returns) == 0:
+		raise ValueError('No trades to simulate!')
+	if paths * len(returns) > MAX_CELLS:
+		raise ValueError(f'Too many paths {paths} for {len(returns)} trades! (Expected paths x trades <= {MAX_CELLS})')
+
+	rng = np.random.default_rng(seed)
+	match method:
+		case 'shuffle':
+			path_returns = shuffle_paths(returns, paths, rng)
+
+		case 'bootstrap':
+			path_returns = bootstrap_paths(returns, paths, rng)
+
+		case 'block':
+			if close_prices is None or open_times is None:
+				raise ValueError('Block bootstrap requires close prices and open times!')
+
+			length = len(close_prices) - 1
+			if block_size is None:
+				block_size = max(1, round(length ** (1 / 3)))
+			if not isinstance(block_size, int) or isinstance(block_size, bool) or not 0 < block_size <= length:
+				raise ValueError(f'Invalid block_size {block_size}! (Expected 1 to {length})')
+
+			buy_bars, sell_bars = trade_bars(trades, open_times)
+			path_returns = block_bootstrap_paths(close_prices, buy_bars, sell_bars, paths, block_size, rng)
+
+	final_equity, max_drawdown, max_drawdown_percentage, time_to_ruin = _path_metrics(
+		capital, returns[np.newaxis], ruin_level
+	)
+	return {
+		'method': method,
+		'block_size': block_size if method == 'block' else None,
+		'ruin_level': ruin_level,
+		'original': {
+			'final_equity': float(final_equity[0]),
+			'max_drawdown': float(max_drawdown[0]),
+			'max_drawdown_percentage': float(max_drawdown_percentage[0]),
+			'time_to_ruin': int(time_to_ruin[0]) if time_to_ruin[0] >= 0 else None,
+		},
+		**analyse_paths(capital, path_returns, ruin_level),
+	}
@@ -0,0 +1,607 @@
+import itertools
+import math
+import os
+import threading
+from concurrent.futures import Executor
+from copy import deepcopy
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from core.calculations import (
+	BACKTEST_PARAMS,
+	IndicatorGraph,
+	analyse_strategy,
+	compile_strategy,
+	evaluate_program,
+	simulate_trades,
+)
+
+MAX_RUNS = 5000
+# Largest grid sampled by its flat index
+MAX_FLAT_GRID = np.iinfo(np.int64).max
+MAX_WINDOWS = 100
+METRICS = [
+	'total_profit',
+	'max_equity_run_up',
+	'max_drawdown',
+	'max_drawdown_percentage',
+	'equity_max_drawdown',
+	'equity_max_drawdown_percentage',
+	'sharpe_ratio',
+	'sortino_ratio',
+	'exposure_time',
+	'total_trades',
+	'winning_count',
+	'losing_count',
+	'profit_percent',
+	'percent_profitable',
+	'average_profit',
+	'average_winning_trade',
+	'average_losing_trade',
+	'ratio_average_win_loss',
+	'largest_winning_trade',
+	'largest_losing_trade',
+]
+COLUMNS = ['Open Time', *BACKTEST_PARAMS]
+
+# Worker side cache: OHLC and indicator graph of the shared memory block currently being optimised,
+# per thread as the workers may be threads of a single process
+_worker = threading.local()
+
+
+def is_parameter(value) -> bool:
+	return isinstance(value, dict) and ('values' in value or ('min' in value and 'max' in value))
+
+
+def parameter_values(spec: dict) -> list:
+	"""
+	Values of a parameter spec, either `{'values': [...]}` or `{'min': 5, 'max': 50, 'step': 5}`.
+	`step` defaults to 1, and the values are integers when `min`, `max` and `step` are all integers.
+	A parameter has at most `MAX_RUNS` values, counted before any is listed.
+	"""
+	if 'values' in spec:
+		values = list(spec['values'])
+		if len(values) == 0:
+			raise ValueError('Parameter without values!')
+		if len(values) > MAX_RUNS:
+			raise ValueError(f'Too many parameter values {len(values)}! (Expected <= {MAX_RUNS})')
+		return values
+
+	low = spec['min']
+	high = spec['max']
+	step = spec.get('step', 1)
+	try:
+		if high < low:
+			raise ValueError(f'Invalid parameter range {low} to {high}!')
+		if step <= 0:
+			raise ValueError(f'Invalid parameter step {step}! (Expected > 0)')
+	except TypeError:
+		raise ValueError(f'Invalid parameter range {low} to {high}, step {step}!')
+
+	is_integer = all(isinstance(value, int) and not isinstance(value, bool) for value in (low, high, step))
+	steps = (high - low) // step if is_integer else (high - low) / step + 1e-9
+	# Also false for an infinite or NaN number of steps
+	if not steps < MAX_RUNS:
+		raise ValueError(f'Too many values in parameter range {low} to {high}, step {step}! (Expected <= {MAX_RUNS})')
+
+	if is_integer:
+		return list(range(low, high + 1, step))
+	return [round(low + i * step, 10) for i in range(math.floor(steps) + 1)]
+
+
+def _find_parameters(strategy: list, path: tuple, found: list):
+	for i, exp in enumerate(strategy):
+		if not isinstance(exp, dict):
+			continue
+
+		value = exp.get('value')
+		match exp.get('type'):
+			case 'value':
+				if is_parameter(value):
+					found.append(((*path, i, 'value'), value, True))
+
+			case 'indicator':
+				params = value.get('params', {}) if isinstance(value, dict) else {}
+				for param, param_value in params.items():
+					if is_parameter(param_value):
+						found.append(((*path, i, 'value', 'params', param), param_value, False))
+
+			case 'math_func':
+				if isinstance(value, dict) and isinstance(value.get('value'), list):
+					_find_parameters(value['value'], (*path, i, 'value', 'value'), found)
+
+
+def find_parameters(buy_strategy: list, sell_strategy: list) -> dict[str, dict]:
+	"""
+	Parameters of a strategy template, by name.
+	A parameter is any `value` token value or indicator param given as a spec (see `parameter_values`),
+	named by its optional `name` key, or by its path such as `buy_strategy.0.timeperiod`.
+	Specs sharing a name are the same parameter, e.g. one RSI period for the buy and sell strategies.
+
+	Returns:
+		parameters:
+		`{name: {'values': [...], 'paths': [...], 'indicator': bool}}`,
+		with indicator parameters first so neighbouring runs share indicator results
+	"""
+	found = []
+	_find_parameters(buy_strategy, ('buy_strategy',), found)
+	_find_parameters(sell_strategy, ('sell_strategy',), found)
+
+	parameters = {}
+	for path, spec, is_value in found:
+		name = spec.get('name') or '.'.join(str(part) for part in path if part not in ('value', 'params'))
+		if name not in parameters:
+			parameters[name] = {'values': parameter_values(spec), 'paths': [], 'indicator': False}
+		parameters[name]['paths'].append(path)
+		parameters[name]['indicator'] |= not is_value
+
+	return dict(sorted(parameters.items(), key=lambda item: not item[1]['indicator']))
+
+
+def apply_parameters(buy_strategy: list, sell_strategy: list, parameters: dict[str, dict], values: dict):
+	"""Copy of the buy and sell strategies with every parameter replaced by its value"""
+	strategies = {'buy_strategy': deepcopy(buy_strategy), 'sell_strategy': deepcopy(sell_strategy)}
+	for name, parameter in parameters.items():
+		for path in parameter['paths']:
+			target = strategies
+			for part in path[:-1]:
+				target = target[part]
+			target[path[-1]] = values[name]
+
+	return strategies['buy_strategy'], strategies['sell_strategy']
+
+
+def parameter_sets(
+	parameters: dict[str, dict],
+	method: str = 'grid',
+	samples: int = 100,
+	seed: int | None = None,
+) -> list[dict]:
+	"""
+	Parameter values to run, in grid order so that runs sharing indicator parameters are next to each other.
+	`random` samples distinct points of the grid, and falls back to the full grid when it is not larger than `samples`.
+	"""
+	names = list(parameters.keys())
+	sizes = [len(parameters[name]['values']) for name in names]
+	total = math.prod(sizes)
+
+	if method == 'grid':
+		if total > MAX_RUNS:
+			raise ValueError(f'Too many parameter combinations {total}! (Expected <= {MAX_RUNS}, try "random")')
+		indexes = itertools.product(*[range(size) for size in sizes])
+	elif method == 'random':
+		if samples is None or samples <= 0 or samples > MAX_RUNS:
+			raise ValueError(f'Invalid samples {samples}! (Expected 1 to {MAX_RUNS})')
+		if total <= samples:
+			indexes = itertools.product(*[range(size) for size in sizes])
+		elif total <= MAX_FLAT_GRID:
+			rng = np.random.default_rng(seed)
+			flat = np.sort(rng.choice(total, samples, replace=False))
+			indexes = zip(*np.unravel_index(flat, sizes))
+		else:
+			# Too large to number as int64, points are drawn per parameter, rarely colliding in such a grid
+			rng = np.random.default_rng(seed)
+			points = set()
+			while len(points) < samples:
+				points.add(tuple(int(rng.integers(size)) for size in sizes))
+			indexes = sorted(points)
+	else:
+		raise ValueError(f'Invalid search method "{method}"!')
+
+	return [{name: parameters[name]['values'][int(index)] for name, index in zip(names, point)} for point in indexes]
+
+
+def share_ohlc(df: pd.DataFrame) -> SharedMemory:
+	"""Copy the OHLC columns into a shared memory block of `len(COLUMNS)` float64 rows"""
+	shared = SharedMemory(create=True, size=max(len(COLUMNS) * len(df) * 8, 1))
+	block = np.ndarray((len(COLUMNS), len(df)), dtype=np.float64, buffer=shared.buf)
+	block[0].view(np.int64)[:] = df['Open Time'].to_numpy(dtype=np.int64)
+	for i, column in enumerate(BACKTEST_PARAMS, 1):
+		block[i] = df[column].to_numpy(dtype=np.float64)
+	del block
+	return shared
+
+
+def _worker_graphs() -> dict[str, IndicatorGraph]:
+	if not hasattr(_worker, 'graphs'):
+		_worker.graphs = {}
+	return _worker.graphs
+
+
+def _attach_ohlc(name: str, length: int, timeframe: str) -> IndicatorGraph:
+	graphs = _worker_graphs()
+	if name not in graphs:
+		graphs.clear()
+
+		shared = SharedMemory(name=name)
+		try:
+			block = np.ndarray((len(COLUMNS), length), dtype=np.float64, buffer=shared.buf)
+			data = {'Open Time': block[0].view(np.int64).copy()}
+			data.update({column: block[i].copy() for i, column in enumerate(BACKTEST_PARAMS, 1)})
+			del block
+		finally:
+			shared.close()
+
+		graphs[name] = IndicatorGraph({timeframe: pd.DataFrame(data)}, timeframe)
+
+	return graphs[name]
+
+
+def _run(
+	graph: IndicatorGraph, buy_strategy: list, sell_strategy: list, settings: dict, windows: list[tuple[int, int]]
+):
+	"""Results of a strategy over each `(start, end)` bar window, slicing signals evaluated on the full series"""
+	buy_program = compile_strategy(buy_strategy)
+	sell_program = compile_strategy(sell_strategy)
+	graph.add(buy_program)
+	graph.add(sell_program)
+
+	df = graph.ohlc(graph.default_timeframe)
+	open_times = df['Open Time'].to_numpy()
+	close_data = df['Close'].to_numpy()
+	signals = []
+	for program, is_buy in ((buy_program, True), (sell_program, False)):
+		signal = np.atleast_1d(evaluate_program(program, graph, is_buy))
+		signals.append(signal.repeat(len(close_data)) if len(signal) == 1 else signal)
+	buy_signals, sell_signals = signals
+
+	results = []
+	for start, end in windows:
+		simulation = simulate_trades(
+			capital=settings['capital'],
+			open_times=open_times[start:end],
+			close_data=close_data[start:end],
+			buy_signals=buy_signals[start:end],
+			sell_signals=sell_signals[start:end],
+			unit_types=settings['unit_types'],
+			stop_loss=settings['stop_loss'],
+			take_profit=settings['take_profit'],
+			trade_limit=settings['trade_limit'],
+		)
+		report = analyse_strategy(
+			settings['capital'],
+			close_data[start:end],
+			simulation.holdings,
+			simulation.trade_types,
+			simulation.trades(),
+			periods_per_year=settings['periods_per_year'],
+		)
+		report.pop('trade_reports')
+
+		results.append(
+			{
+				'final_amount': simulation.result(-1),
+				'profit': float(simulation.holdings[-1]) - settings['capital'],
+				'buy_count': simulation.buy_count,
+				'sell_count': simulation.sell_count,
+				'stopped_by': simulation.stopped_by,
+				'performance_report': report,
+			}
+		)
+
+	return results
+
+
+def _run_chunk(
+	graph: IndicatorGraph,
+	buy_strategy: list,
+	sell_strategy: list,
+	parameters: dict[str, dict],
+	chunk: list[dict],
+	settings: dict,
+	windows: list[tuple[int, int]],
+):
+	results = []
+	for values in chunk:
+		buy, sell = apply_parameters(buy_strategy, sell_strategy, parameters, values)
+		try:
+			results.append({'parameters': values, 'windows': _run(graph, buy, sell, settings, windows)})
+		except ValueError as e:
+			results.append({'parameters': values, 'error': str(e)})
+	return results
+
+
+def _run_shared_chunk(name: str, length: int, timeframe: str, *args):
+	return _run_chunk(_attach_ohlc(name, length, timeframe), *args)
+
+
+def _map_runs(
+	executor: Executor | None,
+	shared: SharedMemory,
+	length: int,
+	timeframe: str,
+	buy_strategy: list,
+	sell_strategy: list,
+	parameters: dict[str, dict],
+	runs: list[dict],
+	settings: dict,
+	windows: list[tuple[int, int]],
+	progress: Callable[[float], None] | None = None,
+):
+	"""
+	Runs split into chunks over the executor, or run one chunk after another in this process without one,
+	leaving out runs failing validation
+	"""
+	workers = (getattr(executor, '_max_workers', os.cpu_count()) or 1) if executor is not None else 1
+	chunk_size = max(math.ceil(len(runs) / (workers * 4)), 1)
+	chunks = [runs[i : i + chunk_size] for i in range(0, len(runs), chunk_size)]
+	args = (shared.name, length, timeframe, buy_strategy, sell_strategy, parameters)
+	if executor is not None:
+		futures = [executor.submit(_run_shared_chunk, *args, chunk, settings, windows) for chunk in chunks]
+		chunk_results = (future.result() for future in futures)
+	else:
+		chunk_results = (_run_shared_chunk(*args, chunk, settings, windows) for chunk in chunks)
+
+	results = []
+	for i, chunk_result in enumerate(chunk_results, 1):
+		results.extend(result for result in chunk_result if 'error' not in result)
+		if progress is not None:
+			progress(i / len(chunks))
+	return results
+
+
+def _stage_progress(progress: Callable[[float], None] | None, start: float, share: float):
+	"""`progress` of a stage starting at `start` and taking `share` of the whole"""
+	if progress is None:
+		return None
+	return lambda done: progress(start + done * share)
+
+
+def rank_results(results: list[dict], metric: str, minimize: bool = False) -> list[dict]:
+	"""Results sorted by `result['performance_report'][metric]`, with `None` last"""
+
+	def sort_key(result: dict):
+		value = result['performance_report'][metric]
+		if value is None:
+			return (True, 0)
+		return (False, value if minimize else -value)
+
+	return sorted(results, key=sort_key)
+
+
+def _prepare(buy_strategy: list, sell_strategy: list, metric: str, method: str, samples: int, seed: int | None):
+	if metric not in METRICS:
+		raise ValueError(f'Invalid metric "{metric}"!')
+
+	parameters = find_parameters(buy_strategy, sell_strategy)
+	if len(parameters) == 0:
+		raise ValueError('No parameter to optimise!')
+
+	runs = parameter_sets(parameters, method, samples, seed)
+	for strategy in apply_parameters(buy_strategy, sell_strategy, parameters, runs[0]):
+		compile_strategy(strategy)
+
+	return parameters, runs
+
+
+def optimize_strategy(
+	df: pd.DataFrame,
+	buy_strategy: list,
+	sell_strategy: list,
+	capital: float = 10000,
+	stop_loss: float = None,
+	take_profit: float = None,
+	trade_limit: int = 100,
+	unit_types: tuple[str, str] = ('', ''),
+	metric: str = 'total_profit',
+	minimize: bool = False,
+	method: str = 'grid',
+	samples: int = 100,
+	top_k: int = 10,
+	seed: int | None = None,
+	timeframe: str = '1h',
+	periods_per_year: int = 365 * 24,
+	executor: Executor | None = None,
+	progress: Callable[[float], None] | None = None,
+):
+	"""
+	Runs a strategy template over its parameter sets and ranks the results by a metric of `analyse_strategy`.
+	Runs are split into chunks over `executor`, e.g. the pool of `BACKTEST_EXECUTOR`, with the OHLC data in shared
+	memory, and each worker keeps the indicators it computed for the next chunks. Without an executor the chunks run
+	in this process, e.g. a job worker.
+	Runs with `None` for the metric are ranked last, and runs failing validation are left out.
+	`progress` is called with the fraction of the runs done as chunks complete.
+
+	Returns:
+		results:
+		`{'parameters': {...}, 'runs': int, 'results': [top_k results]}`
+	"""
+	parameters, runs = _prepare(buy_strategy, sell_strategy, metric, method, samples, seed)
+	settings = {
+		'capital': capital,
+		'stop_loss': stop_loss,
+		'take_profit': take_profit,
+		'trade_limit': trade_limit,
+		'unit_types': list(unit_types),
+		'periods_per_year': periods_per_year,
+	}
+
+	shared = share_ohlc(df)
+	try:
+		results = _map_runs(
+			executor,
+			shared,
+			len(df),
+			timeframe,
+			buy_strategy,
+			sell_strategy,
+			parameters,
+			runs,
+			settings,
+			[(0, len(df))],
+			progress,
+		)
+	finally:
+		shared.close()
+		shared.unlink()
+		_worker_graphs().pop(shared.name, None)
+
+	results = [{'parameters': result['parameters'], **result['windows'][0]} for result in results]
+	results = rank_results(results, metric, minimize)[:top_k]
+	for result in results:
+		result['metric'] = result['performance_report'][metric]
+
+	return {
+		'parameters': {name: parameter['values'] for name, parameter in parameters.items()},
+		'runs': len(runs),
+		'results': results,
+	}
+
+
+def walk_forward_windows(length: int, in_sample: int, out_of_sample: int, step: int | None = None, anchored=False):
+	"""
+	Rolling `((in sample start, end), (out of sample start, end))` bar windows, where each out of sample window
+	directly follows its in sample window. Windows move by `step` bars (default `out_of_sample`),
+	and anchored in sample windows all start at the first bar.
+	"""
+	step = step if step is not None else out_of_sample
+	for name, value in (('in_sample', in_sample), ('out_of_sample', out_of_sample), ('step', step)):
+		if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+			raise ValueError(f'Invalid {name} {value}! (Expected a number of bars > 0)')
+
+	windows = []
+	start = 0
+	while start + in_sample + out_of_sample <= length:
+		in_sample_end = start + in_sample
+		windows.append(((0 if anchored else start, in_sample_end), (in_sample_end, in_sample_end + out_of_sample)))
+		start += step
+
+	if len(windows) == 0:
+		raise ValueError(f'Not enough data for one window! ({in_sample + out_of_sample} bars needed, {length} given)')
+	if len(windows) > MAX_WINDOWS:
+		raise ValueError(f'Too many windows {len(windows)}! (Expected <= {MAX_WINDOWS})')
+
+	return windows
+
+
+def walk_forward(
+	df: pd.DataFrame,
+	buy_strategy: list,
+	sell_strategy: list,
+	in_sample: int,
+	out_of_sample: int,
+	step: int | None = None,
+	anchored: bool = False,
+	capital: float = 10000,
+	stop_loss: float = None,
+	take_profit: float = None,
+	trade_limit: int = 100,
+	unit_types: tuple[str, str] = ('', ''),
+	metric: str = 'total_profit',
+	minimize: bool = False,
+	method: str = 'grid',
+	samples: int = 100,
+	seed: int | None = None,
+	timeframe: str = '1h',
+	periods_per_year: int = 365 * 24,
+	executor: Executor | None = None,
+	progress: Callable[[float], None] | None = None,
+):
+	"""
+	Walk-forward analysis: picks the best parameter set of each in sample window by `metric`,
+	then runs it on the following out of sample window.
+	Signals are evaluated once per parameter set on the full series and sliced per window, so each worker
+	simulates every in sample window of its chunk of runs from the same indicators.
+	The best parameter sets are then run on their out of sample windows.
+	`progress` is called with the fraction of the runs done, the in sample runs counting for most of it.
+
+	Returns:
+		results:
+		`{'parameters': {...}, 'runs': int, 'windows': [...], 'summary': {...}}`
+	"""
+	parameters, runs = _prepare(buy_strategy, sell_strategy, metric, method, samples, seed)
+	windows = walk_forward_windows(len(df), in_sample, out_of_sample, step, anchored)
+	settings = {
+		'capital': capital,
+		'stop_loss': stop_loss,
+		'take_profit': take_profit,
+		'trade_limit': trade_limit,
+		'unit_types': list(unit_types),
+		'periods_per_year': periods_per_year,
+	}
+	open_times = df['Open Time'].to_numpy()
+
+	shared = share_ohlc(df)
+	try:
+		args = (executor, shared, len(df), timeframe, buy_strategy, sell_strategy, parameters)
+		# The out of sample stage runs one parameter set per window at most
+		in_sample_share = len(runs) / (len(runs) + len(windows))
+		in_sample_progress = _stage_progress(progress, 0, in_sample_share)
+		in_sample_results = _map_runs(*args, runs, settings, [window for window, _ in windows], in_sample_progress)
+
+		best = []
+		for i in range(len(windows)):
+			ranked = rank_results(
+				[{'parameters': result['parameters'], **result['windows'][i]} for result in in_sample_results],
+				metric,
+				minimize,
+			)
+			best.append(ranked[0] if len(ranked) > 0 else None)
+
+		best_runs = []
+		for result in best:
+			if result is not None and result['parameters'] not in best_runs:
+				best_runs.append(result['parameters'])
+		out_of_sample_progress = _stage_progress(progress, in_sample_share, 1 - in_sample_share)
+		out_of_sample_results = _map_runs(
+			*args, best_runs, settings, [window for _, window in windows], out_of_sample_progress
+		)
+	finally:
+		shared.close()
+		shared.unlink()
+		_worker_graphs().pop(shared.name, None)
+
+	results = []
+	for i, ((in_sample_start, in_sample_end), (out_of_sample_start, out_of_sample_end)) in enumerate(windows):
+		window = {
+			'in_sample': {
+				'start_time': int(open_times[in_sample_start]),
+				'end_time': int(open_times[in_sample_end - 1]),
+				'bars': in_sample_end - in_sample_start,
+			},
+			'out_of_sample': {
+				'start_time': int(open_times[out_of_sample_start]),
+				'end_time': int(open_times[out_of_sample_end - 1]),
+				'bars': out_of_sample_end - out_of_sample_start,
+			},
+			'parameters': None,
+			'in_sample_metric': None,
+			'out_of_sample_metric': None,
+			'out_of_sample_result': None,
+		}
+		if best[i] is not None:
+			result = next(result for result in out_of_sample_results if result['parameters'] == best[i]['parameters'])
+			window['parameters'] = best[i]['parameters']
+			window['in_sample_metric'] = best[i]['performance_report'][metric]
+			window['out_of_sample_metric'] = result['windows'][i]['performance_report'][metric]
+			window['out_of_sample_result'] = result['windows'][i]
+		results.append(window)
+
+	in_sample_metrics = [window['in_sample_metric'] for window in results if window['in_sample_metric'] is not None]
+	out_of_sample_metrics = [
+		window['out_of_sample_metric'] for window in results if window['out_of_sample_metric'] is not None
+	]
+	average_in_sample = float(np.mean(in_sample_metrics)) if len(in_sample_metrics) > 0 else None
+	average_out_of_sample = float(np.mean(out_of_sample_metrics)) if len(out_of_sample_metrics) > 0 else None
+
+	return {
+		'parameters': {name: parameter['values'] for name, parameter in parameters.items()},
+		'runs': len(runs),
+		'windows': results,
+		'summary': {
+			'out_of_sample_profit': float(
+				sum(window['out_of_sample_result']['profit'] for window in results if window['parameters'] is not None)
+			),
+			'average_in_sample_metric': average_in_sample,
+			'average_out_of_sample_metric': average_out_of_sample,
+			# Walk-forward efficiency: out of sample performance relative to in sample performance
+			'efficiency': (
+				average_out_of_sample / average_in_sample
+				if average_in_sample not in (None, 0) and average_out_of_sample is not None
+				else None
+			),
+		},
+	}
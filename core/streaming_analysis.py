@@ -0,0 +1,752 @@
+import math
+from collections import deque
+
+import pandas as pd
+
+NAN = float('nan')
+
+
+def _is_zero(value: float):
+	"""Same threshold as TA-Lib's `TA_IS_ZERO`"""
+	return -1e-8 < value < 1e-8
+
+
+class _State:
+	"""Building block of a streaming indicator, serialised through `to_dict` / `load`"""
+
+	deques = ()
+
+	def to_dict(self) -> dict:
+		return {key: list(value) if key in self.deques else value for key, value in vars(self).items()}
+
+	def load(self, state: dict):
+		for key, value in state.items():
+			setattr(self, key, deque(tuple(item) for item in value) if key in self.deques else value)
+
+
+class _Window(_State):
+	"""Last `period` values in a ring buffer, with the running sum of the last `period - 1` values like TA-Lib"""
+
+	def __init__(self, period: int):
+		self.period = period
+		self.values = [0.0] * period
+		self.position = 0
+		self.count = 0
+		self.total = 0.0
+		self.squares = 0.0
+
+	@property
+	def full(self):
+		return self.count >= self.period
+
+	def oldest(self):
+		"""Value leaving the window on the next push, once full"""
+		return self.values[self.position]
+
+	def push(self, value: float):
+		self.values[self.position] = value
+		self.position = (self.position + 1) % self.period
+		self.count += 1
+
+	def mean(self, value: float) -> float:
+		"""Push `value` and return the mean of the window, NaN until it is full"""
+		self.total += value
+		self.push(value)
+		if not self.full:
+			return NAN
+
+		mean = self.total / self.period
+		self.total -= self.oldest()
+		return mean
+
+	def moments(self, value: float) -> tuple[float, float]:
+		"""Push `value` and return the mean and mean of squares of the window, NaN until it is full"""
+		self.total += value
+		self.squares += value * value
+		self.push(value)
+		if not self.full:
+			return NAN, NAN
+
+		mean = self.total / self.period
+		mean_squares = self.squares / self.period
+		oldest = self.oldest()
+		self.total -= oldest
+		self.squares -= oldest * oldest
+		return mean, mean_squares
+
+
+class _Delay(_State):
+	"""Value pushed `shift` updates ago"""
+
+	def __init__(self, shift: int):
+		self.shift = shift
+		self.values = [NAN] * shift
+		self.position = 0
+
+	def push(self, value: float) -> float:
+		if self.shift == 0:
+			return value
+
+		delayed = self.values[self.position]
+		self.values[self.position] = value
+		self.position = (self.position + 1) % self.shift
+		return delayed
+
+
+class _Ema(_State):
+	"""TA-Lib EMA, seeded with the SMA of the first `period` values after skipping `skip` values"""
+
+	def __init__(self, period: int, skip: int = 0):
+		self.period = period
+		self.k = 2 / (period + 1)
+		self.skip = skip
+		self.count = 0
+		self.total = 0.0
+		self.value = NAN
+
+	def update(self, value: float) -> float:
+		self.count += 1
+		if self.count <= self.skip:
+			return NAN
+
+		if self.count - self.skip < self.period:
+			self.total += value
+		elif self.count - self.skip == self.period:
+			self.value = (self.total + value) / self.period
+		else:
+			self.value = (value - self.value) * self.k + self.value
+		return self.value
+
+
+class _Extreme(_State):
+	"""Highest or lowest value of the last `period` values with its update index, as a monotonic deque"""
+
+	deques = ('candidates',)
+
+	def __init__(self, period: int, highest: bool):
+		self.period = period
+		self.highest = highest
+		self.index = -1
+		self.candidates = deque()
+
+	def update(self, value: float) -> tuple[float, int]:
+		"""Push `value` and return the extreme and its index, the latest one on ties like TA-Lib"""
+		self.index += 1
+		candidates = self.candidates
+		if self.highest:
+			while candidates and candidates[-1][1] <= value:
+				candidates.pop()
+		else:
+			while candidates and candidates[-1][1] >= value:
+				candidates.pop()
+		candidates.append((self.index, value))
+		if candidates[0][0] <= self.index - self.period:
+			candidates.popleft()
+		return candidates[0][1], candidates[0][0]
+
+	@property
+	def full(self):
+		return self.index + 1 >= self.period
+
+
+def _true_range(high: float, low: float, previous_close: float):
+	return max(high - low, abs(high - previous_close), abs(low - previous_close))
+
+
+class StreamingIndicator:
+	"""
+	Indicator updated in O(1) per appended candle, matching the output of `TechnicalAnalysis` at the last bar.
+
+	All state is held in attributes which are numbers, `_State` objects or other streaming indicators,
+	so the state of any indicator is serialised with `to_dict` and restored with `from_dict`.
+	Candles are dicts with the `Open`, `High`, `Low`, `Close` and `Volume` keys.
+	"""
+
+	name = ''
+
+	def __init__(self, **params):
+		self.params = params
+		self.value = NAN
+
+	def update(self, candle: dict) -> float:
+		self.value = self._update(candle)
+		return self.value
+
+	def _update(self, candle: dict) -> float:
+		raise NotImplementedError
+
+	def to_dict(self) -> dict:
+		state = {
+			key: value.to_dict() if isinstance(value, (_State, StreamingIndicator)) else value
+			for key, value in vars(self).items()
+			if key != 'params'
+		}
+		return {'indicator': self.name, 'params': self.params, 'state': state}
+
+	@classmethod
+	def from_dict(cls, data: dict):
+		indicator = cls(**data['params'])
+		for key, value in data['state'].items():
+			current = getattr(indicator, key, None)
+			if isinstance(current, _State):
+				current.load(value)
+			elif isinstance(current, StreamingIndicator):
+				setattr(indicator, key, type(current).from_dict(value))
+			else:
+				setattr(indicator, key, value)
+		return indicator
+
+
+def _check_periods(**periods):
+	for name, period in periods.items():
+		if not isinstance(period, int) or isinstance(period, bool) or period < 1:
+			raise ValueError(f'Invalid {name} {period}! (Expected an integer >= 1)')
+
+
+def _check_shift(shift: int):
+	if not isinstance(shift, int) or isinstance(shift, bool) or shift < 0:
+		raise ValueError(f'Invalid shift {shift}! (Expected an integer >= 0)')
+
+
+class SMA(StreamingIndicator):
+	name = 'sma'
+
+	def __init__(self, source='Close', timeperiod=30):
+		super().__init__(source=source, timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.window = _Window(timeperiod)
+
+	def _update(self, candle: dict):
+		return self.window.mean(candle[self.params['source']])
+
+
+class EMA(StreamingIndicator):
+	name = 'ema'
+
+	def __init__(self, source='Close', timeperiod=30):
+		super().__init__(source=source, timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.ema = _Ema(timeperiod)
+
+	def _update(self, candle: dict):
+		return self.ema.update(candle[self.params['source']])
+
+
+class _MACD(StreamingIndicator):
+	"""TA-Lib MACD: the fast EMA is seeded on the last `fastperiod` values of the slow EMA seed"""
+
+	output = 0
+
+	def __init__(self, source='Close', fastperiod=12, slowperiod=26, signalperiod=9):
+		super().__init__(source=source, fastperiod=fastperiod, slowperiod=slowperiod, signalperiod=signalperiod)
+		_check_periods(fastperiod=fastperiod, slowperiod=slowperiod, signalperiod=signalperiod)
+		if slowperiod < fastperiod:
+			fastperiod, slowperiod = slowperiod, fastperiod
+		self.fast = _Ema(fastperiod, skip=slowperiod - fastperiod)
+		self.slow = _Ema(slowperiod)
+		self.signal = _Ema(signalperiod)
+
+	def _update(self, candle: dict):
+		value = candle[self.params['source']]
+		fast = self.fast.update(value)
+		slow = self.slow.update(value)
+		if math.isnan(slow):
+			return NAN
+
+		macd = fast - slow
+		signal = self.signal.update(macd)
+		if math.isnan(signal):
+			return NAN
+		return (macd, signal)[self.output]
+
+
+class MACD(_MACD):
+	name = 'macd'
+
+
+class MACDSignal(_MACD):
+	name = 'macdsignal'
+	output = 1
+
+
+class RSI(StreamingIndicator):
+	"""Wilder smoothing of gains and losses, seeded with their mean over the first `timeperiod` changes"""
+
+	name = 'rsi'
+
+	def __init__(self, source='Close', timeperiod=14):
+		super().__init__(source=source, timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.count = 0
+		self.previous = NAN
+		self.gain = 0.0
+		self.loss = 0.0
+
+	def _update(self, candle: dict):
+		value = candle[self.params['source']]
+		period = self.params['timeperiod']
+		self.count += 1
+		previous = self.previous
+		self.previous = value
+		if self.count == 1:
+			return NAN
+
+		change = value - previous
+		gain = change if change > 0 else 0.0
+		loss = -change if change < 0 else 0.0
+		if self.count <= period:
+			self.gain += gain
+			self.loss += loss
+			return NAN
+
+		if self.count == period + 1:
+			self.gain = (self.gain + gain) / period
+			self.loss = (self.loss + loss) / period
+		else:
+			self.gain = (self.gain * (period - 1) + gain) / period
+			self.loss = (self.loss * (period - 1) + loss) / period
+
+		total = self.gain + self.loss
+		return 100 * (self.gain / total) if not _is_zero(total) else 0.0
+
+
+class ATR(StreamingIndicator):
+	"""Wilder smoothing of the true range, seeded with its mean over the first `timeperiod` bars after the first"""
+
+	name = 'atr'
+
+	def __init__(self, timeperiod=14, shift=0):
+		super().__init__(timeperiod=timeperiod, shift=shift)
+		_check_periods(timeperiod=timeperiod)
+		_check_shift(shift)
+		self.count = 0
+		self.previous_close = NAN
+		self.atr = 0.0
+		self.delay = _Delay(shift)
+
+	def _update(self, candle: dict):
+		return self.delay.push(self._atr(candle))
+
+	def _atr(self, candle: dict):
+		period = self.params['timeperiod']
+		self.count += 1
+		previous_close = self.previous_close
+		self.previous_close = candle['Close']
+		if self.count == 1:
+			return NAN
+
+		true_range = _true_range(candle['High'], candle['Low'], previous_close)
+		if self.count <= period:
+			self.atr += true_range
+			return NAN
+
+		if self.count == period + 1:
+			self.atr = (self.atr + true_range) / period
+		else:
+			self.atr = (self.atr * (period - 1) + true_range) / period
+		return self.atr
+
+
+class ADX(StreamingIndicator):
+	"""
+	TA-Lib ADX: directional movements and true range summed over the first `timeperiod - 1` changes,
+	then Wilder smoothed, with the ADX seeded by the mean of the first `timeperiod` DX values
+	"""
+
+	name = 'adx'
+
+	def __init__(self, timeperiod=14):
+		super().__init__(timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.count = 0
+		self.previous_high = NAN
+		self.previous_low = NAN
+		self.previous_close = NAN
+		self.plus_dm = 0.0
+		self.minus_dm = 0.0
+		self.true_range = 0.0
+		self.adx = 0.0
+
+	def _update(self, candle: dict):
+		period = self.params['timeperiod']
+		high = candle['High']
+		low = candle['Low']
+		self.count += 1
+		previous_high, previous_low, previous_close = self.previous_high, self.previous_low, self.previous_close
+		self.previous_high, self.previous_low, self.previous_close = high, low, candle['Close']
+		if self.count == 1:
+			return NAN
+
+		plus_dm = high - previous_high
+		minus_dm = previous_low - low
+		if minus_dm > 0 and plus_dm < minus_dm:
+			plus_dm = 0.0
+		elif plus_dm > 0 and plus_dm > minus_dm:
+			minus_dm = 0.0
+		else:
+			plus_dm = minus_dm = 0.0
+		true_range = _true_range(high, low, previous_close)
+
+		if self.count <= period:
+			self.plus_dm += plus_dm
+			self.minus_dm += minus_dm
+			self.true_range += true_range
+			return NAN
+
+		self.plus_dm = self.plus_dm - self.plus_dm / period + plus_dm
+		self.minus_dm = self.minus_dm - self.minus_dm / period + minus_dm
+		self.true_range = self.true_range - self.true_range / period + true_range
+
+		dx = None
+		if not _is_zero(self.true_range):
+			minus_di = 100 * (self.minus_dm / self.true_range)
+			plus_di = 100 * (self.plus_dm / self.true_range)
+			total = minus_di + plus_di
+			if not _is_zero(total):
+				dx = 100 * (abs(minus_di - plus_di) / total)
+
+		if self.count <= period * 2:
+			self.adx += dx or 0.0
+			if self.count < period * 2:
+				return NAN
+			self.adx /= period
+		elif dx is not None:
+			self.adx = (self.adx * (period - 1) + dx) / period
+		return self.adx
+
+
+class _Stoch(StreamingIndicator):
+	"""TA-Lib STOCH with SMA smoothing, both outputs start once the slow D is defined"""
+
+	output = 0
+
+	def __init__(self, fastk_period=5, slowk_period=3, slowd_period=3):
+		super().__init__(fastk_period=fastk_period, slowk_period=slowk_period, slowd_period=slowd_period)
+		_check_periods(fastk_period=fastk_period, slowk_period=slowk_period, slowd_period=slowd_period)
+		self.highest = _Extreme(fastk_period, highest=True)
+		self.lowest = _Extreme(fastk_period, highest=False)
+		self.slowk = _Window(slowk_period)
+		self.slowd = _Window(slowd_period)
+
+	def _update(self, candle: dict):
+		highest = self.highest.update(candle['High'])[0]
+		lowest = self.lowest.update(candle['Low'])[0]
+		if not self.highest.full:
+			return NAN
+
+		diff = (highest - lowest) / 100
+		fastk = (candle['Close'] - lowest) / diff if diff != 0 else 0.0
+		slowk = self.slowk.mean(fastk)
+		if math.isnan(slowk):
+			return NAN
+
+		slowd = self.slowd.mean(slowk)
+		if math.isnan(slowd):
+			return NAN
+		return (slowk, slowd)[self.output]
+
+
+class StochSlowK(_Stoch):
+	name = 'stoch_slowk'
+
+
+class StochSlowD(_Stoch):
+	name = 'stoch_slowd'
+	output = 1
+
+
+class _BBands(StreamingIndicator):
+	"""TA-Lib BBANDS with an SMA middle band and the population standard deviation"""
+
+	output = 0
+
+	def __init__(self, source='Close', timeperiod=20, nbdevup=2, nbdevdn=2):
+		super().__init__(source=source, timeperiod=timeperiod, nbdevup=nbdevup, nbdevdn=nbdevdn)
+		_check_periods(timeperiod=timeperiod)
+		self.window = _Window(timeperiod)
+
+	def _update(self, candle: dict):
+		mean, mean_squares = self.window.moments(candle[self.params['source']])
+		if math.isnan(mean):
+			return NAN
+
+		variance = mean_squares - mean * mean
+		deviation = math.sqrt(variance) if variance > 0 and not _is_zero(variance) else 0.0
+		if self.output == 0:
+			return mean + deviation * self.params['nbdevup']
+		return mean - deviation * self.params['nbdevdn']
+
+
+class BBandsUpper(_BBands):
+	name = 'bbands_upper'
+
+
+class BBandsLower(_BBands):
+	name = 'bbands_lower'
+	output = 1
+
+
+class OBV(StreamingIndicator):
+	name = 'obv'
+
+	def __init__(self, shift=0):
+		super().__init__(shift=shift)
+		_check_shift(shift)
+		self.previous_close = NAN
+		self.obv = NAN
+		self.delay = _Delay(shift)
+
+	def _update(self, candle: dict):
+		close = candle['Close']
+		volume = candle['Volume']
+		if math.isnan(self.obv):
+			self.obv = volume
+		elif close > self.previous_close:
+			self.obv += volume
+		elif close < self.previous_close:
+			self.obv -= volume
+		self.previous_close = close
+		return self.delay.push(self.obv)
+
+
+class MOM(StreamingIndicator):
+	name = 'mom'
+
+	def __init__(self, source='Close', timeperiod=10):
+		super().__init__(source=source, timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.delay = _Delay(timeperiod)
+
+	def _update(self, candle: dict):
+		value = candle[self.params['source']]
+		return value - self.delay.push(value)
+
+
+class WILLR(StreamingIndicator):
+	name = 'willr'
+
+	def __init__(self, timeperiod=14):
+		super().__init__(timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.highest = _Extreme(timeperiod, highest=True)
+		self.lowest = _Extreme(timeperiod, highest=False)
+
+	def _update(self, candle: dict):
+		highest = self.highest.update(candle['High'])[0]
+		lowest = self.lowest.update(candle['Low'])[0]
+		if not self.highest.full:
+			return NAN
+
+		diff = (highest - lowest) / -100
+		return (highest - candle['Close']) / diff if diff != 0 else 0.0
+
+
+class _Aroon(StreamingIndicator):
+	"""
+	TA-Lib AROON over the last `timeperiod + 1` bars, the latest extreme wins on ties.
+	`TechnicalAnalysis._aroon` unpacks TA-Lib's `(aroondown, aroonup)` as `(aroon_up, aroon_down)`,
+	which is kept so that live values match backtests.
+	"""
+
+	output = 0
+
+	def __init__(self, timeperiod=14):
+		super().__init__(timeperiod=timeperiod)
+		_check_periods(timeperiod=timeperiod)
+		self.highest = _Extreme(timeperiod + 1, highest=True)
+		self.lowest = _Extreme(timeperiod + 1, highest=False)
+
+	def _update(self, candle: dict):
+		period = self.params['timeperiod']
+		highest_index = self.highest.update(candle['High'])[1]
+		lowest_index = self.lowest.update(candle['Low'])[1]
+		if not self.highest.full:
+			return NAN
+
+		factor = 100 / period
+		index = self.highest.index
+		match self.output:
+			case 0:
+				return factor * (period - (index - lowest_index))
+			case 1:
+				return factor * (period - (index - highest_index))
+			case _:
+				return factor * (highest_index - lowest_index)
+
+
+class AroonUp(_Aroon):
+	name = 'aroon_up'
+
+
+class AroonDown(_Aroon):
+	name = 'aroon_down'
+	output = 1
+
+
+class AroonOsc(_Aroon):
+	name = 'aroonosc'
+	output = 2
+
+
+class _Midpoint(StreamingIndicator):
+	"""Mean of the highest high and lowest low of the last `period` bars, shifted by `shift` bars"""
+
+	period = 20
+	shift = 0
+
+	def __init__(self):
+		super().__init__()
+		self.highest = _Extreme(self.period, highest=True)
+		self.lowest = _Extreme(self.period, highest=False)
+		self.delay = _Delay(self.shift)
+
+	def _midpoint(self, candle: dict):
+		highest = self.highest.update(candle['High'])[0]
+		lowest = self.lowest.update(candle['Low'])[0]
+		return (highest + lowest) / 2 if self.highest.full else NAN
+
+	def _update(self, candle: dict):
+		return self.delay.push(self._midpoint(candle))
+
+
+class DonchianUpper(StreamingIndicator):
+	name = 'donchian_upper'
+
+	def __init__(self):
+		super().__init__()
+		self.highest = _Extreme(20, highest=True)
+
+	def _update(self, candle: dict):
+		highest = self.highest.update(candle['High'])[0]
+		return highest if self.highest.full else NAN
+
+
+class DonchianLower(StreamingIndicator):
+	name = 'donchian_lower'
+
+	def __init__(self):
+		super().__init__()
+		self.lowest = _Extreme(20, highest=False)
+
+	def _update(self, candle: dict):
+		lowest = self.lowest.update(candle['Low'])[0]
+		return lowest if self.lowest.full else NAN
+
+
+class TenkanSen(_Midpoint):
+	name = 'tenkan_sen'
+	period = 9
+
+
+class KijunSen(_Midpoint):
+	name = 'kijun_sen'
+	period = 26
+
+
+class SenkouSpanA(StreamingIndicator):
+	name = 'senkou_span_a'
+
+	def __init__(self):
+		super().__init__()
+		self.tenkan_sen = TenkanSen()
+		self.kijun_sen = KijunSen()
+		self.delay = _Delay(26)
+
+	def _update(self, candle: dict):
+		span = (self.tenkan_sen.update(candle) + self.kijun_sen.update(candle)) / 2
+		return self.delay.push(span)
+
+
+class SenkouSpanB(_Midpoint):
+	name = 'senkou_span_b'
+	period = 52
+	shift = 26
+
+
+class StreamingAnalysis:
+	"""Set of streaming indicators fed with the same candles
+
+	Attributes:
+		`indicators`:
+			Streaming indicator classes by `TechnicalAnalysis` name. E.g.
+			`{'rsi': RSI, 'macd': MACD}`
+	"""
+
+	indicators: dict[str, type[StreamingIndicator]] = {
+		indicator.name: indicator
+		for indicator in (
+			SMA,
+			EMA,
+			MACD,
+			MACDSignal,
+			RSI,
+			ATR,
+			ADX,
+			StochSlowK,
+			StochSlowD,
+			BBandsUpper,
+			BBandsLower,
+			OBV,
+			MOM,
+			WILLR,
+			AroonUp,
+			AroonDown,
+			AroonOsc,
+			DonchianUpper,
+			DonchianLower,
+			TenkanSen,
+			KijunSen,
+			SenkouSpanA,
+			SenkouSpanB,
+		)
+	}
+
+	def __init__(self, indicators: list[tuple[str, dict]] | None = None):
+		self.__indicators: dict[str, StreamingIndicator] = {}
+		for indicator_name, params in indicators or []:
+			self.add(indicator_name, params)
+
+	@staticmethod
+	def key(indicator_name: str, params: dict | None = None) -> str:
+		"""E.g. `'rsi'` or `'rsi:source=Close,timeperiod=7'`"""
+		if not params:
+			return indicator_name
+		return f'{indicator_name}:' + ','.join(f'{param}={value}' for param, value in sorted(params.items()))
+
+	def add(self, indicator_name: str, params: dict | None = None) -> str:
+		"""Add an indicator, returning its key in `values`"""
+		if indicator_name not in self.indicators:
+			raise ValueError(f'Streaming is not supported for "{indicator_name}"!')
+
+		key = self.key(indicator_name, params)
+		if key not in self.__indicators:
+			try:
+				self.__indicators[key] = self.indicators[indicator_name](**(params or {}))
+			except TypeError as e:
+				raise ValueError(f'Invalid params for "{indicator_name}"! ({e})')
+		return key
+
+	def update(self, candle: dict) -> dict[str, float]:
+		"""Append one candle and return the latest value of every indicator"""
+		return {key: indicator.update(candle) for key, indicator in self.__indicators.items()}
+
+	def run(self, df: pd.DataFrame) -> dict[str, float]:
+		"""Append every candle of `df`, e.g. to warm up the indicators from history"""
+		values = self.values
+		for candle in df.to_dict('records'):
+			values = self.update(candle)
+		return values
+
+	@property
+	def values(self) -> dict[str, float]:
+		return {key: indicator.value for key, indicator in self.__indicators.items()}
+
+	def to_dict(self) -> dict:
+		return {key: indicator.to_dict() for key, indicator in self.__indicators.items()}
+
+	@classmethod
+	def from_dict(cls, data: dict):
+		analysis = cls()
+		for key, indicator in data.items():
+			analysis.__indicators[key] = cls.indicators[indicator['indicator']].from_dict(indicator)
+		return analysis
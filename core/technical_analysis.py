@@ -13,9 +13,32 @@ class TechnicalAnalysis:
 		`options`:
 			All technical analysis options. E.g.
 			`{'sma': {'name': 'SMA - Simple Moving Average', 'params': {'timeperiod': 30 }}}`
+		`outputs`:
+			Indicators that are one output of a multi-output function, as `(function name, output index)`. E.g.
+			`{'macd': ('_macd', 0), 'macdsignal': ('_macd', 1)}`
 	"""
 
 	options = {}
+	outputs = {
+		'macd': ('_macd', 0),
+		'macdsignal': ('_macd', 1),
+		'aroon_up': ('_aroon', 0),
+		'aroon_down': ('_aroon', 1),
+		'stoch_slowk': ('_stoch', 0),
+		'stoch_slowd': ('_stoch', 1),
+		'bbands_upper': ('_bbands', 0),
+		'bbands_lower': ('_bbands', 1),
+		'macdext': ('_macdext', 0),
+		'macdext_signal': ('_macdext', 1),
+		'macdfix': ('_macdfix', 0),
+		'macdfix_signal': ('_macdfix', 1),
+		'stochf_fastk': ('_stochf', 0),
+		'stochf_fastd': ('_stochf', 1),
+		'stochrsi_fastk': ('_stochrsi', 0),
+		'stochrsi_fastd': ('_stochrsi', 1),
+		'mama_fast': ('_mama', 0),
+		'mama_slow': ('_mama', 1),
+	}
 
 	def __init__(self):
 		members = inspect.getmembers(self, predicate=inspect.ismethod)
@@ -1,27 +1,55 @@
+import asyncio
 import inspect
 import json
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from unittest.mock import patch
 
 import numpy as np
 import pandas as pd
 from django.conf import settings
 from django.test import SimpleTestCase
 
-from core import old_mvp_backtest
+from core import calculations, instrumentation, old_mvp_backtest
 from core.calculations import (
+	IndicatorGraph,
 	analyse_strategy,
 	arrange_expressions,
 	calculate_amount,
 	combine_ohlc,
+	compile_strategy,
 	evaluate_expression,
 	evaluate_expressions,
 	evaluate_math_func,
+	evaluate_program,
 	evaluate_values,
+	resample_ohlc,
+	simulate_trades,
+	strategy_key,
 	validate_indicator,
 	validate_indicators,
 	validate_strategy,
 )
+from core.exceptions import ExecutorSaturatedException
+from core.execution import BacktestExecutor, program_timeframes, run_backtest, run_batch, run_monte_carlo
+from core.instrumentation import STAGE_SECONDS, Histogram, stage_timer, timed
+from core.monte_carlo import MAX_CELLS, analyse_paths, block_bootstrap_paths, monte_carlo, trade_bars, trade_returns
+from core.optimization import (
+	MAX_RUNS,
+	apply_parameters,
+	find_parameters,
+	optimize_strategy,
+	parameter_sets,
+	parameter_values,
+	walk_forward,
+	walk_forward_windows,
+)
+from core.streaming_analysis import StreamingAnalysis
 from core.technical_analysis import TechnicalAnalysis, TechnicalAnalysisTemplate
+from machd.metrics import server_timing
 
 CORE_DIR = settings.BASE_DIR / 'core'
 ORACLE_DIR = CORE_DIR / 'oracles'
@@ -1682,6 +1710,229 @@ class TestEvaluation(SimpleTestCase):
 			text = file.read()
 		self.assertEqual(text, json.dumps(trade_results, indent=2, default=str))
 
+	def test_simulate_trades(self):
+		capital = 10000
+		open_times = self.ohlc_data['Open Time'].to_numpy()
+		close_data = self.ohlc_data['Close'].to_numpy().copy()
+		close_data[5:8] = np.nan
+		buy_signals = np.array(([0] * 5) + ([1] * 5) + ([0] * (self.MAX_LENGTH - 10)))
+		sell_signals = np.array(([0] * 20) + ([1] * 10) + ([0] * (self.MAX_LENGTH - 30)))
+		unit_types = ['GBP', 'BTC']
+		simulation = simulate_trades(capital, open_times, close_data, buy_signals, sell_signals, unit_types)
+		trade_results = calculate_amount(capital, open_times, close_data, buy_signals, sell_signals, unit_types)
+
+		# Buy is delayed until the first bar with a close price
+		self.assertEqual(simulation.trade_bars.tolist(), [8, 20])
+		self.assertEqual(simulation.buy_count, 1)
+		self.assertEqual(simulation.sell_count, 1)
+		self.assertEqual(simulation.result(-1), trade_results['results'][-1])
+		self.assertEqual(simulation.results(), trade_results['results'])
+		self.assertEqual(simulation.trades(), trade_results['trades'])
+		self.assertEqual(simulation.holdings.tolist(), trade_results['holdings'])
+		self.assertEqual(simulation.trade_type_names(), trade_results['trade_types'])
+		self.assertIsNone(simulation.stopped_by)
+
+	def test_simulate_trades_trade_limit(self):
+		capital = 10000
+		open_times = self.ohlc_data['Open Time'].to_numpy()
+		close_data = self.ohlc_data['Close'].to_numpy()
+		buy_signals = np.array([1, 0] * (self.MAX_LENGTH // 2) + [0] * (self.MAX_LENGTH % 2))
+		sell_signals = 1 - buy_signals
+		unit_types = ['GBP', 'BTC']
+
+		simulation = simulate_trades(
+			capital, open_times, close_data, buy_signals, sell_signals, unit_types, trade_limit=3
+		)
+		self.assertEqual(simulation.trade_bars.tolist(), [0, 1, 2, 3, 4, 5])
+		self.assertEqual(simulation.stopped_by, 'trade limit hit')
+
+		simulation = simulate_trades(
+			capital, open_times, close_data, buy_signals, sell_signals, unit_types, trade_limit=0
+		)
+		self.assertEqual(simulation.trade_bars.tolist(), [0, self.MAX_LENGTH - 1])
+		self.assertEqual(simulation.trade_types[-1], calculations.SELL)
+		self.assertEqual(simulation.stopped_by, 'trade limit hit')
+
+
+class TestStrategyProgram(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+		cls.strategy = [
+			{'type': 'value', 'value': 60},
+			{'type': 'operator', 'value': '+'},
+			{'type': 'ohlc', 'value': 'close'},
+			{'type': 'operator', 'value': '-'},
+			{'type': 'ohlc', 'value': 'open'},
+			{'type': 'operator', 'value': '*'},
+			{'type': 'ohlc', 'value': 'high'},
+			{'type': 'operator', 'value': '/'},
+			{'type': 'ohlc', 'value': 'low'},
+			{'type': 'operator', 'value': '>'},
+			{'type': 'operator', 'value': '('},
+			{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'macd', 'params': {'fastperiod': 2}}},
+			{'type': 'operator', 'value': '*'},
+			{
+				'type': 'math_func',
+				'value': {
+					'type': 'max',
+					'value': [
+						{'type': 'ohlc', 'value': 'close'},
+						{'type': 'operator', 'value': '+'},
+						{'type': 'value', 'value': 30},
+					],
+				},
+			},
+			{'type': 'operator', 'value': ')'},
+			{'type': 'operator', 'value': 'or'},
+			{'type': 'template', 'timeframe': '4h', 'value': 'macd'},
+		]
+
+	def test_strategy_key(self):
+		reordered = [{key: exp[key] for key in reversed(exp)} for exp in self.strategy]
+		self.assertEqual(strategy_key(self.strategy), strategy_key(reordered))
+		self.assertNotEqual(strategy_key(self.strategy), strategy_key(self.strategy[:-2]))
+
+	def test_compile_strategy_cache(self):
+		program = compile_strategy(self.strategy)
+		self.assertIs(program, compile_strategy(json.loads(json.dumps(self.strategy))))
+		self.assertEqual(program.key, strategy_key(self.strategy))
+
+		# Compiling must not normalise the submitted strategy
+		strategy = [{'type': 'value', 'value': '5'}, {'type': 'operator', 'value': '>'}, {'type': 'value', 'value': 4}]
+		compile_strategy(strategy)
+		self.assertEqual(strategy[0]['value'], '5')
+
+	def test_compile_strategy_invalid(self):
+		strategy = [{'type': 'value', 'value': 5}, {'type': 'operator', 'value': '>'}]
+		try:
+			compile_strategy(strategy)
+			self.assertTrue(False)
+		except ValueError as e:
+			self.assertEqual(str(e), 'Invalid expression, trailing operator encountered!')
+
+	def test_evaluate_program(self):
+		strategies = [
+			self.strategy,
+			[{'type': 'value', 'value': 5}, {'type': 'operator', 'value': '^'}, {'type': 'value', 'value': 4}],
+			[
+				{'type': 'value', 'value': 2},
+				{'type': 'operator', 'value': '*'},
+				{'type': 'operator', 'value': '('},
+				{'type': 'ohlc', 'value': 'close'},
+				{'type': 'operator', 'value': '-'},
+				{'type': 'indicator', 'timeframe': '4h', 'value': {'indicator_name': 'rsi'}},
+				{'type': 'operator', 'value': ')'},
+				{'type': 'operator', 'value': '>='},
+				{'type': 'math_func', 'value': {'type': 'min', 'value': [{'type': 'ohlc', 'value': 'low'}]}},
+				{'type': 'operator', 'value': 'and'},
+				{'type': 'template', 'timeframe': '1d', 'value': 'rsi_70_30'},
+			],
+		]
+
+		# `combine_ohlc` used by `evaluate_values` only matches on contiguous hourly candles starting on a UTC day
+		df = self.ohlc_data.copy()
+		df['Open Time'] = df['Open Time'][0] + np.arange(len(df)) * 3600000
+		for strategy in strategies:
+			program = compile_strategy(strategy)
+			for is_buy in [True, False]:
+				expected = evaluate_expressions(evaluate_values({'1h': df}, strategy, is_buy))
+				result = evaluate_program(program, {'1h': df}, is_buy)
+				self.assertTrue(np.array_equal(result, expected))
+
+	def test_resample_ohlc(self):
+		df = self.ohlc_data.copy()
+		df['Open Time'] = df['Open Time'][0] + np.arange(len(df)) * 3600000
+		for timeframe in ['2h', '4h', '1d']:
+			resampled, index = resample_ohlc(df, timeframe)
+			interval = int(settings.INTERVAL_MAP[timeframe] / 60)
+			expected = combine_ohlc(df, interval)
+			pd.testing.assert_frame_equal(resampled, expected)
+			self.assertTrue(np.array_equal(index, np.arange(len(df)) // interval))
+
+		# A gap, and a series starting mid-day
+		df = pd.DataFrame(
+			{
+				'Open Time': np.array([20, 21, 22, 23, 24, 25, 50, 51]) * 3600000,
+				'Open': [1.0, 2, 3, 4, 5, 6, 7, 8],
+				'High': [2.0, 3, 9, 5, 6, 7, 8, 9],
+				'Low': [0.5, 1, 2, 3, 4, 5, 1, 7],
+				'Close': [2.0, 3, 4, 5, 6, 7, 8, 9],
+				'Volume': [1.0, 1, 1, 1, 1, 1, 1, 1],
+			}
+		)
+		resampled, index = resample_ohlc(df, '1d')
+		self.assertEqual(resampled['Open Time'].tolist(), [0, 86400000, 172800000])
+		self.assertEqual(resampled['Open'].tolist(), [1, 5, 7])
+		self.assertEqual(resampled['High'].tolist(), [9, 7, 9])
+		self.assertEqual(resampled['Low'].tolist(), [0.5, 4, 1])
+		self.assertEqual(resampled['Close'].tolist(), [5, 7, 9])
+		self.assertEqual(resampled['Volume'].tolist(), [4, 2, 2])
+		self.assertEqual(index.tolist(), [0, 0, 0, 0, 1, 1, 2, 2])
+
+		graph = IndicatorGraph(df)
+		self.assertTrue(np.array_equal(graph.value(('ohlc', 'Close'), True), df['Close']))
+		self.assertTrue(graph.ohlc('1d').equals(resampled))
+		self.assertTrue(np.array_equal(graph.index('1d'), index))
+
+		# Data given for a timeframe is matched by open time
+		graph = IndicatorGraph({'1h': df, '1d': resampled})
+		self.assertTrue(np.array_equal(graph.index('1d'), index))
+
+		self.assertRaises(ValueError, resample_ohlc, resampled, '1h', '1d')
+
+	def test_indicator_graph_outputs(self):
+		TA = TechnicalAnalysis()
+		graph = IndicatorGraph({'1h': self.ohlc_data})
+		for indicator_name in TA.outputs:
+			expected = np.nan_to_num(np.array(getattr(TA, indicator_name)(self.ohlc_data)))
+			self.assertTrue(np.array_equal(graph.indicator('1h', indicator_name), expected))
+
+	def test_indicator_graph_shared(self):
+		buy_program = compile_strategy(
+			[
+				{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'macd'}},
+				{'type': 'operator', 'value': '>'},
+				{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'macdsignal'}},
+				{'type': 'operator', 'value': 'and'},
+				{'type': 'template', 'timeframe': '1h', 'value': 'bbands'},
+			]
+		)
+		sell_program = compile_strategy(
+			[
+				{
+					'type': 'indicator',
+					'timeframe': '1h',
+					'value': {'indicator_name': 'macd', 'params': {'signalperiod': 9}},
+				},
+				{'type': 'operator', 'value': '<'},
+				{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'macdsignal'}},
+				{'type': 'operator', 'value': 'or'},
+				{'type': 'template', 'timeframe': '1h', 'value': 'bbands'},
+			]
+		)
+
+		TA = calculations.TA
+		TA_TEMPLATES = calculations.TA_TEMPLATES
+		with (
+			patch.object(TA, '_macd', wraps=TA._macd) as macd,
+			patch.object(TA_TEMPLATES, 'bbands', wraps=TA_TEMPLATES.bbands) as bbands,
+			patch.dict(TA_TEMPLATES.templates['bbands'], {'function': bbands}),
+		):
+			graph = IndicatorGraph({'1h': self.ohlc_data})
+			graph.add(buy_program)
+			graph.add(sell_program)
+			buy_result = evaluate_program(buy_program, graph, True)
+			sell_result = evaluate_program(sell_program, graph, False)
+			self.assertEqual(macd.call_count, 1)
+			self.assertEqual(bbands.call_count, 1)
+
+		self.assertTrue(np.array_equal(buy_result, evaluate_program(buy_program, {'1h': self.ohlc_data}, True)))
+		self.assertTrue(np.array_equal(sell_result, evaluate_program(sell_program, {'1h': self.ohlc_data}, False)))
+
 
 class TestAnalysis(SimpleTestCase):
 	@classmethod
@@ -1797,3 +2048,629 @@ class TestAnalysis(SimpleTestCase):
 		with open(ref_file) as file:
 			text = file.read()
 		self.assertEqual(text, json.dumps(report, indent=2, default=str))
+
+	def test_analysis_report_trade_codes(self):
+		capital = 10000
+		open_times = self.ohlc_data['Open Time'].to_numpy()
+		close_data = self.ohlc_data['Close'].to_numpy()
+		unit_types = ['GBP', 'BTC']
+		buy_signals = np.array([1, 0, 0, 0] * (self.MAX_LENGTH // 4) + [0] * (self.MAX_LENGTH % 4))
+		sell_signals = np.roll(buy_signals, 2)
+
+		simulation = simulate_trades(
+			capital, open_times, close_data, buy_signals, sell_signals, unit_types, trade_limit=None
+		)
+		trades = simulation.trades()
+		report = analyse_strategy(capital, close_data, simulation.holdings, simulation.trade_types, trades)
+		expected = analyse_strategy(
+			capital,
+			close_data,
+			simulation.holdings.tolist(),
+			simulation.trade_type_names(),
+			trades,
+		)
+
+		self.assertEqual(json.dumps(report, default=str), json.dumps(expected, default=str))
+		self.assertEqual(report['total_trades'], simulation.sell_count)
+		self.assertAlmostEqual(report['exposure_time'], 0.5, places=2)
+		self.assertLessEqual(report['equity_max_drawdown'], 0)
+
+
+class TestOptimization(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+		period = {'min': 10, 'max': 30, 'step': 10, 'name': 'period'}
+		cls.buy_strategy = [
+			{
+				'type': 'indicator',
+				'timeframe': '1h',
+				'value': {'indicator_name': 'rsi', 'params': {'timeperiod': period}},
+			},
+			{'type': 'operator', 'value': '<'},
+			{'type': 'value', 'value': {'min': 20, 'max': 40, 'step': 10}},
+		]
+		cls.sell_strategy = [
+			{
+				'type': 'indicator',
+				'timeframe': '1h',
+				'value': {'indicator_name': 'rsi', 'params': {'timeperiod': period}},
+			},
+			{'type': 'operator', 'value': '>'},
+			{
+				'type': 'math_func',
+				'value': {'type': 'max', 'value': [{'type': 'value', 'value': {'values': [60, 70]}}]},
+			},
+		]
+
+	def test_parameter_values(self):
+		self.assertEqual(parameter_values({'min': 5, 'max': 20, 'step': 5}), [5, 10, 15, 20])
+		self.assertEqual(parameter_values({'min': 0.1, 'max': 0.3, 'step': 0.1}), [0.1, 0.2, 0.3])
+		self.assertEqual(parameter_values({'values': ['Open', 'Close']}), ['Open', 'Close'])
+		self.assertRaises(ValueError, parameter_values, {'min': 5, 'max': 1})
+		self.assertRaises(ValueError, parameter_values, {'min': 1, 'max': 5, 'step': 0})
+		self.assertRaises(ValueError, parameter_values, {'values': []})
+		# Too many values are refused before any is listed, as a 400 of the optimisation views
+		self.assertRaises(ValueError, parameter_values, {'min': 0, 'max': 10**10})
+		self.assertRaises(ValueError, parameter_values, {'min': 0, 'max': 1e12, 'step': 0.5})
+		self.assertRaises(ValueError, parameter_values, {'min': 0, 'max': 1e308, 'step': 1e-308})
+		self.assertEqual(len(parameter_values({'min': 1, 'max': MAX_RUNS})), MAX_RUNS)
+
+	def test_find_parameters(self):
+		parameters = find_parameters(self.buy_strategy, self.sell_strategy)
+		self.assertEqual(list(parameters.keys()), ['period', 'buy_strategy.2', 'sell_strategy.2.0'])
+		self.assertEqual(len(parameters['period']['paths']), 2)
+		self.assertTrue(parameters['period']['indicator'])
+		self.assertFalse(parameters['buy_strategy.2']['indicator'])
+
+		buy_strategy, sell_strategy = apply_parameters(
+			self.buy_strategy,
+			self.sell_strategy,
+			parameters,
+			{'period': 20, 'buy_strategy.2': 30, 'sell_strategy.2.0': 70},
+		)
+		self.assertEqual(buy_strategy[0]['value']['params']['timeperiod'], 20)
+		self.assertEqual(buy_strategy[2]['value'], 30)
+		self.assertEqual(sell_strategy[0]['value']['params']['timeperiod'], 20)
+		self.assertEqual(sell_strategy[2]['value']['value'][0]['value'], 70)
+		self.assertIsInstance(self.buy_strategy[2]['value'], dict)
+
+	def test_parameter_sets(self):
+		parameters = find_parameters(self.buy_strategy, self.sell_strategy)
+		grid = parameter_sets(parameters)
+		self.assertEqual(len(grid), 18)
+		self.assertEqual(grid[0], {'period': 10, 'buy_strategy.2': 20, 'sell_strategy.2.0': 60})
+
+		samples = parameter_sets(parameters, 'random', 5, seed=1)
+		self.assertEqual(len(samples), 5)
+		self.assertEqual(samples, parameter_sets(parameters, 'random', 5, seed=1))
+		self.assertEqual(len({tuple(sample.values()) for sample in samples}), 5)
+		self.assertTrue(all(sample in grid for sample in samples))
+		self.assertEqual(parameter_sets(parameters, 'random', 50), grid)
+		self.assertRaises(ValueError, parameter_sets, parameters, 'annealing')
+
+		# Sampling a grid too large to number as int64
+		parameters = {f'p{i}': {'values': list(range(MAX_RUNS))} for i in range(6)}
+		samples = parameter_sets(parameters, 'random', 10, seed=1)
+		self.assertEqual(len({tuple(sample.values()) for sample in samples}), 10)
+		self.assertEqual(samples, parameter_sets(parameters, 'random', 10, seed=1))
+
+	def test_optimize_strategy(self):
+		progress = []
+		with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn')) as executor:
+			result = optimize_strategy(
+				self.ohlc_data,
+				self.buy_strategy,
+				self.sell_strategy,
+				metric='sharpe_ratio',
+				top_k=3,
+				executor=executor,
+				progress=progress.append,
+			)
+
+		self.assertEqual(progress, sorted(progress))
+		self.assertEqual(progress[-1], 1)
+		self.assertEqual(result['runs'], 18)
+		self.assertEqual(len(result['results']), 3)
+		metrics = [run['metric'] for run in result['results']]
+		self.assertEqual(metrics, sorted(metrics, reverse=True))
+
+		best = result['results'][0]
+		buy_strategy, sell_strategy = apply_parameters(
+			self.buy_strategy,
+			self.sell_strategy,
+			find_parameters(self.buy_strategy, self.sell_strategy),
+			best['parameters'],
+		)
+		close_data = self.ohlc_data['Close'].to_numpy()
+		simulation = simulate_trades(
+			10000,
+			self.ohlc_data['Open Time'].to_numpy(),
+			close_data,
+			evaluate_program(compile_strategy(buy_strategy), self.ohlc_data, True),
+			evaluate_program(compile_strategy(sell_strategy), self.ohlc_data, False),
+			['', ''],
+			trade_limit=100,
+		)
+		report = analyse_strategy(10000, close_data, simulation.holdings, simulation.trade_types, simulation.trades())
+		self.assertEqual(best['metric'], report['sharpe_ratio'])
+		self.assertEqual(best['final_amount'], simulation.result(-1))
+
+		# Without an executor the runs are in this process, as in a job worker
+		in_process = optimize_strategy(
+			self.ohlc_data, self.buy_strategy, self.sell_strategy, metric='sharpe_ratio', top_k=3
+		)
+		self.assertEqual(in_process, result)
+
+		with self.assertRaises(ValueError):
+			optimize_strategy(self.ohlc_data, self.buy_strategy, self.sell_strategy, metric='trade_reports')
+		with self.assertRaises(ValueError):
+			optimize_strategy(self.ohlc_data, [], [])
+
+	def test_walk_forward_windows(self):
+		self.assertEqual(walk_forward_windows(10, 4, 2), [((0, 4), (4, 6)), ((2, 6), (6, 8)), ((4, 8), (8, 10))])
+		self.assertEqual(walk_forward_windows(10, 4, 3, anchored=True), [((0, 4), (4, 7)), ((0, 7), (7, 10))])
+		self.assertEqual(walk_forward_windows(10, 4, 2, step=3), [((0, 4), (4, 6)), ((3, 7), (7, 9))])
+		self.assertRaises(ValueError, walk_forward_windows, 10, 8, 3)
+		self.assertRaises(ValueError, walk_forward_windows, 10, 0, 3)
+
+	def test_walk_forward(self):
+		length = len(self.ohlc_data)
+		in_sample = length // 3
+		out_of_sample = length // 6
+		progress = []
+		with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn')) as executor:
+			result = walk_forward(
+				self.ohlc_data,
+				self.buy_strategy,
+				self.sell_strategy,
+				in_sample,
+				out_of_sample,
+				trade_limit=None,
+				executor=executor,
+				progress=progress.append,
+			)
+
+		self.assertEqual(progress, sorted(progress))
+		self.assertAlmostEqual(progress[-1], 1)
+		windows = walk_forward_windows(length, in_sample, out_of_sample)
+		self.assertEqual(len(result['windows']), len(windows))
+
+		parameters = find_parameters(self.buy_strategy, self.sell_strategy)
+		open_times = self.ohlc_data['Open Time'].to_numpy()
+		close_data = self.ohlc_data['Close'].to_numpy()
+
+		def run(values: dict, window: tuple[int, int]):
+			buy_strategy, sell_strategy = apply_parameters(self.buy_strategy, self.sell_strategy, parameters, values)
+			start, end = window
+			simulation = simulate_trades(
+				10000,
+				open_times[start:end],
+				close_data[start:end],
+				evaluate_program(compile_strategy(buy_strategy), self.ohlc_data, True)[start:end],
+				evaluate_program(compile_strategy(sell_strategy), self.ohlc_data, False)[start:end],
+				['', ''],
+				trade_limit=None,
+			)
+			return float(simulation.holdings[-1]) - 10000
+
+		for window, (in_sample_window, out_of_sample_window) in zip(result['windows'], windows):
+			best_profit = max(run(values, in_sample_window) for values in parameter_sets(parameters))
+			self.assertEqual(window['in_sample_metric'], best_profit)
+			self.assertEqual(window['out_of_sample_result']['profit'], run(window['parameters'], out_of_sample_window))
+			self.assertEqual(window['out_of_sample']['start_time'], int(open_times[out_of_sample_window[0]]))
+
+		self.assertAlmostEqual(
+			result['summary']['out_of_sample_profit'],
+			sum(window['out_of_sample_result']['profit'] for window in result['windows']),
+		)
+
+
+class TestMonteCarlo(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.open_times = df['Open Time'].to_numpy()
+		cls.close_data = df['Close'].to_numpy()
+		buy_strategy = compile_strategy(
+			[
+				{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+				{'type': 'operator', 'value': '<'},
+				{'type': 'value', 'value': 30},
+			]
+		)
+		sell_strategy = compile_strategy(
+			[
+				{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+				{'type': 'operator', 'value': '>'},
+				{'type': 'value', 'value': 70},
+			]
+		)
+		cls.trades = calculate_amount(
+			10000,
+			cls.open_times,
+			cls.close_data,
+			evaluate_program(buy_strategy, df, True),
+			evaluate_program(sell_strategy, df, False),
+			['GBP', 'BTC'],
+			trade_limit=None,
+		)['trades']
+
+	def test_trade_returns(self):
+		returns = trade_returns(self.trades)
+		self.assertEqual(len(returns), len(self.trades) // 2)
+		self.assertAlmostEqual(float(np.prod(returns)) * 10000, self.trades[-1]['to_amount'])
+
+		buy_bars, sell_bars = trade_bars(self.trades, self.open_times)
+		np.testing.assert_allclose(returns, self.close_data[sell_bars] / self.close_data[buy_bars])
+
+	def test_analyse_paths(self):
+		returns = np.array([[1.1, 0.5, 1.2], [0.9, 0.9, 2.0]])
+		result = analyse_paths(100, returns, ruin_level=0.6)
+		self.assertEqual(result['paths'], 2)
+		self.assertEqual(result['trades'], 3)
+		self.assertAlmostEqual(result['final_equity']['min'], 66)
+		self.assertAlmostEqual(result['final_equity']['max'], 162)
+		self.assertAlmostEqual(result['max_drawdown']['max'], 55)
+		self.assertAlmostEqual(result['max_drawdown_percentage']['min'], 19)
+		self.assertEqual(result['time_to_ruin']['mean'], 2)
+		self.assertEqual(result['probability_of_ruin'], 0.5)
+		self.assertEqual(result['probability_of_profit'], 0.5)
+
+	def test_monte_carlo(self):
+		original = trade_returns(self.trades)
+		shuffled = monte_carlo(10000, self.trades, 'shuffle', paths=200, seed=1)
+		self.assertEqual(shuffled['paths'], 200)
+		self.assertAlmostEqual(shuffled['final_equity']['std'], 0, places=6)
+		self.assertAlmostEqual(shuffled['final_equity']['mean'], shuffled['original']['final_equity'])
+		self.assertGreaterEqual(shuffled['max_drawdown']['max'], shuffled['original']['max_drawdown'])
+
+		bootstrap = monte_carlo(10000, self.trades, 'bootstrap', paths=200, seed=1)
+		self.assertEqual(bootstrap, monte_carlo(10000, self.trades, 'bootstrap', paths=200, seed=1))
+		self.assertGreater(bootstrap['final_equity']['std'], 0)
+		self.assertGreaterEqual(bootstrap['final_equity']['min'], 10000 * original.min() ** len(original))
+
+		block = monte_carlo(
+			10000, self.trades, 'block', paths=200, seed=1, close_prices=self.close_data, open_times=self.open_times
+		)
+		self.assertEqual(block['block_size'], round((len(self.close_data) - 1) ** (1 / 3)))
+		self.assertEqual(block['trades'], len(original))
+
+		self.assertRaises(ValueError, monte_carlo, 10000, self.trades, 'block', paths=10)
+		self.assertRaises(ValueError, monte_carlo, 10000, self.trades, 'x')
+		self.assertRaises(ValueError, monte_carlo, 10000, self.trades, paths=0)
+		round_trips = self.trades[: len(original) * 2] * 20
+		with self.assertRaisesRegex(ValueError, 'paths x trades'):
+			monte_carlo(10000, round_trips, paths=MAX_CELLS // (len(original) * 20) + 1)
+		self.assertRaises(ValueError, monte_carlo, 10000, self.trades, ruin_level=1)
+		self.assertRaises(ValueError, monte_carlo, 10000, [])
+
+	def test_block_bootstrap_paths(self):
+		# A single block covering the whole series replays the original trades
+		buy_bars, sell_bars = trade_bars(self.trades, self.open_times)
+		rng = np.random.default_rng(0)
+		returns = block_bootstrap_paths(self.close_data, buy_bars, sell_bars, 3, len(self.close_data) - 1, rng)
+		self.assertEqual(returns.shape, (3, len(buy_bars)))
+		np.testing.assert_allclose(returns, np.broadcast_to(trade_returns(self.trades), returns.shape))
+
+		# Bar by bar construction of the same price paths
+		block_size = 7
+		rng = np.random.default_rng(2)
+		returns = block_bootstrap_paths(self.close_data, buy_bars, sell_bars, 2, block_size, rng)
+		increments = np.diff(np.log(self.close_data))
+		block_count = len(increments) // block_size + 1
+		starts = np.random.default_rng(2).integers(0, len(increments) - block_size + 1, size=(2, block_count))
+		for path, path_starts in enumerate(starts):
+			path_increments = np.concatenate([increments[start : start + block_size] for start in path_starts])
+			log_prices = np.concatenate(([0], np.cumsum(path_increments)))
+			np.testing.assert_allclose(returns[path], np.exp(log_prices[sell_bars] - log_prices[buy_bars]))
+
+
+class TestStreamingAnalysis(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+		cls.TA = TechnicalAnalysis()
+
+	def test_streaming_indicators(self):
+		indicators = [(indicator_name, {}) for indicator_name in StreamingAnalysis.indicators] + [
+			('ema', {'source': 'High', 'timeperiod': 2}),
+			('macd', {'fastperiod': 26, 'slowperiod': 12, 'signalperiod': 5}),
+			('rsi', {'timeperiod': 7}),
+			('atr', {'timeperiod': 1, 'shift': 3}),
+			('adx', {'timeperiod': 2}),
+			('stoch_slowd', {'fastk_period': 14, 'slowk_period': 1, 'slowd_period': 5}),
+			('bbands_lower', {'timeperiod': 5, 'nbdevdn': 1.5}),
+			('obv', {'shift': 2}),
+			('aroonosc', {'timeperiod': 25}),
+		]
+		analysis = StreamingAnalysis(indicators)
+		candles = self.ohlc_data.to_dict('records')
+		half = len(candles) // 2
+		analysis.run(self.ohlc_data.iloc[:half])
+
+		# Restored state carries on from the same values
+		analysis = StreamingAnalysis.from_dict(json.loads(json.dumps(analysis.to_dict())))
+		values = {key: [] for key in analysis.values}
+		for candle in candles[half:]:
+			for key, value in analysis.update(candle).items():
+				values[key].append(value)
+
+		for indicator_name, params in indicators:
+			expected = np.asarray(getattr(self.TA, indicator_name)(self.ohlc_data, **params), dtype=np.float64)[half:]
+			np.testing.assert_allclose(
+				values[StreamingAnalysis.key(indicator_name, params)],
+				expected,
+				rtol=1e-9,
+				err_msg=indicator_name,
+			)
+
+	def test_streaming_warm_up(self):
+		analysis = StreamingAnalysis([('rsi', {}), ('senkou_span_b', {})])
+		values = analysis.run(self.ohlc_data.iloc[:20])
+		self.assertEqual(list(values), ['rsi', 'senkou_span_b'])
+		self.assertAlmostEqual(values['rsi'], self.TA.rsi(self.ohlc_data.iloc[:20]).iloc[-1])
+		self.assertTrue(np.isnan(values['senkou_span_b']))
+		self.assertEqual(analysis.add('rsi', {}), 'rsi')
+		self.assertEqual(analysis.add('rsi', {'timeperiod': 7}), 'rsi:timeperiod=7')
+
+		self.assertRaises(ValueError, analysis.add, 'cdl2crows')
+		self.assertRaises(ValueError, analysis.add, 'rsi', {'timeperiod': 0})
+		self.assertRaises(ValueError, analysis.add, 'rsi', {'period': 7})
+		self.assertRaises(ValueError, analysis.add, 'obv', {'shift': -1})
+
+
+class TestExecution(SimpleTestCase):
+	@classmethod
+	def setUpClass(cls):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		cls.ohlc_data = df
+
+		cls.buy_strategy = [
+			{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+			{'type': 'operator', 'value': '<'},
+			{'type': 'value', 'value': 30},
+			{'type': 'operator', 'value': 'and'},
+			{'type': 'template', 'timeframe': '4h', 'value': 'macd'},
+		]
+		cls.sell_strategy = [
+			{'type': 'indicator', 'timeframe': '1d', 'value': {'indicator_name': 'rsi'}},
+			{'type': 'operator', 'value': '>'},
+			{'type': 'value', 'value': 70},
+		]
+		cls.options = {
+			'capital': 10000,
+			'unit_types': ['GBP', 'BTC'],
+			'stop_loss': None,
+			'take_profit': None,
+			'trade_limit': 100,
+			'periods_per_year': 8760,
+		}
+
+	def test_program_timeframes(self):
+		self.assertEqual(program_timeframes(compile_strategy(self.buy_strategy)), {'1h', '4h'})
+		self.assertEqual(program_timeframes(compile_strategy(self.sell_strategy)), {'1d'})
+
+	def test_run_backtest(self):
+		result = run_backtest({'1h': self.ohlc_data}, '1h', self.buy_strategy, self.sell_strategy, self.options)
+
+		graph = IndicatorGraph({'1h': self.ohlc_data}, '1h')
+		buy_program = compile_strategy(self.buy_strategy)
+		sell_program = compile_strategy(self.sell_strategy)
+		graph.add(buy_program)
+		graph.add(sell_program)
+		simulation = simulate_trades(
+			capital=10000,
+			open_times=self.ohlc_data['Open Time'].to_numpy(),
+			close_data=self.ohlc_data['Close'].to_numpy(),
+			buy_signals=evaluate_program(buy_program, graph, True),
+			sell_signals=evaluate_program(sell_program, graph, False),
+			unit_types=['GBP', 'BTC'],
+			trade_limit=100,
+		)
+		self.assertEqual(result['final_amount'], simulation.result(-1))
+		self.assertEqual(result['trade_events'], simulation.trades())
+
+		# Resampled timeframes given by the caller give the same result
+		frames = {'1h': self.ohlc_data, '1d': resample_ohlc(self.ohlc_data, '1d', '1h').ohlc}
+		resampled = run_backtest(frames, '1h', self.buy_strategy, self.sell_strategy, self.options)
+		self.assertEqual(resampled['final_amount'], result['final_amount'])
+
+		with BacktestExecutor(max_workers=1) as executor:
+			future = executor.submit(run_backtest, frames, '1h', self.buy_strategy, self.sell_strategy, self.options)
+			self.assertEqual(future.result(timeout=120)['performance_report'], result['performance_report'])
+
+	def test_run_batch(self):
+		variants = [
+			{
+				'name': name,
+				'capital_amount': 10000,
+				'take_profit': None,
+				'stop_loss': stop_loss,
+				'trade_limit': 100,
+				'buy_program': compile_strategy(self.buy_strategy),
+				'sell_program': compile_strategy(self.sell_strategy),
+			}
+			for name, stop_loss in [('a', None), ('b', 9000)]
+		]
+		progress = []
+		results = run_batch({'1h': self.ohlc_data}, '1h', variants, ['GBP', 'BTC'], 8760, progress=progress.append)
+		self.assertEqual([result['name'] for result in results], ['a', 'b'])
+		self.assertEqual(progress, [0.5, 1])
+
+		# Same as backtesting each variant on its own
+		for variant, result in zip(variants, results):
+			options = self.options | {'stop_loss': variant['stop_loss']}
+			backtest = run_backtest({'1h': self.ohlc_data}, '1h', self.buy_strategy, self.sell_strategy, options)
+			self.assertEqual(result['final_amount'], backtest['final_amount'])
+			self.assertEqual(result['stopped_by'], backtest['stopped_by'])
+			report = {key: value for key, value in backtest['performance_report'].items() if key != 'trade_reports'}
+			self.assertEqual(result['performance_report'], report)
+
+	def test_run_monte_carlo(self):
+		buy_program = compile_strategy(self.buy_strategy)
+		sell_program = compile_strategy(self.sell_strategy)
+		options = {'method': 'shuffle', 'paths': 100, 'ruin_level': 0.5, 'block_size': None, 'seed': 1}
+		result = run_monte_carlo({'1h': self.ohlc_data}, '1h', buy_program, sell_program, self.options, options)
+
+		backtest = run_backtest({'1h': self.ohlc_data}, '1h', self.buy_strategy, self.sell_strategy, self.options)
+		self.assertEqual(result['final_amount'], backtest['final_amount'])
+		expected = monte_carlo(10000, backtest['trade_events'], method='shuffle', paths=100, seed=1)
+		self.assertEqual(result['original'], expected['original'])
+		self.assertEqual(result['probability_of_ruin'], expected['probability_of_ruin'])
+
+		with BacktestExecutor(max_workers=0) as executor:
+			future = executor.submit(
+				run_monte_carlo, {'1h': self.ohlc_data}, '1h', buy_program, sell_program, self.options, options
+			)
+			self.assertEqual(future.result(timeout=60)['final_amount'], result['final_amount'])
+
+		self.assertRaises(
+			ValueError,
+			run_monte_carlo,
+			{'1h': self.ohlc_data},
+			'1h',
+			buy_program,
+			sell_program,
+			self.options,
+			options | {'method': 'x'},
+		)
+
+	def test_backtest_executor_saturated(self):
+		release = threading.Event()
+		with BacktestExecutor(max_workers=0, max_pending=2) as executor:
+			futures = [executor.submit(release.wait, 5) for _ in range(2)]
+			self.assertRaises(ExecutorSaturatedException, executor.submit, release.wait, 5)
+
+			release.set()
+			for future in futures:
+				future.result(timeout=5)
+			# Slots are released as tasks finish
+			deadline = time.monotonic() + 5
+			while time.monotonic() < deadline:
+				try:
+					self.assertEqual(asyncio.run(executor.run(sum, [1, 2])), 3)
+					break
+				except ExecutorSaturatedException:
+					time.sleep(0.01)
+			else:
+				self.fail('Executor slots were not released')
+
+	def test_backtest_executor_reserve(self):
+		with BacktestExecutor(max_workers=0, max_pending=1) as executor:
+			with executor.reserve() as pool:
+				self.assertEqual(pool.submit(sum, [1, 2]).result(timeout=5), 3)
+				self.assertRaises(ExecutorSaturatedException, executor.submit, sum, [1, 2])
+			self.assertEqual(executor.submit(sum, [1, 2]).result(timeout=5), 3)
+
+
+class TestInstrumentation(SimpleTestCase):
+	def setUp(self):
+		STAGE_SECONDS.clear()
+		self.addCleanup(STAGE_SECONDS.clear)
+		self.addCleanup(instrumentation.enable, instrumentation.enabled())
+
+	def test_disabled(self):
+		instrumentation.enable(False)
+		calls = []
+		with instrumentation.collect() as timings:
+			timed('stage')(calls.append)(1)
+			with stage_timer('block'):
+				calls.append(2)
+		self.assertEqual(calls, [1, 2])
+		self.assertEqual(timings, {})
+		self.assertEqual(STAGE_SECONDS.count('stage'), 0)
+		self.assertFalse(instrumentation.collecting())
+
+	def test_collect(self):
+		instrumentation.enable()
+
+		@timed('stage')
+		def stage(value):
+			time.sleep(0.01)
+			return value
+
+		with instrumentation.collect() as timings:
+			self.assertTrue(instrumentation.collecting())
+			self.assertEqual(stage(1), 1)
+			self.assertEqual(stage(2), 2)
+			with stage_timer('block'):
+				pass
+			self.assertRaises(ZeroDivisionError, timed('error')(lambda: 1 / 0))
+			instrumentation.merge({'worker': 0.5})
+
+		# Summed per stage, and only observed once the request is done with them
+		self.assertEqual(set(timings), {'stage', 'block', 'error', 'worker'})
+		self.assertGreaterEqual(timings['stage'], 0.02)
+		self.assertEqual(timings['worker'], 0.5)
+		self.assertEqual(STAGE_SECONDS.count('stage'), 0)
+
+		# Observed at once outside of a request
+		stage(3)
+		self.assertEqual(STAGE_SECONDS.count('stage'), 1)
+
+	def test_histogram(self):
+		histogram = Histogram('test_seconds', 'Test', 'stage', buckets=(0.1, 1))
+		for seconds in [0.05, 0.5, 0.5, 5]:
+			histogram.observe('a"b', seconds)
+		self.assertEqual(histogram.count('a"b'), 4)
+		self.assertEqual(
+			histogram.render().splitlines(),
+			[
+				'# HELP test_seconds Test',
+				'# TYPE test_seconds histogram',
+				'test_seconds_bucket{stage="a\\"b",le="0.1"} 1',
+				'test_seconds_bucket{stage="a\\"b",le="1"} 3',
+				'test_seconds_bucket{stage="a\\"b",le="+Inf"} 4',
+				'test_seconds_sum{stage="a\\"b"} 6.05',
+				'test_seconds_count{stage="a\\"b"} 4',
+			],
+		)
+		self.assertEqual(server_timing({'fetch_kline': 0.0125}, 0.02), 'fetch_kline;dur=12.500, total;dur=20.000')
+
+	def test_executor_timings(self):
+		df = pd.read_csv(ORACLE_DIR / 'BTCUSDT.csv')
+		df = df.iloc[:, 0:6]
+		df.columns = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+		strategy = [
+			{'type': 'indicator', 'timeframe': '1h', 'value': {'indicator_name': 'rsi'}},
+			{'type': 'operator', 'value': '<'},
+			{'type': 'value', 'value': 30},
+		]
+		options = {
+			'capital': 10000,
+			'unit_types': ['GBP', 'BTC'],
+			'stop_loss': None,
+			'take_profit': None,
+			'trade_limit': 100,
+			'periods_per_year': 8760,
+		}
+		instrumentation.enable()
+
+		async def backtest():
+			with instrumentation.collect() as timings:
+				result = await executor.run(run_backtest, {'1h': df}, '1h', strategy, strategy, options)
+			return result, timings
+
+		# Stages timed by the worker are added to the request which submitted the backtest
+		with BacktestExecutor(max_workers=0) as executor:
+			result, timings = asyncio.run(backtest())
+		expected = run_backtest({'1h': df}, '1h', strategy, strategy, options)
+		self.assertEqual(result['final_amount'], expected['final_amount'])
+		self.assertEqual(set(timings), {'indicators', 'evaluate', 'simulate', 'analyse'})
+
+		# The indicators are timed apart from the evaluation, so the stages do not add up to more than it took
+		start = time.perf_counter()
+		with instrumentation.collect() as timings:
+			evaluate_program(compile_strategy(strategy), {'1h': df}, True)
+		self.assertLessEqual(timings['indicators'] + timings['evaluate'], time.perf_counter() - start)
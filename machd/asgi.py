@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'machd.settings')
 
 application = get_asgi_application()
+
+
+# Created once by the gunicorn master with `--preload`, before it forks the workers attaching to it.
+# Worker processes and threads are started in each worker by the hooks of `machd.gunicorn`
+from api_v2.candle_arena import CANDLE_ARENA  # noqa: E402
+
+if CANDLE_ARENA.enabled:
+	CANDLE_ARENA.create()
@@ -0,0 +1,14 @@
+"""
+Gunicorn hooks, loaded with `--config python:machd.gunicorn`.
+The master imports the application before forking its workers with `--preload`,
+so that processes and threads of the application are started in each worker instead.
+"""
+
+
+def post_worker_init(worker):
+	# The application is loaded by now, and `DJANGO_SETTINGS_MODULE` set
+	from api_v2.candle_arena import CANDLE_ARENA
+	from core.execution import BACKTEST_EXECUTOR
+
+	BACKTEST_EXECUTOR.warm()
+	CANDLE_ARENA.start()
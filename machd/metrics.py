@@ -0,0 +1,83 @@
+"""
+Per-stage timings of the requests, installed with `METRICS_ENABLED`.
+Each response has a `Server-Timing` header with the seconds spent in every stage of its request and is logged,
+while `/metrics` exposes histograms of them aggregated by the server process, in the Prometheus text format.
+"""
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from rest_framework.renderers import JSONRenderer
+
+from core import instrumentation
+from core.instrumentation import STAGE_SECONDS, Histogram, timed
+from machd.utils import log
+
+REQUEST_SECONDS = Histogram('machd_request_seconds', 'Seconds taken by the requests of each route', 'route')
+
+
+def server_timing(timings: dict[str, float], total: float) -> str:
+	"""`Server-Timing` header of the stage timings, in ms, stages run in parallel being summed"""
+	metrics = [f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in timings.items()]
+	return ', '.join([*metrics, f'total;dur={total * 1000:.3f}'])
+
+
+def render_metrics() -> str:
+	return STAGE_SECONDS.render() + REQUEST_SECONDS.render()
+
+
+class TimingMiddleware:
+	"""Collects the stage timings of each request, handling sync and async views alike"""
+
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		if iscoroutinefunction(get_response):
+			markcoroutinefunction(self)
+		instrumentation.enable()
+
+	def __call__(self, request):
+		if iscoroutinefunction(self):
+			return self.__acall(request)
+
+		start = time.perf_counter()
+		with instrumentation.collect() as timings:
+			response = self.get_response(request)
+		return self.__finish(request, response, timings, time.perf_counter() - start)
+
+	async def __acall(self, request):
+		start = time.perf_counter()
+		with instrumentation.collect() as timings:
+			response = await self.get_response(request)
+		return self.__finish(request, response, timings, time.perf_counter() - start)
+
+	def __finish(self, request, response, timings: dict[str, float], total: float):
+		for stage, seconds in timings.items():
+			STAGE_SECONDS.observe(stage, seconds)
+		# Routes rather than paths, which would give a series per id
+		route = request.resolver_match.route if request.resolver_match is not None else 'unmatched'
+		REQUEST_SECONDS.observe(route, total)
+
+		response['Server-Timing'] = server_timing(timings, total)
+		log(
+			{
+				'message': 'Request timings',
+				'method': request.method,
+				'path': request.path,
+				'route': route,
+				'status': response.status_code,
+				'seconds': round(total, 6),
+				'stages': {stage: round(seconds, 6) for stage, seconds in timings.items()},
+			}
+		)
+		return response
+
+
+class TimedJSONRenderer(JSONRenderer):
+	"""`JSONRenderer` timing the serialisation of responses"""
+
+	@timed('render')
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		return super().render(data, accepted_media_type, renderer_context)
@@ -10,11 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 import environ
 import firebase_admin
-from firebase_admin import firestore
+from firebase_admin import firestore, firestore_async
 from firebase_admin.credentials import Certificate
 
 from core.technical_analysis import TechnicalAnalysis, TechnicalAnalysisTemplate
@@ -65,6 +66,12 @@ MIDDLEWARE = [
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Stage timings of each request in a `Server-Timing` header and the logs, aggregated at /metrics
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=False)
+if METRICS_ENABLED:
+	# First, so that the timings cover the other middleware too
+	MIDDLEWARE.insert(0, 'machd.metrics.TimingMiddleware')
+
 CORS_ALLOWED_ORIGINS = env.str('CORS', 'http://localhost').split(';')
 CORS_ALLOW_CREDENTIALS = True
 
@@ -86,7 +93,10 @@ TEMPLATES = [
 	},
 ]
 
-REST_FRAMEWORK = {'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'}
+REST_FRAMEWORK = {
+	'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+	'DEFAULT_RENDERER_CLASSES': ['machd.metrics.TimedJSONRenderer', 'rest_framework.renderers.BrowsableAPIRenderer'],
+}
 SPECTACULAR_SETTINGS = {'TITLE': 'MachD API', 'SERVE_INCLUDE_SCHEMA': False}
 
 WSGI_APPLICATION = 'machd.wsgi.application'
@@ -164,8 +174,31 @@ INTERVAL_MAP = {
 	'1d': 1440,
 }
 
+# Local copy of the Firestore candles, disabled when empty
+CANDLE_STORE_DIR = Path(env.str('CANDLE_STORE_DIR')) if env.str('CANDLE_STORE_DIR', default='') else None
+CANDLE_STORE_SYNC_SECONDS = env.int('CANDLE_STORE_SYNC_SECONDS', default=60)
+
+# Candle document bucket per timeframe, 'day', 'week' or 'month', e.g. CANDLE_BUCKETS=1h=month,1d=month
+# Existing documents must be moved with the rebucket_candles command when changed
+CANDLE_BUCKETS = {timeframe: 'day' for timeframe in INTERVAL_MAP} | env.dict('CANDLE_BUCKETS', default={})
+
+# Save candle bucket documents as a single packed bytes field instead of a list of maps
+CANDLE_PACKED = env.bool('CANDLE_PACKED', default=False)
+
+# Candles of hot pairs, e.g. CANDLE_ARENA_SYMBOLS=BTCGBP;ETHGBP, shared in memory by the server processes of a host
+# through the arena of this name, disabled when empty. One process refreshes them every CANDLE_ARENA_REFRESH_SECONDS
+CANDLE_ARENA_NAME = env.str('CANDLE_ARENA_NAME', default='')
+CANDLE_ARENA_SYMBOLS = [symbol for symbol in env.str('CANDLE_ARENA_SYMBOLS', default='').split(';') if symbol != '']
+CANDLE_ARENA_REFRESH_SECONDS = env.int('CANDLE_ARENA_REFRESH_SECONDS', default=60)
+
+# Memory budget of the in-process kline cache
+KLINE_CACHE_BYTES = env.int('KLINE_CACHE_BYTES', default=256 * 1024 * 1024)
+
+# Pairs cached in process, reloaded after the TTL or kept live by a Firestore snapshot listener
+SYMBOL_REGISTRY_TTL_SECONDS = env.int('SYMBOL_REGISTRY_TTL_SECONDS', default=300)
+SYMBOL_REGISTRY_LISTEN = env.bool('SYMBOL_REGISTRY_LISTEN', default=False)
+
 GOOGLE_AUTH_EMAIL = 'https://accounts.google.com'
-GOOGLE_AUTH_URL = 'https://oauth2.googleapis.com/tokeninfo'
 GCLOUD_EMAIL = env.str('GCLOUD_EMAIL', default='')
 SERVER_API_URL = env.str('API_URL', default='')
 
@@ -191,10 +224,42 @@ if env.bool('EXCLUDE_FIRESTORE', default=False) is False:
 	}
 	firebase_admin.initialize_app(Certificate(firebase_admin_settings))
 	FIREBASE = firestore.client()
-	DB_BATCH = FIREBASE.batch()
+	FIREBASE_ASYNC = firestore_async.client()
 else:
 	FIREBASE = None
-	DB_BATCH = None
+	FIREBASE_ASYNC = None
+
+# Batches committed at once by a BatchWriter
+FIRESTORE_WRITE_WORKERS = env.int('FIRESTORE_WRITE_WORKERS', default=4)
+
+# Candle reads over long ranges are split into up to this many date partitions read concurrently,
+# each covering at least FIRESTORE_READ_MIN_BUCKETS bucket documents
+FIRESTORE_READ_PARTITIONS = env.int('FIRESTORE_READ_PARTITIONS', default=8)
+FIRESTORE_READ_MIN_BUCKETS = env.int('FIRESTORE_READ_MIN_BUCKETS', default=30)
+
+# Backtest history writes queued for a background thread before they are committed inline
+WRITE_BEHIND_QUEUE_SIZE = env.int('WRITE_BEHIND_QUEUE_SIZE', default=1000)
+# Seconds a user document is known to exist, or not, without reading it again
+USER_CACHE_TTL_SECONDS = env.int('USER_CACHE_TTL_SECONDS', default=60)
+# Verified Firebase and Google ID tokens kept until they expire, so that each is verified once
+TOKEN_CACHE_SIZE = env.int('TOKEN_CACHE_SIZE', default=10000)
+
+# Worker processes running backtests outside the server process, 0 to run them in threads of it,
+# and the backtests queued or running at once before further ones are rejected with 503
+BACKTEST_WORKERS = env.int('BACKTEST_WORKERS', default=os.cpu_count() or 1)
+BACKTEST_QUEUE_SIZE = env.int('BACKTEST_QUEUE_SIZE', default=4 * (os.cpu_count() or 1))
+
+# SQLite database of the jobs run by the run_job_workers command, which must be on the host of the server
+JOB_QUEUE_PATH = Path(env.str('JOB_QUEUE_PATH', default=str(BASE_DIR / 'jobs.sqlite3')))
+JOB_WORKERS = env.int('JOB_WORKERS', default=2)
+# Jobs of a user run at once, and queued or running before further ones are rejected
+JOB_USER_CONCURRENCY = env.int('JOB_USER_CONCURRENCY', default=1)
+JOB_USER_PENDING = env.int('JOB_USER_PENDING', default=20)
+# Seconds finished jobs are kept for their results
+JOB_RETENTION_SECONDS = env.int('JOB_RETENTION_SECONDS', default=7 * 24 * 60 * 60)
+JOB_POLL_SECONDS = env.float('JOB_POLL_SECONDS', default=1)
+# Seconds a stopping worker has to finish its job before it is killed and the job queued again
+JOB_SHUTDOWN_SECONDS = env.int('JOB_SHUTDOWN_SECONDS', default=30)
 
 
 TA = TechnicalAnalysis()
@@ -25,4 +25,5 @@ urlpatterns = [
 	path('schema/', SpectacularAPIView.as_view(), name='schema'),  # OpenAPI schema
 	path('documentations/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),  # Swagger UI
 	path('healthz/', views.Health.as_view(), name='health'),
+	path('metrics', views.Metrics.as_view(), name='metrics'),  # Default path scraped by Prometheus
 ]
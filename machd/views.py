@@ -1,8 +1,19 @@
+from django.http import HttpResponse
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from core import instrumentation
+from machd.metrics import render_metrics
+
 
 class Health(APIView):
 	def get(self, request: Request):
 		return Response('Server is Live!')
+
+
+class Metrics(APIView):
+	def get(self, request: Request):
+		if not instrumentation.enabled():
+			return Response({'error': 'Metrics are disabled'}, 404)
+		return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')